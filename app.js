@@ -204,8 +204,8 @@ async function imageToBase64(url) {
     }
 }
 
-// Load template HTML with CSS and images inlined
-async function loadTemplate() {
+// Load template HTML, CSS and logo
+async function loadTemplateAssets() {
     try {
         // Load HTML, CSS, and logo
         const [htmlResponse, cssResponse, logoResponse] = await Promise.all([
@@ -231,21 +231,7 @@ async function loadTemplate() {
             });
         }
         
-        // Replace the CSS link with inline style
-        let htmlWithInlineCSS = htmlText.replace(
-            /<link[^>]*rel=["']stylesheet["'][^>]*href=["']trec_styles\.css["'][^>]*>/gi,
-            `<style>${cssText}</style>`
-        );
-        
-        // Replace logo image with base64 if available
-        if (logoBase64) {
-            htmlWithInlineCSS = htmlWithInlineCSS.replace(
-                /<img([^>]*?)src=["']logo\.png["']([^>]*?)>/gi,
-                `<img$1src="${logoBase64}"$2>`
-            );
-        }
-        
-        return htmlWithInlineCSS;
+        return { htmlText, cssText, logoBase64 };
     } catch (error) {
         // Check if it's a CORS error
         if (error.message.includes('CORS') || error.message.includes('fetch')) {
@@ -259,6 +245,44 @@ async function loadTemplate() {
     }
 }
 
+// Inline the CSS and logo so the HTML can be previewed from a blob URL
+function inlineAssets(htmlText, assets) {
+    // Replace the CSS link with inline style
+    let htmlWithInlineCSS = htmlText.replace(
+        /<link[^>]*rel=["']stylesheet["'][^>]*href=["']trec_styles\.css["'][^>]*>/gi,
+        `<style>${assets.cssText}</style>`
+    );
+    
+    // Replace logo image with base64 if available
+    if (assets.logoBase64) {
+        htmlWithInlineCSS = htmlWithInlineCSS.replace(
+            /<img([^>]*?)src=["']logo\.png["']([^>]*?)>/gi,
+            `<img$1src="${assets.logoBase64}"$2>`
+        );
+    }
+    
+    return htmlWithInlineCSS;
+}
+
+// Populate the report on the server (POST /render); null if unavailable
+async function renderOnServer(data) {
+    try {
+        const response = await fetch('/render', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(data)
+        });
+        if (!response.ok) {
+            console.warn('Server render failed (' + response.status + '), filling in the browser');
+            return null;
+        }
+        return await response.text();
+    } catch (error) {
+        console.warn('Server render unavailable, filling in the browser:', error);
+        return null;
+    }
+}
+
 // Generate filled report
 async function generateReport() {
     if (!inspectionData) {
@@ -281,8 +305,8 @@ async function generateReport() {
         loadingText.textContent = 'Loading TREC template...';
         await sleep(500);
 
-        const template = await loadTemplate();
-        if (!template) {
+        const assets = await loadTemplateAssets();
+        if (!assets) {
             updateStatus('template', 'error');
             return;
         }
@@ -295,28 +319,37 @@ async function generateReport() {
         updateStatus('fill', 'loading');
         updateProgress(40);
         loadingText.textContent = 'Filling template with inspection data...';
-        await sleep(800);
 
-        // Create DOM parser
-        const parser = new DOMParser();
-        const doc = parser.parseFromString(template, 'text/html');
+        // Prefer the server-side populator; fall back to filling in the browser
+        let filledHtmlContent;
+        const serverHtml = await renderOnServer(inspectionData);
+        if (serverHtml) {
+            filledHtmlContent = inlineAssets(serverHtml, assets);
+            updateProgress(90);
+        } else {
+            await sleep(800);
 
-        updateProgress(50);
+            // Create DOM parser
+            const parser = new DOMParser();
+            const doc = parser.parseFromString(inlineAssets(assets.htmlText, assets), 'text/html');
 
-        // Populate header
-        populateHeader(doc, inspectionData);
-        updateProgress(60);
+            updateProgress(50);
 
-        // Populate sections
-        populateSections(doc, inspectionData);
-        updateProgress(80);
+            // Populate header
+            populateHeader(doc, inspectionData);
+            updateProgress(60);
 
-        // Update page numbers
-        updatePageNumbers(doc);
-        updateProgress(90);
+            // Populate sections
+            populateSections(doc, inspectionData);
+            updateProgress(80);
 
-        // Get filled HTML
-        const filledHtmlContent = '<!DOCTYPE html>\n' + doc.documentElement.outerHTML;
+            // Update page numbers
+            updatePageNumbers(doc);
+            updateProgress(90);
+
+            // Get filled HTML
+            filledHtmlContent = '<!DOCTYPE html>\n' + doc.documentElement.outerHTML;
+        }
 
         await sleep(500);
         updateStatus('fill', 'success');
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TREC Populator Benchmark
+Times CompleteTRECPopulator phase by phase (load, header, sections, prune,
+save) on synthetic inspections scaled up from inspection.json, and reports
+throughput and peak memory as JSON so results can be compared across versions.
+
+Usage:
+    python benchmark_trec.py --scales 1 10 100 --output bench.json
+    python benchmark_trec.py --scales 10 --comments 2 --photos 3 --repeat 5
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from populate_trec_complete import CompleteTRECPopulator, RENDER_CODE_FILES, file_digest, select_parser
+
+try:
+    import resource  # Unix only; without it the report has no max_rss
+except ImportError:
+    resource = None
+
+PHASES = ('load', 'header', 'sections', 'prune', 'save')
+DEFAULT_SCALES = (1, 10, 100)
+
+
+class Workload(NamedTuple):
+    """How much the base inspection is multiplied by"""
+    line_items: int = 1  # Copies of every line item within its section
+    sections: int = 1    # Copies of every section
+    comments: int = 1    # Copies of every comment within its line item
+    photos: int = 1      # Copies of every photo within its comment
+
+
+def _copy_id(value: Any, suffix: str) -> Any:
+    return f"{value}{suffix}" if value else value
+
+
+def _copy_url(url: Optional[str], suffix: str) -> Optional[str]:
+    # A distinct URL per copy, so no copy is deduplicated away as the same file
+    if not url or not suffix:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}copy={suffix.lstrip('-')}"
+
+
+def scale_inspection(data: Dict[str, Any], workload: Workload) -> Dict[str, Any]:
+    """Synthetic inspection with the shape of ``data``, multiplied per ``workload``
+
+    Copies keep their names (so they map to the same TREC items and exercise
+    the "Additional Finding" path) but get distinct ids and media URLs. The
+    result is deterministic for a given input and workload.
+    """
+    def scale_photos(photos, suffix):
+        return [dict(photo, id=_copy_id(photo.get('id'), f"{suffix}-p{n}" if n else suffix),
+                     url=_copy_url(photo.get('url'), f"{suffix}-p{n}" if n else suffix))
+                for photo in photos or [] for n in range(workload.photos)]
+
+    def scale_comments(comments, suffix):
+        scaled = []
+        for comment in comments or []:
+            for n in range(workload.comments):
+                copy_suffix = f"{suffix}-c{n}" if n else suffix
+                scaled.append(dict(comment, id=_copy_id(comment.get('id'), copy_suffix),
+                                   photos=scale_photos(comment.get('photos'), copy_suffix),
+                                   videos=[dict(video, url=_copy_url(video.get('url'), copy_suffix))
+                                           for video in comment.get('videos') or []]))
+        return scaled
+
+    def scale_line_items(line_items, suffix):
+        scaled = []
+        for line_item in line_items or []:
+            for n in range(workload.line_items):
+                copy_suffix = f"{suffix}-l{n}" if n else suffix
+                scaled.append(dict(line_item, id=_copy_id(line_item.get('id'), copy_suffix),
+                                   comments=scale_comments(line_item.get('comments'), copy_suffix)))
+        return scaled
+
+    result = copy.copy(data)
+    inspection = result['inspection'] = dict(data.get('inspection', {}))
+    sections = []
+    for n in range(workload.sections):
+        suffix = f"-s{n}" if n else ''
+        for section in data.get('inspection', {}).get('sections') or []:
+            sections.append(dict(section, id=_copy_id(section.get('id'), suffix),
+                                 lineItems=scale_line_items(section.get('lineItems'), suffix)))
+    inspection['sections'] = sections
+    return result
+
+
+def count_workload(data: Dict[str, Any]) -> Dict[str, int]:
+    """Sections, line items, comments and photos in an inspection payload"""
+    counts = {'sections': 0, 'line_items': 0, 'comments': 0, 'photos': 0}
+    for section in data.get('inspection', {}).get('sections') or []:
+        counts['sections'] += 1
+        for line_item in section.get('lineItems') or []:
+            counts['line_items'] += 1
+            for comment in line_item.get('comments') or []:
+                counts['comments'] += 1
+                counts['photos'] += len(comment.get('photos') or [])
+    return counts
+
+
+def run_phases(html_template: str, inspection_path: str, output_path: str,
+               clock: Callable[[], float] = time.perf_counter) -> Dict[str, float]:
+    """Populate and save one report, returning seconds per phase"""
+    timings = {}
+    start = clock()
+    populator = CompleteTRECPopulator(html_template, inspection_path)
+    timings['load'] = clock() - start
+    for phase, step in (('header', populator.populate_header_fields),
+                        ('sections', populator.populate_all_sections),
+                        ('prune', populator.remove_empty_sections),
+                        ('save', lambda: populator.save(output_path))):
+        start = clock()
+        step()
+        timings[phase] = clock() - start
+    return timings
+
+
+def peak_memory(html_template: str, inspection_path: str, output_path: str) -> int:
+    """Peak bytes allocated by Python while populating one report"""
+    tracemalloc.start()
+    try:
+        run_phases(html_template, inspection_path, output_path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(html_template: str, base: Dict[str, Any], workload: Workload,
+              repeat: int, work_dir: str) -> Dict[str, Any]:
+    """Benchmark one workload: per-phase timings over ``repeat`` runs, then memory"""
+    data = scale_inspection(base, workload)
+    inspection_path = os.path.join(work_dir, 'inspection.json')
+    output_path = os.path.join(work_dir, 'report.html')
+    with open(inspection_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    counts = count_workload(data)
+    del data
+
+    runs = [run_phases(html_template, inspection_path, output_path) for _ in range(repeat)]
+    phases = {}
+    for phase in PHASES:
+        samples = [run[phase] for run in runs]
+        phases[phase] = {'median_ms': statistics.median(samples) * 1000,
+                         'min_ms': min(samples) * 1000,
+                         'max_ms': max(samples) * 1000}
+    totals = [sum(run.values()) for run in runs]
+    total = statistics.median(totals)
+    # Traced separately: tracemalloc would distort the timings above
+    peak = peak_memory(html_template, inspection_path, output_path)
+    return {
+        'workload': workload._asdict(),
+        'counts': counts,
+        'input_bytes': os.path.getsize(inspection_path),
+        'output_bytes': os.path.getsize(output_path),
+        'phases': phases,
+        'total_ms': {'median': total * 1000, 'min': min(totals) * 1000, 'max': max(totals) * 1000},
+        'throughput': {
+            'line_items_per_s': counts['line_items'] / total if total else None,
+            'photos_per_s': counts['photos'] / total if total else None,
+            'output_mb_per_s': os.path.getsize(output_path) / 1e6 / total if total else None,
+        },
+        'peak_traced_bytes': peak,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """What the results were measured with, to compare runs across versions"""
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=code_dir, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    try:
+        import bs4
+        bs4_version = bs4.__version__
+    except ImportError:
+        bs4_version = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'code_digests': {name: file_digest(os.path.join(code_dir, name)) for name in RENDER_CODE_FILES},
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'beautifulsoup4': bs4_version,
+        'parser': select_parser() if bs4_version else None,
+    }
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"{'Scale':>6} {'Items':>7} {'Photos':>7} " + ' '.join(f"{p + ' ms':>11}" for p in PHASES)
+          + f" {'Total ms':>10} {'Items/s':>9} {'Peak MB':>8}")
+    print("-" * 120)
+    for result in results:
+        print(f"{result['workload']['line_items']:>6} {result['counts']['line_items']:>7} "
+              f"{result['counts']['photos']:>7} "
+              + ' '.join(f"{result['phases'][p]['median_ms']:>11.1f}" for p in PHASES)
+              + f" {result['total_ms']['median']:>10.1f}"
+              f" {result['throughput']['line_items_per_s']:>9.0f}"
+              f" {result['peak_traced_bytes'] / 1e6:>8.1f}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the TREC populator on synthetic inspections")
+    parser.add_argument('--template', default="TREC_Report_All.html", help="TREC HTML template")
+    parser.add_argument('--inspection', default="inspection.json",
+                        help="Inspection JSON whose shape the synthetic inspections copy")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES),
+                        help="Line-item multipliers to benchmark (up to 100x inspection.json)")
+    parser.add_argument('--sections', type=int, default=1, help="Section multiplier")
+    parser.add_argument('--comments', type=int, default=1, help="Comments multiplier")
+    parser.add_argument('--photos', type=int, default=1, help="Photos-per-comment multiplier")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per scale (median is reported)")
+    parser.add_argument('--output', metavar='JSON', help="Write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main() -> int:
+    args = parse_args()
+    with open(args.inspection, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='trec-bench-') as work_dir:
+        for scale in args.scales:
+            workload = Workload(line_items=scale, sections=args.sections,
+                                comments=args.comments, photos=args.photos)
+            print(f"Benchmarking {workload}...", file=sys.stderr)
+            results.append(benchmark(args.template, base, workload, max(1, args.repeat), work_dir))
+
+    print_results(results)
+    report = {
+        'environment': environment(),
+        'template': os.path.abspath(args.template),
+        'base_inspection': os.path.abspath(args.inspection),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        report['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
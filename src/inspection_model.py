@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inspection Data Model
+Compact, immutable records for an inspection, built once from the raw
+inspection.json payload by a single normalization pass.
+"""
+from typing import Dict, Any, Iterable, NamedTuple, Optional, Tuple
+
+
+class MediaRef(NamedTuple):
+    """A photo or video attached to a comment or line item"""
+    id: str
+    url: str
+    caption: str
+    thumbnail: str
+    width: Optional[int]
+    height: Optional[int]
+    content_type: str = ''  # MIME type when the payload gives one, e.g. 'video/mp4'
+
+
+class Comment(NamedTuple):
+    id: str
+    text: str
+    location: str
+    order: float
+    photos: Tuple[MediaRef, ...]
+    videos: Tuple[MediaRef, ...]
+    updated_at: Any
+
+
+class LineItem(NamedTuple):
+    id: str
+    name: str
+    status: Optional[str]
+    comments: Tuple[Comment, ...]
+    media: Tuple[MediaRef, ...]
+    updated_at: Any
+
+
+class Section(NamedTuple):
+    id: str
+    name: str
+    line_items: Tuple[LineItem, ...]
+
+
+class Inspection(NamedTuple):
+    """Header fields plus sections (empty when sections are streamed)"""
+    id: str
+    client_name: str
+    inspection_date: Any
+    address: str
+    inspector_name: str
+    inspector_license: str
+    sponsor_name: str
+    sponsor_license: str
+    updated_at: Any
+    sections: Tuple[Section, ...]
+
+
+class StringPool:
+    """Deduplicates equal strings within one inspection
+
+    Comment text is repeated across ``text``/``content``/``commentText`` and
+    between comments; pooling keeps a single instance of each value.
+    """
+
+    def __init__(self):
+        self._strings: Dict[str, str] = {}
+
+    def __call__(self, value: Any) -> str:
+        if value is None:
+            return ''
+        if not isinstance(value, str):
+            value = str(value)
+        return self._strings.setdefault(value, value)
+
+
+def normalize_order(value: Any) -> float:
+    """Comment sort key: a JSON number or numeric string, 0 when missing
+
+    Raises ValueError for anything else, so mixed or non-numeric orders are
+    rejected here rather than failing when comments are sorted.
+    """
+    if value is None or value == '':
+        return 0
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    raise ValueError(f"Comment 'order' must be a number, not {value!r}")
+
+
+def normalize_dimension(value: Any) -> Optional[int]:
+    """A positive pixel size, or None when the payload's value is unusable"""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return value if value > 0 else None
+
+
+def normalize_status(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    raise ValueError(f"Line item 'inspectionStatus' must be a string, not {value!r}")
+
+
+def normalize_media(raw: Dict[str, Any], pool: StringPool) -> MediaRef:
+    return MediaRef(
+        id=pool(raw.get('id')),
+        url=pool(raw.get('url')),
+        caption=pool(raw.get('caption') or raw.get('description')),
+        thumbnail=pool(raw.get('thumbnail') or raw.get('thumbnailUrl')),
+        width=normalize_dimension(raw.get('width')),
+        height=normalize_dimension(raw.get('height')),
+        content_type=pool(raw.get('fileType') or raw.get('contentType') or raw.get('mimeType')),
+    )
+
+
+def normalize_comment(raw: Dict[str, Any], pool: StringPool) -> Comment:
+    text = raw.get('text') or raw.get('commentText') or raw.get('value') or ''
+    return Comment(
+        id=pool(raw.get('id')),
+        text=pool(text),
+        location=pool((raw.get('location') or '').strip()),
+        order=normalize_order(raw.get('order')),
+        photos=tuple(normalize_media(p, pool) for p in raw.get('photos') or ()),
+        videos=tuple(normalize_media(v, pool) for v in raw.get('videos') or ()),
+        updated_at=raw.get('updatedAt'),
+    )
+
+
+def normalize_line_item(raw: Dict[str, Any], pool: StringPool) -> LineItem:
+    return LineItem(
+        id=pool(raw.get('id')),
+        name=pool(raw.get('name', '')),
+        status=normalize_status(raw.get('inspectionStatus')),
+        comments=tuple(normalize_comment(c, pool) for c in raw.get('comments') or ()),
+        media=tuple(normalize_media(m, pool) for m in raw.get('media') or ()),
+        updated_at=raw.get('updatedAt'),
+    )
+
+
+def normalize_section(raw: Dict[str, Any], pool: StringPool,
+                      line_items: Optional[Iterable[LineItem]] = None) -> Section:
+    if line_items is None:
+        line_items = (normalize_line_item(li, pool) for li in raw.get('lineItems') or ())
+    return Section(
+        id=pool(raw.get('id')),
+        name=pool(raw.get('name', '')),
+        line_items=tuple(line_items),
+    )
+
+
+def normalize_header(data: Dict[str, Any], sections: Iterable[Section] = ()) -> Inspection:
+    """Build the Inspection record from the top-level payload"""
+    inspection = data.get('inspection', {})
+    client_info = inspection.get('clientInfo', {})
+    inspector = inspection.get('inspector', {})
+    account = data.get('account', {}) or {}
+    return Inspection(
+        id=inspection.get('id', ''),
+        client_name=client_info.get('name', ''),
+        inspection_date=inspection.get('schedule', {}).get('date'),
+        address=inspection.get('address', {}).get('fullAddress', ''),
+        inspector_name=inspector.get('name', ''),
+        inspector_license=inspector.get('id', ''),
+        # Fall back to the account name when there is no company name
+        sponsor_name=account.get('companyName', '') or account.get('name', ''),
+        sponsor_license=account.get('id', ''),
+        updated_at=inspection.get('updatedAt'),
+        sections=tuple(sections),
+    )
+
+
+def normalize_inspection(data: Dict[str, Any]) -> Inspection:
+    """Normalize a raw inspection.json payload into an Inspection"""
+    pool = StringPool()
+    sections = (normalize_section(s, pool) for s in data.get('inspection', {}).get('sections') or ())
+    return normalize_header(data, sections)
+
+
+def iter_line_items(inspection: Inspection) -> Iterable[LineItem]:
+    for section in inspection.sections:
+        yield from section.line_items
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming Inspection Loader
+Walks inspection.sections[].lineItems[] incrementally so memory is bounded by
+one section rather than the whole document, normalizing each line item into
+the compact inspection model as soon as it is read.
+"""
+import json
+from typing import Dict, Any, Iterator, Optional, TextIO
+
+from inspection_model import (
+    Inspection,
+    Section,
+    StringPool,
+    normalize_header,
+    normalize_line_item,
+    normalize_section,
+)
+
+# Inspection fields needed for the header; everything else is skipped
+INSPECTION_FIELDS = ('id', 'schedule', 'clientInfo', 'address', 'inspector', 'updatedAt')
+
+WHITESPACE = ' \t\n\r'
+
+
+class InspectionStream:
+    """Incremental parser for an inspection JSON document
+
+    ``iter_sections()`` yields normalized sections as they are read. Header
+    fields outside ``inspection.sections`` (including ``account``, which
+    follows the sections) are collected into ``data``; ``inspection()`` is
+    complete once the iteration finishes.
+    """
+
+    def __init__(self, fileobj: TextIO, chunk_size: int = 64 * 1024):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.data: Dict[str, Any] = {'inspection': {}}
+        self.pool = StringPool()
+
+    # -- low level reading ---------------------------------------------------
+
+    def _fill(self, min_size: Optional[int] = None) -> bool:
+        """Read another chunk; returns False at end of input"""
+        if self.eof:
+            return False
+        if self.pos:
+            # Drop consumed input so the buffer only holds the current value
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.fileobj.read(max(self.chunk_size, min_size or 0))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise json.JSONDecodeError("Unexpected end of input", self.buffer, self.pos)
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def _decode_value(self) -> Any:
+        """Decode the next complete JSON value, reading more input as needed"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Grow geometrically so large values aren't re-scanned many times
+                if not self._fill(len(self.buffer)):
+                    raise
+                continue
+            # A number ending exactly at the buffer edge may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _iter_object_keys(self) -> Iterator[str]:
+        """Yield the keys of the object starting here; the caller consumes each value"""
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(':')
+            yield key
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect('}')
+            return
+
+    def _iter_array(self) -> Iterator[None]:
+        """Yield once per element of the array starting here; the caller consumes each element"""
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect(']')
+            return
+
+    # -- document structure --------------------------------------------------
+
+    def _read_section(self) -> Section:
+        fields: Dict[str, Any] = {}
+        line_items = []
+        for key in self._iter_object_keys():
+            if key == 'lineItems':
+                for _ in self._iter_array():
+                    line_items.append(normalize_line_item(self._decode_value(), self.pool))
+            elif key in ('id', 'name'):
+                fields[key] = self._decode_value()
+            else:
+                self._decode_value()
+        return normalize_section(fields, self.pool, line_items)
+
+    def _iter_inspection(self) -> Iterator[Section]:
+        inspection = self.data['inspection']
+        for key in self._iter_object_keys():
+            if key == 'sections':
+                for _ in self._iter_array():
+                    yield self._read_section()
+            elif key in INSPECTION_FIELDS:
+                inspection[key] = self._decode_value()
+            else:
+                self._decode_value()
+
+    def iter_sections(self) -> Iterator[Section]:
+        """Yield normalized sections one at a time"""
+        try:
+            for key in self._iter_object_keys():
+                if key == 'inspection':
+                    yield from self._iter_inspection()
+                else:
+                    self.data[key] = self._decode_value()
+        finally:
+            self.fileobj.close()
+
+    def inspection(self) -> Inspection:
+        """Header-only Inspection from the fields read so far"""
+        return normalize_header(self.data)
+
+    def load(self) -> Inspection:
+        """Read the whole document into an Inspection"""
+        sections = list(self.iter_sections())
+        return normalize_header(self.data, sections)
+
+
+def open_inspection_stream(path: str) -> InspectionStream:
+    """Open an inspection JSON file for streaming"""
+    return InspectionStream(open(path, 'r', encoding='utf-8'))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instrumentation
+Lightweight timers and counters for the populator, exported as JSON or in the
+Prometheus text exposition format.
+"""
+import json
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+METRICS_FORMATS = ('json', 'prometheus')
+
+# (metric name, sorted (label, value) pairs)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def metric_key(name: str, labels: Optional[Dict[str, str]] = None) -> MetricKey:
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+class _Timer:
+    """Context manager adding its elapsed time to a Metrics timer"""
+    __slots__ = ('metrics', 'key', 'start')
+
+    def __init__(self, metrics: 'Metrics', key: MetricKey):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Named timers (call count and total seconds) and counters, with optional labels"""
+
+    def __init__(self):
+        self.timers: Dict[MetricKey, list] = {}
+        self.counters: Dict[MetricKey, int] = {}
+
+    def timer(self, name: str, **labels: str) -> _Timer:
+        """``with metrics.timer('header'):`` times the block"""
+        return _Timer(self, metric_key(name, labels))
+
+    def add_time(self, key: MetricKey, seconds: float) -> None:
+        entry = self.timers.get(key)
+        if entry is None:
+            self.timers[key] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, name: str, amount: int = 1, **labels: str) -> None:
+        key = metric_key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    # -- aggregation ---------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, list]:
+        """Picklable, JSON-ready copy, e.g. to send from a worker process"""
+        return {
+            'timers': [{'name': name, 'labels': dict(labels), 'count': count, 'seconds': seconds}
+                       for (name, labels), (count, seconds) in sorted(self.timers.items())],
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(self.counters.items())],
+        }
+
+    def merge(self, snapshot: Dict[str, list]) -> None:
+        """Add another Metrics' snapshot into this one"""
+        for timer in snapshot.get('timers', ()):
+            key = metric_key(timer['name'], timer['labels'])
+            entry = self.timers.setdefault(key, [0, 0.0])
+            entry[0] += timer['count']
+            entry[1] += timer['seconds']
+        for counter in snapshot.get('counters', ()):
+            key = metric_key(counter['name'], counter['labels'])
+            self.counters[key] = self.counters.get(key, 0) + counter['value']
+
+    # -- export --------------------------------------------------------------
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'trec_populator') -> str:
+        """Prometheus text format: ``*_seconds_total``/``*_calls_total`` per timer, ``*_total`` per counter"""
+        lines = []
+
+        def emit(metric: str, kind: str, help_text: str, samples: Iterable[Tuple[Tuple, float]]):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                value_text = repr(value) if isinstance(value, float) else str(value)
+                lines.append(f"{metric}{{{label_text}}} {value_text}" if label_text else f"{metric} {value_text}")
+
+        for name in sorted({name for name, _ in self.timers}):
+            samples = [(labels, entry) for (n, labels), entry in sorted(self.timers.items()) if n == name]
+            emit(f"{prefix}_{name}_seconds_total", 'counter', f"Seconds spent in {name}",
+                 [(labels, seconds) for labels, (_, seconds) in samples])
+            emit(f"{prefix}_{name}_calls_total", 'counter', f"Times {name} was timed",
+                 [(labels, count) for labels, (count, _) in samples])
+        for name in sorted({name for name, _ in self.counters}):
+            emit(f"{prefix}_{name}_total", 'counter', name.replace('_', ' ').capitalize(),
+                 [(labels, value) for (n, labels), value in sorted(self.counters.items()) if n == name])
+        return '\n'.join(lines) + '\n'
+
+    def render(self, output_format: str) -> str:
+        return self.to_prometheus() if output_format == 'prometheus' else self.to_json()
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
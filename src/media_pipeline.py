@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Media Pipeline
+Resolves the photos and videos referenced by an inspection into a local,
+content-hashed cache: files are fetched concurrently, photos are reduced to
+report-sized thumbnails, and the inspection is rewritten to reference the
+cached files instead of the full-resolution originals.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from typing import Dict, Any, Iterable, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+from inspection_model import Inspection, Section, MediaRef
+
+# Pillow and urllib.request are imported when media is first processed, so
+# importing this module (and the populator) stays cheap
+HAS_PIL = find_spec('PIL') is not None
+
+# Twice the 250x200 the report CSS displays, so photos stay sharp on HiDPI screens
+THUMBNAIL_SIZE = (500, 400)
+THUMBNAIL_QUALITY = 82
+DEFAULT_FETCH_WORKERS = 8
+FETCH_TIMEOUT = 30
+COPY_CHUNK = 256 * 1024
+RESOLVED_URLS = 4096  # URL records kept in memory; older ones are reloaded from urls/
+
+
+class CachedMedia(NamedTuple):
+    """A media file resolved into the cache (paths relative to the cache root)"""
+    url: str
+    original: str
+    thumbnail: str  # Same as original for videos, or when thumbnails are unavailable
+    content_type: str
+    width: Optional[int]
+    height: Optional[int]
+
+
+def is_within(path: str, root: str) -> bool:
+    """Whether real path ``path`` is ``root`` or inside it"""
+    root = os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def open_media(url: str, timeout: float = FETCH_TIMEOUT, local_roots: Sequence[str] = ()):
+    """Open a media URL for reading: http(s), file:// or a local path
+
+    Media URLs come from the inspection payload, so file:// URLs and local
+    paths only open files inside one of ``local_roots`` (none by default).
+    """
+    from urllib.request import url2pathname, urlopen
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme in ('http', 'https'):
+        return urlopen(url, timeout=timeout)
+    if parsed.scheme == 'file':
+        path = url2pathname(parsed.path)
+    elif parsed.scheme == '' or len(parsed.scheme) == 1:  # Plain or Windows drive path
+        path = url
+    else:
+        raise ValueError(f"Unsupported media URL scheme: {parsed.scheme}")
+    real_path = os.path.realpath(path)
+    if not any(is_within(real_path, root) for root in local_roots):
+        raise PermissionError(f"Local media outside the allowed directories: {url}")
+    return open(real_path, 'rb')
+
+
+def guess_extension(url: str, content_type: Optional[str]) -> str:
+    ext = os.path.splitext(urllib.parse.urlparse(url).path)[1].lower()
+    if ext and len(ext) <= 5:
+        return ext
+    return mimetypes.guess_extension(content_type or '') or '.bin'
+
+
+class MediaStore:
+    """Content-hashed local cache of inspection media
+
+    Layout under ``cache_dir``:
+      objects/ab/<sha256><ext>       originals, named by content hash
+      thumbs/<sha256>_<W>x<H>.jpg    report-sized photo thumbnails
+      urls/<sha256 of url>.json      URL -> CachedMedia, so URLs are fetched once
+
+    Every file is written atomically, so processes can share one cache.
+    Local paths and file:// URLs are only copied from ``local_roots``.
+    """
+
+    def __init__(self, cache_dir: str, workers: int = DEFAULT_FETCH_WORKERS,
+                 thumbnail_size: Tuple[int, int] = THUMBNAIL_SIZE,
+                 timeout: float = FETCH_TIMEOUT, local_roots: Sequence[str] = ()):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.workers = workers
+        self.thumbnail_size = tuple(thumbnail_size)
+        self.timeout = timeout
+        self.local_roots = tuple(os.path.abspath(root) for root in local_roots)
+        self.resolved: 'OrderedDict[str, CachedMedia]' = OrderedDict()
+        self.failures: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        for subdir in ('objects', 'thumbs', 'urls'):
+            os.makedirs(os.path.join(self.cache_dir, subdir), exist_ok=True)
+
+    def config(self) -> Dict[str, Any]:
+        """Constructor arguments, to open the same cache in another process"""
+        return {'cache_dir': self.cache_dir, 'workers': self.workers,
+                'thumbnail_size': self.thumbnail_size, 'timeout': self.timeout,
+                'local_roots': self.local_roots}
+
+    # -- cache files ---------------------------------------------------------
+
+    def _url_record_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, 'urls', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _load_url_record(self, url: str) -> Optional[CachedMedia]:
+        try:
+            with open(self._url_record_path(url), 'r', encoding='utf-8') as f:
+                media = CachedMedia(**json.load(f))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+        # The record is only good while the files it points at still exist
+        if all(os.path.exists(os.path.join(self.cache_dir, p)) for p in (media.original, media.thumbnail)):
+            return media
+        return None
+
+    def _save_url_record(self, media: CachedMedia) -> None:
+        path = self._url_record_path(media.url)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(media._asdict(), f)
+        os.replace(tmp_path, path)
+
+    def _download(self, url: str) -> Tuple[str, str, str]:
+        """Stream a URL into objects/; returns (sha256, relative path, content type)"""
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.cache_dir, 'objects', f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open_media(url, self.timeout, self.local_roots) as source, open(tmp_path, 'wb') as out:
+                headers = getattr(source, 'headers', None)
+                content_type = (headers.get_content_type() if headers is not None
+                                else mimetypes.guess_type(url)[0]) or 'application/octet-stream'
+                while True:
+                    chunk = source.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+            sha = digest.hexdigest()
+            relative = os.path.join('objects', sha[:2], sha + guess_extension(url, content_type))
+            path = os.path.join(self.cache_dir, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(tmp_path)  # Same content already cached (e.g. under another URL)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            # Don't leave a partial download behind in objects/
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha, relative, content_type
+
+    def _thumbnail(self, sha: str, original: str) -> Tuple[str, Optional[int], Optional[int]]:
+        """Report-sized JPEG for a photo; falls back to the original without Pillow"""
+        if not HAS_PIL:
+            return original, None, None
+        from PIL import Image, ImageOps
+        width, height = self.thumbnail_size
+        relative = os.path.join('thumbs', f"{sha}_{width}x{height}.jpg")
+        path = os.path.join(self.cache_dir, relative)
+        with Image.open(os.path.join(self.cache_dir, original)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((width, height))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                image.save(tmp_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+                os.replace(tmp_path, path)
+            return relative, image.width, image.height
+
+    def _resolve_one(self, url: str) -> CachedMedia:
+        media = self._load_url_record(url)
+        if media is None:
+            sha, original, content_type = self._download(url)
+            thumbnail, width, height = original, None, None
+            if content_type.startswith('image/'):
+                try:
+                    thumbnail, width, height = self._thumbnail(sha, original)
+                except OSError:
+                    pass  # Not decodable: reference the original
+            media = CachedMedia(url, original, thumbnail, content_type, width, height)
+            self._save_url_record(media)
+        return media
+
+    # -- public API ----------------------------------------------------------
+
+    def resolve(self, urls: Iterable[str]) -> Dict[str, CachedMedia]:
+        """Resolve URLs into the cache, fetching the missing ones concurrently
+
+        URLs that cannot be fetched are left out of the result and recorded in
+        ``failures``. Only the most recently used RESOLVED_URLS records are kept
+        in ``resolved``; the rest are reloaded from the cache when needed.
+        """
+        urls = [url for url in dict.fromkeys(urls) if url]
+        found: Dict[str, CachedMedia] = {}
+        with self.lock:
+            for url in urls:
+                media = self.resolved.get(url)
+                if media is not None:
+                    self.resolved.move_to_end(url)
+                    found[url] = media
+        pending = [url for url in urls if url not in found]
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(pending)))) as executor:
+                futures = [(url, executor.submit(self._resolve_one, url)) for url in pending]
+                for url, future in futures:
+                    try:
+                        media = future.result()
+                    except Exception as e:
+                        with self.lock:
+                            self.failures[url] = f"{type(e).__name__}: {e}"
+                        continue
+                    found[url] = media
+                    with self.lock:
+                        self.resolved[url] = media
+                        if len(self.resolved) > RESOLVED_URLS:
+                            self.resolved.popitem(last=False)
+        return {url: found[url] for url in urls if url in found}
+
+    def reference(self, relative: str, base_dir: str) -> str:
+        """URL for a cached file as seen from a report written to ``base_dir``"""
+        path = os.path.relpath(os.path.join(self.cache_dir, relative), os.path.abspath(base_dir))
+        return urllib.parse.quote(path.replace(os.sep, '/'))
+
+    def localize_media(self, media: MediaRef, base_dir: str, resolved: Dict[str, CachedMedia]) -> MediaRef:
+        cached = resolved.get(media.url)
+        if cached is None:
+            return media
+        return media._replace(
+            url=self.reference(cached.thumbnail, base_dir),
+            thumbnail=self.reference(cached.thumbnail, base_dir),
+            width=cached.width if cached.width is not None else media.width,
+            height=cached.height if cached.height is not None else media.height,
+        )
+
+    def localize_section(self, section: Section, base_dir: str, resolved: Dict[str, CachedMedia]) -> Section:
+        """Section with media pointing at cached files (``resolved`` as returned by resolve())"""
+        line_items = []
+        for line_item in section.line_items:
+            comments = tuple(
+                comment._replace(photos=tuple(self.localize_media(p, base_dir, resolved) for p in comment.photos),
+                                 videos=tuple(self.localize_media(v, base_dir, resolved) for v in comment.videos))
+                for comment in line_item.comments)
+            media = tuple(self.localize_media(m, base_dir, resolved) for m in line_item.media)
+            line_items.append(line_item._replace(comments=comments, media=media))
+        return section._replace(line_items=tuple(line_items))
+
+    def localize(self, inspection: Inspection, base_dir: str) -> Inspection:
+        """Resolve all of an inspection's media, then point it at the cache"""
+        resolved = self.resolve(iter_media_urls(inspection.sections))
+        return inspection._replace(sections=tuple(self.localize_section(s, base_dir, resolved)
+                                                  for s in inspection.sections))
+
+    def iter_localized_sections(self, sections: Iterable[Section], base_dir: str) -> Iterator[Section]:
+        """Streaming variant of localize(): resolve media one section at a time"""
+        for section in sections:
+            resolved = self.resolve(iter_media_urls([section]))
+            yield self.localize_section(section, base_dir, resolved)
+
+
+class LocalizedInspectionStream:
+    """Wraps an InspectionStream so streamed sections reference cached media"""
+
+    def __init__(self, stream, store: MediaStore, base_dir: str):
+        self.stream = stream
+        self.store = store
+        self.base_dir = base_dir
+
+    def iter_sections(self) -> Iterator[Section]:
+        return self.store.iter_localized_sections(self.stream.iter_sections(), self.base_dir)
+
+    def inspection(self) -> Inspection:
+        return self.stream.inspection()
+
+
+def iter_media_urls(sections: Iterable[Section]) -> Iterator[str]:
+    """URLs of every photo and video in the given sections"""
+    for section in sections:
+        for line_item in section.line_items:
+            for comment in line_item.comments:
+                for media in comment.photos + comment.videos:
+                    yield media.url
+            for media in line_item.media:
+                yield media.url
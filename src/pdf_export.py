@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF Export
+Converts populated TREC HTML reports to PDF offline with WeasyPrint. Pages are
+laid out by the PDF engine, so comments that overflow a TREC page flow onto
+extra pages, and every page is numbered "Page X of Y" from the real layout
+rather than from the template's page count. Reports convert concurrently on a
+process pool.
+
+Usage:
+    python pdf_export.py reports/*.html --out-dir pdfs/ --workers 0
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+from report_bundle import is_within, iter_resource_references, resolve_local_reference, rewrite_references
+
+try:
+    from weasyprint import HTML, default_url_fetcher
+    HAS_WEASYPRINT = True
+except (ImportError, OSError):  # OSError: WeasyPrint installed without Pango
+    HAS_WEASYPRINT = False
+
+# Print layout for the PDF, added after the report's own styles. The in-page
+# "Page N of [ ]" boxes count template pages, so they are replaced by page
+# counters in the bottom margin, which count the pages actually laid out.
+PDF_CSS = """
+@page {
+    size: letter;
+    margin: 0 0 0.45in 0;
+    @bottom-center {
+        content: "Page " counter(page) " of " counter(pages);
+        font-family: "Times New Roman", Times, serif;
+        font-size: 12px;
+    }
+}
+html, body { height: auto; background: #fff; }
+.page {
+    min-height: 0 !important;
+    margin: 0 !important;
+    box-shadow: none !important;
+    display: block !important;
+    break-after: page;
+}
+.page:last-of-type { break-after: auto; }
+.pagecount-center { display: none !important; }
+.media-container, .comment-item { break-inside: avoid; }
+video { display: none; }
+"""
+
+
+class PdfResult(NamedTuple):
+    """Outcome of converting one report"""
+    name: str
+    pdf_path: str
+    seconds: float
+    pages: Optional[int] = None
+    error: Optional[str] = None
+
+
+def absolute_references(html_text: str, search_dirs: Sequence[str]) -> str:
+    """Point relative stylesheet and media references at absolute file URLs
+
+    Reports are often written away from the template, so ``trec_styles.css``
+    and ``logo.png`` are looked up next to the report first, then in each of
+    ``search_dirs``. References resolving outside those directories are left
+    as they are.
+    """
+    targets = {}
+    for reference in iter_resource_references(html_text):
+        path = resolve_local_reference(reference, search_dirs)
+        if path is not None:
+            targets[reference] = 'file://' + urllib.request.pathname2url(os.path.abspath(path))
+    return rewrite_references(html_text, targets)
+
+
+def contained_url_fetcher(search_dirs: Sequence[str]):
+    """WeasyPrint URL fetcher refusing local files outside ``search_dirs``
+
+    Covers the references absolute_references left alone, which WeasyPrint
+    would otherwise load relative to the report.
+    """
+    def fetch(url: str, *args, **kwargs):
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme == 'file':
+            path = os.path.realpath(urllib.request.url2pathname(parsed.path))
+            if not any(is_within(path, directory) for directory in search_dirs):
+                raise ValueError(f"{url} is outside the report's asset directories")
+        return default_url_fetcher(url, *args, **kwargs)
+    return fetch
+
+
+def pdf_path_for(html_path: str, out_dir: Optional[str] = None) -> str:
+    stem = os.path.splitext(os.path.basename(html_path))[0]
+    return os.path.join(out_dir or os.path.dirname(html_path), f"{stem}.pdf")
+
+
+def write_pdf(html_path: str, pdf_path: Optional[str] = None,
+              search_dirs: Iterable[str] = ()) -> int:
+    """Convert one populated report to PDF; returns the number of pages
+
+    Relative references resolve next to the report, then in ``search_dirs``;
+    local files outside those directories are not loaded.
+    """
+    if not HAS_WEASYPRINT:
+        raise RuntimeError("PDF export requires WeasyPrint. Install with: pip install weasyprint")
+    pdf_path = pdf_path or pdf_path_for(html_path)
+    with open(html_path, 'r', encoding='utf-8') as f:
+        html_text = f.read()
+    # Appended last in <head> so it overrides the template's screen layout
+    head_end = html_text.find('</head>')
+    style = f"<style>{PDF_CSS}</style>"
+    html_text = (html_text[:head_end] + style + html_text[head_end:]) if head_end >= 0 else style + html_text
+
+    report_dir = os.path.dirname(os.path.abspath(html_path))
+    search_dirs = [report_dir, *search_dirs]
+    html_text = absolute_references(html_text, search_dirs)
+    document = HTML(string=html_text, base_url=report_dir + os.sep,
+                    url_fetcher=contained_url_fetcher(search_dirs)).render()
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    document.write_pdf(tmp_path)
+    os.replace(tmp_path, pdf_path)
+    return len(document.pages)
+
+
+def convert_report(html_path: str, pdf_path: str, search_dirs: Sequence[str] = ()) -> PdfResult:
+    """write_pdf, capturing any failure in the result"""
+    name = os.path.splitext(os.path.basename(html_path))[0]
+    start = time.perf_counter()
+    try:
+        pages = write_pdf(html_path, pdf_path, search_dirs)
+    except Exception as e:
+        return PdfResult(name, pdf_path, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    return PdfResult(name, pdf_path, time.perf_counter() - start, pages)
+
+
+def export_pdfs(html_paths: Sequence[str], out_dir: Optional[str] = None, workers: int = 1,
+                search_dirs: Sequence[str] = ()) -> List[PdfResult]:
+    """Convert reports to PDF, over ``workers`` processes when more than one
+
+    Results are returned in input order; a failing report only fails its own
+    entry.
+    """
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    pdf_paths = [pdf_path_for(path, out_dir) for path in html_paths]
+    if workers <= 1 or len(html_paths) <= 1:
+        return [convert_report(html_path, pdf_path, search_dirs)
+                for html_path, pdf_path in zip(html_paths, pdf_paths)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(html_paths))) as executor:
+        return list(executor.map(convert_report, html_paths, pdf_paths,
+                                 [search_dirs] * len(html_paths)))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert populated TREC HTML reports to PDF")
+    parser.add_argument('reports', nargs='+', help="Report HTML files, directories or globs")
+    parser.add_argument('--out-dir', help="Directory for the PDFs (default: next to each report)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Reports converted concurrently (0 = one per CPU core)")
+    parser.add_argument('--assets', action='append', default=[], metavar='DIR',
+                        help="Extra directory for stylesheets and images the reports reference, "
+                             "such as the media cache (default: the directory of this script, "
+                             "where the template lives)")
+    return parser.parse_args(argv)
+
+
+def expand_reports(sources: Iterable[str]) -> List[str]:
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths += sorted(glob.glob(os.path.join(source, '*.html')))
+        elif os.path.isfile(source):
+            paths.append(source)
+        else:
+            paths += sorted(glob.glob(source))
+    return paths
+
+
+def main() -> int:
+    args = parse_args()
+    if not HAS_WEASYPRINT:
+        print("Error: WeasyPrint is required for PDF export. Install with: pip install weasyprint")
+        return 1
+    html_paths = expand_reports(args.reports)
+    if not html_paths:
+        print("Error: No reports found")
+        return 1
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    search_dirs = args.assets or [os.path.dirname(os.path.abspath(__file__))]
+    start = time.perf_counter()
+    results = export_pdfs(html_paths, args.out_dir, workers, search_dirs)
+    wall_seconds = time.perf_counter() - start
+
+    print(f"{'Report':<40} {'Pages':>6} {'ms':>10}  Status")
+    print("-" * 70)
+    for result in results:
+        status = 'OK' if result.error is None else f"FAILED ({result.error})"
+        pages = result.pages if result.pages is not None else '-'
+        print(f"{result.name:<40} {pages:>6} {result.seconds * 1000:>10.1f}  {status}")
+    print("-" * 70)
+    converted = sum(1 for r in results if r.error is None)
+    print(f"Converted {converted}/{len(results)} reports in {wall_seconds:.2f}s "
+          f"({len(results) / wall_seconds if wall_seconds else 0:.1f} reports/s)")
+    return 0 if converted == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
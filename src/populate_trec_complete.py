@@ -5,179 +5,278 @@ Complete TREC HTML Populator
 Processes ALL sections from inspection.json, removes empty items, uses actual names
 """
 import json
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+import logging
+import os
+import sys
+import glob
+import copy
+import time
+import argparse
+import hashlib
+import io
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Dict, Any, Iterable, List, Optional, NamedTuple, Iterator, Sequence, Tuple
 import re
-import html
+from collections import OrderedDict
+from functools import lru_cache
 
-try:
+from inspection_model import Inspection, Section, LineItem, Comment, normalize_inspection
+from trec_content import (
+    ADDITIONAL_FINDING_SEPARATOR,
+    COMMENTS_INLINE_STYLE,
+    COMMENTS_STYLE,
+    FORMATTING_CSS,
+    HEADER_FIELD_LABELS,
+    LINE_ITEM_MAPPING,
+    MAPPING_CACHE_PATH,
+    PRESERVE_WHITESPACE,
+    STATUS_CHECKBOX_INDEX,
+    WHITESPACE_RUN,
+    MappingCache,
+    active_mapping_cache,
+    count_line_item_output,
+    format_all_comments,
+    format_comment_text,
+    format_line_item,
+    fuzzy_match_line_item,
+    has_content,
+    header_field_values,
+    is_empty_item,
+    mapping_tables_version,
+    resolve_unmapped_line_item,
+    title_keywords,
+    transform_value,
+    use_mapping_cache,
+)
+from instrumentation import Metrics, METRICS_FORMATS, metric_key
+from report_logging import (LOG_FORMATS, LOG_LEVELS, configure_logging, get_logger, logging_config,
+                            report_context, update_report_context)
+
+__version__ = '1.0.0'
+
+# BeautifulSoup is imported on first use (see require_bs4): the compiled engine
+# never needs it, and it is a large part of a short run's startup time. The
+# streaming, render cache, media cache and bundle modules are likewise imported
+# by the code paths that use them.
+HAS_BS4 = find_spec('bs4') is not None
+if TYPE_CHECKING:
     from bs4 import BeautifulSoup, Tag
-    HAS_BS4 = True
-except ImportError:
-    HAS_BS4 = False
-    print("Error: BeautifulSoup4 is required. Install with: pip install beautifulsoup4")
-    exit(1)
-
-# Comprehensive mapping of inspection line items to TREC sections/items
-TREC_MAPPING = {
-    # Structural Systems (Section I - index 0)
-    "structural": {
-        "Foundation": ("A", 0),
-        "Grading and Drainage": ("B", 0),
-        "Roof Covering Materials": ("C", 0),
-        "Roof Structures and Attics": ("D", 0),
-        "Walls": ("E", 0),
-        "Ceilings and Floors": ("F", 0),
-        "Doors": ("G", 0),
-        "Windows": ("H", 0),
-        "Stairways": ("I", 0),
-        "Fireplaces and Chimneys": ("J", 0),
-        "Porches, Balconies, Decks, and Carports": ("K", 0),
-        "Other": ("L", 0),
-    },
-    # Electrical Systems (Section II - index 1)
-    "electrical": {
-        "Service Entrance and Panels": ("A", 1),
-        "Branch Circuits": ("B", 1),
-        "Other": ("C", 1),
-    },
-    # HVAC Systems (Section III - index 2)
-    "hvac": {
-        "Heating Equipment": ("A", 2),
-        "Cooling Equipment": ("B", 2),
-        "Duct Systems": ("C", 2),
-        "Other": ("D", 2),
-    },
-    # Plumbing Systems (Section IV - index 3)
-    "plumbing": {
-        "Plumbing Supply": ("A", 3),
-        "Drains, Wastes, and Vents": ("B", 3),
-        "Water Heating Equipment": ("C", 3),
-        "Hydro-Massage Therapy Equipment": ("D", 3),
-        "Gas Distribution": ("E", 3),
-        "Other": ("F", 3),
-    },
-    # Appliances (Section V - index 4)
-    "appliances": {
-        "Dishwashers": ("A", 4),
-        "Food Waste Disposers": ("B", 4),
-        "Range Hood": ("C", 4),
-        "Ranges, Cooktops, and Ovens": ("D", 4),
-        "Microwave Ovens": ("E", 4),
-        "Mechanical Exhaust": ("F", 4),
-        "Garage Door Operators": ("G", 4),
-        "Dryer Exhaust": ("H", 4),
-        "Other": ("I", 4),
-    },
-    # Optional Systems (Section VI - index 5)
-    "optional": {
-        "Landscape Irrigation": ("A", 5),
-        "Swimming Pools": ("B", 5),
-        "Outbuildings": ("C", 5),
-        "Private Water Wells": ("D", 5),
-        "Private Sewage Disposal": ("E", 5),
-        "Other Built-in Appliances": ("F", 5),
-        "Other": ("G", 5),
-    }
-}
-
-# Line item name to TREC mapping
-LINE_ITEM_MAPPING = {
-    # Structural
-    "Decks and Stairways": ("K", 0, "Porches, Balconies, Decks, and Carports"),
-    "Ground-Level Entry Structures": ("K", 0, "Porches, Balconies, Decks, and Carports"),
-    "Exterior Cladding and Trim": ("E", 0, "Walls (Interior and Exterior)"),
-    "Exterior Wall Cladding and Finishes": ("E", 0, "Walls (Interior and Exterior)"),
-    "Window Systems and Sealing": ("H", 0, "Windows"),
-    "Window Systems and Flashing": ("H", 0, "Windows"),
-    "Chimney Structures": ("J", 0, "Fireplaces and Chimneys"),
-    "Chimney Systems": ("J", 0, "Fireplaces and Chimneys"),
-    "Eaves and Soffit Components": ("K", 0, "Porches, Balconies, Decks, and Carports"),
-    "Paved Surfaces and Walkways": ("K", 0, "Porches, Balconies, Decks, and Carports"),
-    "Perimeter Fencing and Gates": ("L", 0, "Other"),
-    "Exterior Elevated Structures": ("K", 0, "Porches, Balconies, Decks, and Carports"),
-    "Exterior Entryways": ("G", 0, "Doors (Interior and Exterior)"),
-    "Site Grading and Drainage": ("B", 0, "Grading and Drainage"),
-    "Roof Covering Materials": ("C", 0, "Roof Covering Materials"),
-    "Roof Structures and Attics": ("D", 0, "Roof Structures and Attics"),
-    "Overall Roof Condition": ("C", 0, "Roof Covering Materials"),
-    "Roofing Material Integrity": ("C", 0, "Roof Covering Materials"),
-    "Flashing System Integrity": ("C", 0, "Roof Covering Materials"),
-    "Roof Flashing Components": ("C", 0, "Roof Covering Materials"),
-    "Roof Penetrations and Ventilation": ("D", 0, "Roof Structures and Attics"),
-    "Exterior Drainage Systems": ("B", 0, "Grading and Drainage"),
-    "Rainwater Management Systems": ("B", 0, "Grading and Drainage"),
-    
-    # HVAC
-    "Outdoor HVAC Unit": ("B", 2, "Cooling Equipment"),
-    "Outdoor Air Conditioning Unit": ("B", 2, "Cooling Equipment"),
-    
-    # Plumbing
-    "Exterior Water Taps and Drainage Access": ("A", 3, "Plumbing Supply, Distribution Systems and Fixtures"),
-    "Bathtub and Shower Systems": ("A", 3, "Plumbing Supply, Distribution Systems and Fixtures"),
-    
-    # Appliances
-    "Food Waste Disposer": ("B", 4, "Food Waste Disposers"),
-    "Integrated Appliances": ("I", 4, "Other"),
-    "Kitchen Ventilation": ("C", 4, "Range Hood and Exhaust Systems"),
-    "Microwave Oven": ("E", 4, "Microwave Ovens"),
-    "Dishwashing Unit": ("A", 4, "Dishwashers"),
-    "Laundry Appliances": ("H", 4, "Dryer Exhaust Systems"),
-    "Wine Refrigerator": ("I", 4, "Other"),
-    "Refrigeration Unit": ("I", 4, "Other"),
-    
-    # Electrical
-    "Electrical Receptacles, Switches, and Signaling Devices": ("B", 1, "Branch Circuits, Connected Devices, and Fixtures"),
-    "Electrical Conductors and Wiring": ("B", 1, "Branch Circuits, Connected Devices, and Fixtures"),
-    
-    # Structural
-    "Interior Door Systems": ("G", 0, "Doors (Interior and Exterior)"),
-    "Window Assemblies": ("H", 0, "Windows"),
-    "Window Systems": ("H", 0, "Windows"),
-    "Interior Wall Systems": ("E", 0, "Walls (Interior and Exterior)"),
-    "Interior Flooring Surfaces": ("F", 0, "Ceilings and Floors"),
-    "Ceiling Surfaces": ("F", 0, "Ceilings and Floors"),
-    "Floor Coverings": ("F", 0, "Ceilings and Floors"),
-    "Exterior Door Systems": ("G", 0, "Doors (Interior and Exterior)"),
-    "Subflooring": ("F", 0, "Ceilings and Floors"),
-    "Main Structural Supports": ("A", 0, "Foundations"),
-    "Floor Joist System": ("F", 0, "Ceilings and Floors"),
-    "General Structural Information": ("A", 0, "Foundations"),
-    "Substructure Entry": ("A", 0, "Foundations"),
-    "Outdoor Living Area Covers": ("K", 0, "Porches, Balconies, Decks, and Carports"),
-    "Exterior Plantings": ("L", 0, "Other"),
-    "Landscape Retaining Structures": ("B", 0, "Grading and Drainage"),
-    
-    # HVAC
-    "Indoor HVAC Unit": ("A", 2, "Heating Equipment"),
-    
-    # Optional - can map to Other
-    "Crawlspace Assessment": ("L", 0, "Other"),
-    "Interior Cabinetry and Countertops": ("L", 0, "Other"),
-    "Interior Passageways": ("L", 0, "Other"),
-    
-    # General/Info sections - map to appropriate fields
-    "Report Context": None,  # Skip - informational only
-    "General Information": None,  # Skip - informational only, not a TREC line item
-    "Site and Property Context": ("B", 0, "Grading and Drainage"),  # Keep this mapping
-}
+    from inspection_stream import InspectionStream
+    from media_pipeline import MediaStore
+    from render_cache import RenderCache
+
+log = get_logger()
+
+
+def require_bs4():
+    """The bs4 module, imported on first use; raises ImportError when it is not installed"""
+    try:
+        import bs4
+    except ImportError:
+        raise ImportError("BeautifulSoup4 is required for the dom engine. "
+                          "Install with: pip install beautifulsoup4 (or use --engine compiled)") from None
+    return bs4
+
+
+# BeautifulSoup tree builders and the module each needs. html.parser ships
+# with Python; html5lib is the most lenient but the slowest of the three.
+PARSER_MODULES = {'lxml': 'lxml', 'html.parser': None, 'html5lib': 'html5lib'}
+PARSER_BACKENDS = tuple(PARSER_MODULES)
+# Tried in order by 'auto': the fastest installed builder
+AUTO_PARSERS = ('lxml', 'html.parser')
+
+
+def available_parsers() -> List[str]:
+    """Tree builders BeautifulSoup can use here (their module imported successfully)"""
+    builder_registry = require_bs4().builder.builder_registry
+    return [name for name in PARSER_BACKENDS if builder_registry.lookup(name) is not None]
+
+
+@lru_cache(maxsize=None)
+def select_parser(preferred: str = 'auto') -> str:
+    """Resolve a --parser choice to an installed tree builder
+    
+    'auto' picks the fastest one installed. A builder that is not installed
+    falls back to html.parser with a warning.
+    """
+    available = available_parsers()
+    if preferred == 'auto':
+        return next(name for name in AUTO_PARSERS if name in available)
+    if preferred not in PARSER_MODULES:
+        raise ValueError(f"Unknown parser backend: {preferred}")
+    if preferred not in available:
+        log.warning("Parser %s is not installed (pip install %s); using html.parser",
+                    preferred, PARSER_MODULES[preferred])
+        return 'html.parser'
+    return preferred
+
+
+def load_template(html_path: str, parser: str = 'auto') -> 'BeautifulSoup':
+    """Parse the TREC HTML template"""
+    bs4 = require_bs4()
+    with open(html_path, 'r', encoding='utf-8') as f:
+        return bs4.BeautifulSoup(f.read(), select_parser(parser))
+
+
+@lru_cache(maxsize=None)
+def raw_html_type():
+    """String node written out verbatim, for fragments that are already escaped HTML"""
+    class RawHTML(require_bs4().element.PreformattedString):
+        PREFIX = ''
+        SUFFIX = ''
+    return RawHTML
+
+
+# save() output formats: unindented, whitespace-collapsed, or the old prettify()
+OUTPUT_FORMATS = ('compact', 'minify', 'pretty')
+
+# Containers whose children are written one at a time instead of as one string
+STREAMED_CONTAINERS = frozenset(['html', 'head', 'body'])
+
+
+def iter_html_chunks(soup: 'BeautifulSoup', node: Optional['Tag'] = None) -> Iterator[str]:
+    """Serialize the document as a sequence of chunks
+
+    The chunks join to exactly ``str(soup)``; only the top-level containers
+    are split so no single string holds the whole report.
+    """
+    Tag = require_bs4().Tag
+    node = soup if node is None else node
+    for child in node.children:
+        if isinstance(child, Tag) and child.name in STREAMED_CONTAINERS:
+            end_tag = f'</{child.name}>'
+            # Serialize an empty copy to get the start tag exactly as decode() would
+            empty = soup.new_tag(child.name, attrs=dict(child.attrs))
+            yield empty.decode()[:-len(end_tag)]
+            yield from iter_html_chunks(soup, child)
+            yield end_tag
+        elif isinstance(child, Tag):
+            yield child.decode()
+        else:
+            yield child.output_ready()
+
+
+def minify_tree(soup: 'BeautifulSoup') -> None:
+    """Drop HTML comments and collapse whitespace runs in text, in place"""
+    bs4 = require_bs4()
+    for text in list(soup.find_all(string=True)):
+        if isinstance(text, bs4.Comment):
+            text.extract()
+        elif type(text) is bs4.NavigableString and not any(
+                parent.name in PRESERVE_WHITESPACE for parent in text.parents):
+            # Keep one newline where there was one so lines stay short
+            collapsed = WHITESPACE_RUN.sub(lambda m: '\n' if '\n' in m.group() else ' ', text)
+            if collapsed != text:
+                text.replace_with(collapsed)
+
+
+class TemplateItem(NamedTuple):
+    """Indexed TREC template item and the children populated for it"""
+    tag: 'Tag'
+    checks: Optional['Tag']
+    comments: Optional['Tag']
+    comments_inline: Optional['Tag']
+    section: int
+    position: int
+
 
 class CompleteTRECPopulator:
     """Populates TREC HTML form with complete inspection data"""
     
-    def __init__(self, html_path: str, inspection_path: str):
+    def __init__(self, html_path: str, inspection_path: str,
+                 template_soup: Optional['BeautifulSoup'] = None,
+                 inspection_data: Optional[Dict[str, Any]] = None,
+                 stream: bool = False,
+                 inspection_stream: Optional['InspectionStream'] = None,
+                 inspection: Optional[Inspection] = None,
+                 parser: str = 'auto'):
         self.html_path = html_path
         self.inspection_path = inspection_path
+        self.parser = select_parser(parser)
+        self.metrics = Metrics()
         
-        # Load files
-        with open(html_path, 'r', encoding='utf-8') as f:
-            self.soup = BeautifulSoup(f.read(), 'html.parser')
+        # Streamed inspections are parsed while sections are populated; fields
+        # after "sections" (e.g. account) are only known once that finishes
+        if stream and inspection_stream is None:
+            from inspection_stream import open_inspection_stream
+            inspection_stream = open_inspection_stream(inspection_path)
+        self.inspection_stream = inspection_stream
         
-        with open(inspection_path, 'r', encoding='utf-8') as f:
-            self.inspection_data = json.load(f)
+        with self.metrics.timer('load'):
+            # Load files (a pre-parsed template is copied so it can be shared)
+            if template_soup is not None:
+                self.soup = copy.copy(template_soup)
+            else:
+                self.soup = load_template(html_path, self.parser)
+            
+            # The raw payload is normalized once and not kept around
+            if inspection is not None:
+                self.inspection = inspection
+            elif inspection_stream is not None:
+                self.inspection = inspection_stream.inspection()
+            else:
+                if inspection_data is None:
+                    with open(inspection_path, 'r', encoding='utf-8') as f:
+                        inspection_data = json.load(f)
+                self.inspection = normalize_inspection(inspection_data)
         
         # Add CSS for better formatting
-        self.add_formatting_css()
+        with self.metrics.timer('css_injection'):
+            self.add_formatting_css()
+        
+        # Index template items once so line item lookups don't walk the DOM
+        with self.metrics.timer('template_index'):
+            self.build_template_index()
+    
+    def localize_media(self, store: 'MediaStore', base_dir: str) -> None:
+        """Point photos and videos at files cached (and thumbnailed) by ``store``"""
+        if self.inspection_stream is not None:
+            from media_pipeline import LocalizedInspectionStream
+            self.inspection_stream = LocalizedInspectionStream(self.inspection_stream, store, base_dir)
+        else:
+            self.inspection = store.localize(self.inspection, base_dir)
+    
+    def build_template_index(self) -> None:
+        """Index TREC items by (section, code) and by title keyword"""
+        self.section_titles = self.soup.select('div.section-title')
+        self.section_items: List[List[TemplateItem]] = []
+        self.item_index: Dict[tuple, TemplateItem] = {}
+        self.keyword_index: Dict[tuple, tuple] = {}
+        self._item_lookup_cache: Dict[tuple, Optional[TemplateItem]] = {}
+        # (section, position) of items given a checked status or comment text
+        self.filled_items = set()
+        self.removed_sections = set()
+        
+        for section_idx, section in enumerate(self.section_titles):
+            items = []
+            for sibling in section.find_next_siblings():
+                if sibling.name != 'div':
+                    continue
+                classes = sibling.get('class', [])
+                if 'section-title' in classes:
+                    break
+                if 'item' in classes:
+                    items.append(TemplateItem(
+                        tag=sibling,
+                        checks=sibling.select_one('.checks'),
+                        comments=sibling.select_one('.comments-inline .comments'),
+                        comments_inline=sibling.select_one('.comments-inline'),
+                        section=section_idx,
+                        position=len(items),
+                    ))
+            self.section_items.append(items)
+            
+            for position, item in enumerate(items):
+                title_elem = item.tag.select_one('.item-title')
+                if not title_elem:
+                    continue
+                code_elem = title_elem.select_one('.code')
+                if code_elem:
+                    code = code_elem.text.strip().rstrip('.')
+                    self.item_index.setdefault((section_idx, code), item)
+                title_text = re.sub(r'^[A-Z]\.\s*', '', title_elem.text.strip(), count=1)
+                for keyword in title_keywords(title_text):
+                    self.keyword_index.setdefault((section_idx, keyword), (position, item))
     
     def add_formatting_css(self):
         """Add CSS styles for better comment and media formatting"""
@@ -188,157 +287,11 @@ class CompleteTRECPopulator:
                 style_tag = self.soup.new_tag('style')
                 head.append(style_tag)
         
-        css = """
-        /* Ensure all pages match pages 1-2 height and structure */
-        .page {
-            min-height: 11in !important;
-            display: flex !important;
-            flex-direction: column !important;
-            overflow: visible !important;
-        }
-        
-        /* Content area should expand to fill available space like pages 1-2 */
-        .page .content {
-            flex: 1 !important;
-            display: flex !important;
-            flex-direction: column !important;
-            overflow: visible !important;
-            padding: 0.6in !important;
-        }
-        
-        /* Ensure pages 3+ match padding-bottom pattern of pages 1-2 */
-        .page:nth-child(n+3) .content {
-            padding-bottom: calc(0.6in * 0.7) !important;
-        }
-        
-        /* Footer should stay at bottom */
-        .footer {
-            flex-shrink: 0;
-            margin: 0 0.6in 0.6in 0.6in;
-        }
-        
-        /* Content should flow naturally - no clipping */
-        .page .content > * {
-            flex-shrink: 0;
-        }
-        
-        /* Comment formatting */
-        .comment-item {
-            margin: 8px 0;
-            padding: 4px 0;
-            line-height: 1.5;
-            page-break-inside: avoid;
-        }
-        .comment-item p {
-            margin: 4px 0;
-        }
-        
-        /* Media container - prevent overflow, allow page breaks */
-        .media-container {
-            margin: 10px 0;
-            clear: both;
-            page-break-inside: avoid;
-            break-inside: avoid;
-            max-width: 100%;
-        }
-        .media-container img,
-        .media-container video {
-            max-width: 250px !important;
-            max-height: 200px !important;
-            width: auto !important;
-            height: auto !important;
-            display: block;
-            clear: both;
-            border: 1px solid #ddd;
-            padding: 2px;
-            margin: 8px 0;
-            object-fit: contain;
-        }
-        
-        /* Comments - allow natural growth */
-        .comments {
-            word-wrap: break-word;
-            height: auto !important;
-            min-height: 0.5in;
-            overflow: visible !important;
-            max-height: none !important;
-        }
-        .comments-inline {
-            height: auto !important;
-            overflow: visible !important;
-        }
-        
-        /* Items - prevent awkward page breaks */
-        .item {
-            page-break-inside: avoid;
-            break-inside: avoid;
-            min-height: auto;
-            overflow: visible;
-        }
-        .item .comments[contenteditable="true"] {
-            height: auto !important;
-            min-height: 0.5in;
-            overflow: visible !important;
-        }
-        
-        /* Section titles - keep with content */
-        .section-title {
-            page-break-after: avoid;
-            break-after: avoid;
-        }
-        
-        /* Print media - proper page breaks and consistent heights */
-        @media print {
-            @page {
-                size: letter;
-                margin: 0;
-            }
-            .page {
-                min-height: 11in !important;
-                height: auto !important;
-                page-break-after: always;
-                page-break-inside: avoid;
-                break-inside: avoid;
-                overflow: visible !important;
-            }
-            .page:last-child {
-                page-break-after: auto;
-            }
-            .page .content {
-                overflow: visible !important;
-                height: auto !important;
-            }
-            .item {
-                page-break-inside: avoid;
-                break-inside: avoid;
-                orphans: 3;
-                widows: 3;
-            }
-            .media-container {
-                page-break-inside: avoid;
-                break-inside: avoid;
-            }
-            .section-title {
-                page-break-after: avoid;
-                break-after: avoid;
-            }
-        }
-        
-        /* Screen view - allow natural flow, no clipping */
-        @media screen {
-            .page {
-                overflow: visible !important;
-            }
-            .page .content {
-                overflow: visible !important;
-            }
-        }
-        """
         
         if style_tag:
             # Append CSS if style tag already has content, otherwise set it
             existing_css = style_tag.string if style_tag.string else ""
-            style_tag.string = existing_css + "\n" + css if existing_css else css
+            style_tag.string = existing_css + "\n" + FORMATTING_CSS if existing_css else FORMATTING_CSS
     
     def get_value_from_path(self, data: Dict[str, Any], path: List[str]) -> Any:
         """Safely get nested value from JSON"""
@@ -352,339 +305,224 @@ class CompleteTRECPopulator:
     
     def transform_value(self, value: Any, transform_type: Optional[str] = None) -> str:
         """Transform value based on type"""
-        if value is None:
-            return ""
-        
-        if transform_type == "date":
-            try:
-                if isinstance(value, (int, float)):
-                    dt = datetime.fromtimestamp(value / 1000)
-                else:
-                    dt = datetime.fromisoformat(str(value))
-                return dt.strftime("%m/%d/%Y")
-            except:
-                return str(value)
-        
-        return str(value)
+        return transform_value(value, transform_type)
     
-    def check_status_checkbox(self, checks_container: Tag, status: str) -> None:
-        """Check the appropriate checkbox based on status"""
+    def check_status_checkbox(self, checks_container: 'Tag', status: str) -> bool:
+        """Check the appropriate checkbox based on status; returns whether one was checked"""
         checkboxes = checks_container.select('input[type="checkbox"]')
-        status_map = {"I": 0, "NI": 1, "NP": 2, "D": 3}
-        idx = status_map.get(status.upper(), -1)
+        idx = STATUS_CHECKBOX_INDEX.get(status.upper(), -1)
         if 0 <= idx < len(checkboxes):
             checkboxes[idx]['checked'] = 'checked'
+            return True
+        return False
     
-    def format_comment_text(self, comment: Dict) -> str:
+    def mark_filled(self, trec_item: TemplateItem) -> None:
+        """Record that an item has data, keeping its section in the report"""
+        self.filled_items.add((trec_item.section, trec_item.position))
+    
+    def format_comment_text(self, comment: Comment) -> str:
         """Format a single comment's text"""
-        text = comment.get('text') or comment.get('commentText') or comment.get('value') or ''
-        location = comment.get('location', '').strip()
-        
-        parts = []
-        
-        if location:
-            parts.append(f'<p><strong>Location:</strong> {html.escape(location)}</p>')
-        
-        if text:
-            parts.append(f'<p>{html.escape(text)}</p>')
-        
-        return ''.join(parts)
+        return format_comment_text(comment)
     
-    def format_all_comments(self, comments: List[Dict]) -> str:
+    def format_all_comments(self, comments: Sequence[Comment]) -> str:
         """Format all comments for a line item"""
-        if not comments:
-            return ''
-        
-        # Sort by order
-        sorted_comments = sorted(comments, key=lambda c: c.get('order', 0))
+        return format_all_comments(comments)
+    
+    def format_line_item(self, line_item: LineItem) -> str:
+        """Format a line item's comments and media"""
+        with self.metrics.timer('comment_formatting'):
+            line_item_html = format_line_item(line_item)
+        count_line_item_output(self.metrics, line_item)
+        return line_item_html
+    
+    def lookup_trec_item(self, section_index: int, item_code: str, item_title: str) -> Optional[TemplateItem]:
+        """Look up an indexed TREC item by code, falling back to title keywords"""
+        cache_key = (section_index, item_code, item_title)
+        if cache_key in self._item_lookup_cache:
+            return self._item_lookup_cache[cache_key]
         
-        html_parts = []
-        for idx, comment in enumerate(sorted_comments):
-            # Format comment text
-            comment_html = self.format_comment_text(comment)
-            if comment_html:
-                html_parts.append(f'<div class="comment-item">{comment_html}</div>')
-            
-            # Add media
-            photos = comment.get('photos', [])
-            for photo in photos:
-                url = photo.get('url', '')
-                caption = photo.get('caption') or photo.get('description') or ''
-                if url:
-                    img_style = "max-width: 250px; max-height: 200px; margin: 8px 0; display: block; clear: both; border: 1px solid #ddd; padding: 2px;"
-                    img_html = f'<img src="{html.escape(url)}" alt="{html.escape(caption)}" style="{img_style}" />'
-                    caption_text = f'<p style="font-size: 0.85em; font-style: italic; margin: 4px 0;"><em>{html.escape(caption)}</em></p>' if caption else ''
-                    html_parts.append(f'<div class="media-container" style="margin: 10px 0; clear: both;">{caption_text}{img_html}</div>')
-            
-            videos = comment.get('videos', [])
-            for video in videos:
-                url = video.get('url', '')
-                if url:
-                    video_style = "max-width: 250px; max-height: 200px; margin: 8px 0; display: block; clear: both;"
-                    video_html = f'<video src="{html.escape(url)}" controls style="{video_style}"></video>'
-                    html_parts.append(f'<div class="media-container" style="margin: 10px 0; clear: both;">{video_html}</div>')
-            
-            if idx < len(sorted_comments) - 1:
-                html_parts.append('<hr style="margin: 12px 0; border: none; border-top: 1px solid #eee;"/>')
+        item = self.item_index.get((section_index, item_code))
+        if item is None and section_index < len(self.section_items):
+            # First item (in template order) sharing any title keyword
+            matches = [self.keyword_index[(section_index, kw)] for kw in title_keywords(item_title)
+                       if (section_index, kw) in self.keyword_index]
+            if matches:
+                item = min(matches, key=lambda match: match[0])[1]
+            elif self.section_items[section_index]:
+                item = self.section_items[section_index][0]
         
-        return '\n'.join(html_parts)
+        self._item_lookup_cache[cache_key] = item
+        return item
     
-    def find_trec_item(self, section_index: int, item_code: str, item_title: str) -> Optional[Tag]:
+    def find_trec_item(self, section_index: int, item_code: str, item_title: str) -> Optional['Tag']:
         """Find TREC item element"""
-        sections = self.soup.select('div.section-title')
-        if section_index >= len(sections):
-            return None
-        
-        section = sections[section_index]
-        current = section.find_next_sibling()
-        items = []
-        
-        while current:
-            if current.name == 'div' and 'section-title' in current.get('class', []):
-                break
-            if current.name == 'div' and 'item' in current.get('class', []):
-                items.append(current)
-            current = current.find_next_sibling()
-        
-        # Find by code
-        for item in items:
-            code_elem = item.select_one('.item-title .code')
-            if code_elem and code_elem.text.strip() == item_code + '.':
-                return item
-        
-        # Find by title keywords
-        title_keywords = [kw.lower() for kw in item_title.split()]
-        for item in items:
-            title_elem = item.select_one('.item-title')
-            if title_elem:
-                title_text = re.sub(r'^[A-Z]\.\s*', '', title_elem.text.strip(), count=1).lower()
-                if any(kw in title_text for kw in title_keywords):
-                    return item
-        
-        return items[0] if items else None
+        item = self.lookup_trec_item(section_index, item_code, item_title)
+        return item.tag if item else None
     
-    def is_empty_item(self, line_item: Dict) -> bool:
-        """Check if line item is empty (no status and no comments)"""
-        has_status = line_item.get('inspectionStatus') is not None
-        has_comments = len(line_item.get('comments', [])) > 0
-        return not has_status and not has_comments
+    def is_empty_item(self, line_item: LineItem) -> bool:
+        """Check if line item is empty (no status, no comments and no media)"""
+        return is_empty_item(line_item)
     
     def populate_header_fields(self) -> None:
         """Populate header fields from inspection.json"""
-        inspection = self.inspection_data.get('inspection', {})
-        client_info = inspection.get('clientInfo', {})
-        address_info = inspection.get('address', {})
-        inspector_info = inspection.get('inspector', {})
-        schedule = inspection.get('schedule', {})
-        account = self.inspection_data.get('account', {})
-        
-        # Client name
-        client_elem = self.soup.find(id='client')
-        if client_elem:
-            client_name = client_info.get('name', '')
-            client_elem['value'] = client_name
-            print(f"   Client: {client_name}")
-        
-        # Date of Inspection
-        date_elem = self.soup.find(id='date')
-        if date_elem:
-            date_val = schedule.get('date')
-            if date_val:
-                formatted_date = self.transform_value(date_val, 'date')
-                date_elem['value'] = formatted_date
-                print(f"   Date: {formatted_date}")
-        
-        # Address of Inspected Property
-        address_elem = self.soup.find(id='address')
-        if address_elem:
-            full_address = address_info.get('fullAddress', '')
-            address_elem['value'] = full_address
-            print(f"   Address: {full_address}")
-        
-        # Name of Inspector
-        inspector_elem = self.soup.find(id='inspector')
-        if inspector_elem:
-            inspector_name = inspector_info.get('name', '')
-            inspector_elem['value'] = inspector_name
-            print(f"   Inspector: {inspector_name}")
-        
-        # TREC License # (Inspector)
-        trec1_elem = self.soup.find(id='trec1')
-        if trec1_elem:
-            trec_license = inspector_info.get('id', '')
-            trec1_elem['value'] = trec_license
-            print(f"   Inspector TREC License: {trec_license}")
-        
-        # Name of Sponsor (if applicable)
-        sponsor_elem = self.soup.find(id='sponsor')
-        if sponsor_elem and account:
-            sponsor_name = account.get('companyName', '')
-            if not sponsor_name:
-                # Try alternative paths
-                sponsor_name = account.get('name', '')
-            if sponsor_name:
-                sponsor_elem['value'] = sponsor_name
-                print(f"   Sponsor: {sponsor_name}")
-        
-        # TREC License # (Sponsor)
-        trec2_elem = self.soup.find(id='trec2')
-        if trec2_elem and account:
-            sponsor_license = account.get('id', '')
-            if sponsor_license:
-                trec2_elem['value'] = sponsor_license
-                print(f"   Sponsor TREC License: {sponsor_license}")
+        if self.inspection_stream is not None:
+            # Streamed header fields are complete once the sections are read
+            self.inspection = self.inspection_stream.inspection()
+        debug = log.isEnabledFor(logging.DEBUG)
+        with self.metrics.timer('header'):
+            for field_id, value in header_field_values(self.inspection).items():
+                elem = self.soup.find(id=field_id)
+                if elem:
+                    elem['value'] = value
+                    if debug:
+                        log.debug("   %s: %s", HEADER_FIELD_LABELS[field_id], value)
     
     def populate_all_sections(self) -> None:
         """Process all sections from inspection.json"""
-        sections = self.inspection_data.get('inspection', {}).get('sections', [])
+        if self.inspection_stream is not None:
+            sections = self.inspection_stream.iter_sections()
+        else:
+            sections = self.inspection.sections
         
         processed_items = {}  # Track processed TREC items
         
         for section in sections:
-            section_name = section.get('name', '')
-            line_items = section.get('lineItems', [])
-            
-            # Filter out empty items
-            non_empty_items = [li for li in line_items if not self.is_empty_item(li)]
-            
-            if not non_empty_items:
-                print(f"[SKIP] Section '{section_name}' has no data")
-                continue
-            
-            print(f"\nProcessing section: {section_name}")
-            print(f"  {len(non_empty_items)} line items with data")
+            with self.metrics.timer('section', section=section.name):
+                self.populate_section(section, processed_items)
+        
+        # Fill each comments container once, with its fragments inserted as one node
+        with self.metrics.timer('comment_insertion'):
+            for pending in processed_items.values():
+                if pending['fragments']:
+                    self.fill_comments(pending['item'], pending['fragments'], pending['styled'])
+    
+    def populate_section(self, section: Section, processed_items: Dict[str, Dict[str, Any]]) -> None:
+        """Map one section's line items to TREC items, queueing their comments"""
+        section_name = section.name
+        # Checked once, so per-item logging costs nothing when debug is off
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        # Filter out empty items
+        non_empty_items = [li for li in section.line_items if not self.is_empty_item(li)]
+        
+        skipped_empty = len(section.line_items) - len(non_empty_items)
+        if skipped_empty:
+            self.metrics.count('items_skipped', skipped_empty, reason='empty')
+        if not non_empty_items:
+            if debug:
+                log.debug("[SKIP] Section '%s' has no data", section_name)
+            return
+        
+        if debug:
+            log.debug("Processing section: %s (%d line items with data)", section_name, len(non_empty_items))
+        
+        for line_item in non_empty_items:
+            line_item_name = line_item.name
             
-            for line_item in non_empty_items:
-                line_item_name = line_item.get('name', '')
-                
-                # Get mapping
-                mapping = LINE_ITEM_MAPPING.get(line_item_name)
+            # Get mapping
+            if line_item_name in LINE_ITEM_MAPPING:
+                mapping = LINE_ITEM_MAPPING[line_item_name]
                 
                 # Check if explicitly set to None (should be skipped)
                 if mapping is None:
-                    print(f"  [SKIP] Skipping informational item: {line_item_name}")
+                    if debug:
+                        log.debug("  [SKIP] Skipping informational item: %s", line_item_name)
+                    self.metrics.count('items_skipped', reason='informational')
                     continue
-                
-                if not mapping:
-                    # Try fuzzy matching
-                    mapping = self.fuzzy_match_line_item(line_item_name)
-                
+            else:
+                # Try fuzzy matching
+                with self.metrics.timer('fuzzy_match'):
+                    mapping = resolve_unmapped_line_item(line_item_name)
                 if not mapping:
-                    print(f"  [SKIP] No mapping for: {line_item_name}")
-                    continue
-                
-                item_code, section_idx, item_title = mapping
-                item_key = f"{section_idx}_{item_code}"
-                
-                # Find TREC item
-                trec_item = self.find_trec_item(section_idx, item_code, item_title)
-                if not trec_item:
-                    print(f"  [SKIP] Could not find TREC item: {item_code}. {item_title}")
+                    if debug:
+                        log.debug("  [SKIP] No mapping for: %s", line_item_name)
+                    self.metrics.count('items_skipped', reason='unmapped')
                     continue
+                if debug:
+                    log.debug("  [FUZZY] %s ~ %s. %s", line_item_name, mapping[0], mapping[2])
+                self.metrics.count('items_fuzzy_matched')
+            
+            item_code, section_idx, item_title = mapping
+            item_key = f"{section_idx}_{item_code}"
+            
+            # Find TREC item
+            with self.metrics.timer('find_trec_item'):
+                trec_item = self.lookup_trec_item(section_idx, item_code, item_title)
+            if not trec_item:
+                if debug:
+                    log.debug("  [SKIP] Could not find TREC item: %s. %s", item_code, item_title)
+                self.metrics.count('items_skipped', reason='no_template_item')
+                continue
+            
+            if debug:
+                log.debug("  [OK] %s -> %s. %s", line_item_name, item_code, item_title,
+                          extra={'line_item': line_item_name, 'trec_item': f"{section_idx}_{item_code}"})
+            self.metrics.count('items_mapped')
+            
+            # Handle multiple items mapping to same TREC item
+            if item_key in processed_items:
+                # Queue as "Additional Finding"; written once all line items are grouped
+                self.metrics.count('additional_findings')
+                if trec_item.comments:
+                    new_html = self.format_line_item(line_item)
+                    if new_html:
+                        processed_items[item_key]['fragments'] += [ADDITIONAL_FINDING_SEPARATOR, new_html]
+            else:
+                pending = processed_items[item_key] = {'item': trec_item, 'fragments': [], 'styled': False}
                 
-                print(f"  [OK] {line_item_name} -> {item_code}. {item_title}")
+                # Set status
+                checks_container = trec_item.checks
+                if checks_container:
+                    status = line_item.status
+                    if status and self.check_status_checkbox(checks_container, status):
+                        self.mark_filled(trec_item)
                 
-                # Handle multiple items mapping to same TREC item
-                if item_key in processed_items:
-                    # Append as "Additional Finding"
-                    existing_item = processed_items[item_key]
-                    comments_container = existing_item.select_one('.comments-inline .comments')
-                    if comments_container:
-                        comments = line_item.get('comments', [])
-                        if comments:
-                            existing_html = comments_container.decode_contents()
-                            new_html = self.format_all_comments(comments)
-                            if new_html:
-                                separator = '<hr style="margin: 12px 0; border: none; border-top: 2px solid #ccc;"/><p style="font-weight: bold; margin: 8px 0;">Additional Finding:</p>'
-                                combined_html = existing_html + separator + new_html
-                                comments_container.clear()
-                                comments_container.append(BeautifulSoup(combined_html, 'html.parser'))
-                else:
-                    processed_items[item_key] = trec_item
-                    
-                    # Set status
-                    checks_container = trec_item.select_one('.checks')
-                    if checks_container:
-                        status = line_item.get('inspectionStatus')
-                        if status:
-                            self.check_status_checkbox(checks_container, status)
-                    
-                    # Add comments
-                    comments_container = trec_item.select_one('.comments-inline .comments')
-                    if comments_container:
-                        comments = line_item.get('comments', [])
-                        if comments:
-                            comments_html = self.format_all_comments(comments)
-                            if comments_html:
-                                comments_container.clear()
-                                comments_container['style'] = 'overflow: visible !important; height: auto !important; min-height: 0.5in; max-height: none !important;'
-                                comments_container.append(BeautifulSoup(comments_html, 'html.parser'))
-                                print(f"    Added {len(comments)} comment(s)")
-                                
-                                comments_inline = trec_item.select_one('.comments-inline')
-                                if comments_inline:
-                                    comments_inline['style'] = 'height: auto; overflow: visible;'
+                # Add comments and media
+                if trec_item.comments:
+                    comments_html = self.format_line_item(line_item)
+                    if comments_html:
+                        pending['fragments'].append(comments_html)
+                        pending['styled'] = True
+                        if debug and line_item.comments:
+                            log.debug("    Added %d comment(s)", len(line_item.comments))
+    
+    def fill_comments(self, trec_item: TemplateItem, fragments: List[str], styled: bool) -> None:
+        """Replace an item's comments with the accumulated HTML fragments"""
+        comments_container = trec_item.comments
+        comments_container.clear()
+        if styled:
+            comments_container['style'] = COMMENTS_STYLE
+            if trec_item.comments_inline:
+                trec_item.comments_inline['style'] = COMMENTS_INLINE_STYLE
+        # The fragments are built escaped, so they are inserted without parsing
+        markup = ''.join(fragments)
+        if has_content(markup):
+            self.mark_filled(trec_item)
+        comments_container.append(raw_html_type()(markup))
     
     def fuzzy_match_line_item(self, line_item_name: str) -> Optional[tuple]:
         """Try to match line item using keywords"""
-        name_lower = line_item_name.lower()
-        
-        # Try keyword matching
-        for mapped_name, (code, idx, title) in LINE_ITEM_MAPPING.items():
-            mapped_lower = mapped_name.lower()
-            # Check if any significant words match
-            mapped_words = set(mapped_lower.split())
-            name_words = set(name_lower.split())
-            
-            if len(mapped_words & name_words) >= 2:  # At least 2 words match
-                return (code, idx, title)
-        
-        return None
+        return fuzzy_match_line_item(line_item_name)
     
     def remove_empty_sections(self) -> None:
-        """Remove TREC sections that have no populated items"""
-        sections = self.soup.select('div.section-title')
+        """Remove TREC sections that have no populated items
         
-        for section in sections:
-            section_div = section.parent if section.parent else None
-            if not section_div:
-                continue
-            
-            # Find all items in this section
-            current = section.find_next_sibling()
-            has_data = False
-            
-            while current:
-                if current.name == 'div' and 'section-title' in current.get('class', []):
-                    break
-                if current.name == 'div' and 'item' in current.get('class', []):
-                    # Check if item has data
-                    comments = current.select_one('.comments[contenteditable="true"]')
-                    if comments and comments.get_text(strip=True):
-                        has_data = True
-                        break
-                    checks = current.select_one('.checks input[checked]')
-                    if checks:
-                        has_data = True
-                        break
-                current = current.find_next_sibling()
-            
-            if not has_data:
-                # Remove this section and its items
-                print(f"[REMOVE] Empty section: {section.text.strip()}")
-                # Find end of section (next section-title or page end)
-                current = section.find_next_sibling()
-                elements_to_remove = [section]
-                
-                while current:
-                    if current.name == 'div' and 'section-title' in current.get('class', []):
-                        break
-                    if current.name == 'div' and 'item' in current.get('class', []):
-                        elements_to_remove.append(current)
-                    current = current.find_next_sibling()
+        Uses the items recorded while populating, so no tree scan is needed.
+        """
+        filled_sections = {section for section, _ in self.filled_items}
+        
+        with self.metrics.timer('prune'):
+            for section_idx, section in enumerate(self.section_titles):
+                if section_idx in filled_sections or section_idx in self.removed_sections:
+                    continue
                 
-                for elem in elements_to_remove:
-                    elem.decompose()
+                # Remove this section and its items
+                log.debug("[REMOVE] Empty section: %s", section.text.strip())
+                self.removed_sections.add(section_idx)
+                self.metrics.count('sections_removed')
+                section.decompose()
+                for item in self.section_items[section_idx]:
+                    item.tag.decompose()
     
     def update_page_numbers(self) -> int:
         """Update page numbers"""
@@ -697,54 +535,850 @@ class CompleteTRECPopulator:
         
         return total_pages
     
-    def save(self, output_path: str) -> None:
-        """Save populated HTML"""
-        self.update_page_numbers()
+    def iter_html(self, output_format: str = 'compact') -> Iterator[str]:
+        """Serialize the populated HTML as a sequence of chunks
+        
+        ``compact`` and ``minify`` serialize the tree without re-indenting it;
+        ``minify`` also drops comments and collapses whitespace. Output is
+        byte-identical for identical inputs.
+        """
+        with self.metrics.timer('serialize'):
+            self.update_page_numbers()
+            
+            if output_format == 'pretty':
+                yield self.soup.prettify()
+                return
+            if output_format == 'minify':
+                minify_tree(self.soup)
+            yield from iter_html_chunks(self.soup)
+    
+    def save(self, output_path: str, output_format: str = 'compact',
+             bundle: Optional[str] = None) -> Dict[str, str]:
+        """Save populated HTML, writing it to the file chunk by chunk
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(str(self.soup.prettify()))
+        With ``bundle`` ('mhtml' or 'zip') the report is saved as one
+        self-contained file embedding each referenced image, video and
+        stylesheet once. Returns the references that could not be embedded.
+        """
+        return write_report(output_path, self.iter_html(output_format), bundle,
+                            report_search_dirs(self.html_path, output_path))
+
+class InspectionSource(NamedTuple):
+    """One inspection payload: a JSON file, or a single line of a JSONL file"""
+    name: str
+    path: str
+    line: Optional[str] = None
+    
+    def load(self) -> Inspection:
+        if self.line is not None:
+            return normalize_inspection(json.loads(self.line))
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return normalize_inspection(json.load(f))
+    
+    def open_stream(self) -> 'InspectionStream':
+        from inspection_stream import InspectionStream, open_inspection_stream
+        if self.line is not None:
+            return InspectionStream(io.StringIO(self.line))
+        return open_inspection_stream(self.path)
+
+
+class RenderOptions(NamedTuple):
+    """How reports are rendered and written"""
+    engine: str = 'dom'
+    stream: bool = False
+    output_format: str = 'compact'
+    prune_empty_sections: bool = True
+    parser: str = 'auto'  # BeautifulSoup tree builder for the dom engine (see select_parser)
+    bundle: Optional[str] = None  # 'mhtml' or 'zip' for a self-contained single file
+    pdf: bool = False  # Also convert each report to PDF (see pdf_export)
+
+
+class BatchResult(NamedTuple):
+    """Outcome of rendering one inspection in a batch"""
+    name: str
+    output_path: str
+    seconds: float
+    error: Optional[str] = None
+    mapping_hits: Optional[Dict[str, int]] = None  # Unmapped-name hits from a pool worker
+    cache: Optional[str] = None  # Render cache tier that served the report, if any
+    pdf_pages: Optional[int] = None  # Pages in the PDF, when converted
+    metrics: Optional[Dict[str, list]] = None  # Metrics snapshot from a pool worker
+    media_failures: int = 0  # Media that could not be fetched or embedded (original URLs kept)
+
+
+def iter_inspection_sources(source: str) -> Iterator[InspectionSource]:
+    """Expand a directory, glob pattern or JSONL file into inspection payloads"""
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, '*.json')) + glob.glob(os.path.join(source, '*.jsonl')))
+    elif os.path.isfile(source):
+        paths = [source]
+    else:
+        paths = sorted(glob.glob(source))
+        if not paths:
+            raise FileNotFoundError(f"No inspections match: {source}")
+    
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if path.endswith('.jsonl'):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    if line.strip():
+                        yield InspectionSource(f"{stem}_{line_no:05d}", path, line)
+        else:
+            yield InspectionSource(stem, path)
+
+
+def iter_report_chunks(html_template: str, inspection: Optional[Inspection],
+                       template=None, options: RenderOptions = RenderOptions(),
+                       inspection_stream: Optional['InspectionStream'] = None) -> Iterator[str]:
+    """Render one populated report as HTML chunks, with a shared, pre-loaded template
+    
+    ``template`` is a parsed template soup for the ``dom`` engine or a compiled
+    plan for the ``compiled`` engine; it is loaded on demand when omitted.
+    Pass ``inspection_stream`` instead of ``inspection`` to populate
+    sections while the inspection is still being parsed.
+    """
+    if options.engine == 'compiled':
+        from trec_template import iter_render_plan
+        plan = template if template is not None else load_shared_template(html_template, options)
+        metrics = Metrics() if _metrics is not None else None
+        if inspection_stream is not None:
+            yield from iter_render_plan(plan, inspection_stream.inspection, inspection_stream.iter_sections(),
+                                        options.prune_empty_sections, metrics)
+        else:
+            yield from iter_render_plan(plan, inspection, prune_empty_sections=options.prune_empty_sections,
+                                        metrics=metrics)
+        if metrics is not None:
+            _metrics.merge(metrics.snapshot())
+        return
+    
+    populator = CompleteTRECPopulator(html_template, '', template_soup=template,
+                                      inspection=inspection,
+                                      inspection_stream=inspection_stream,
+                                      parser=options.parser)
+    if inspection_stream is not None:
+        # Header fields such as the sponsor follow the sections in the file
+        populator.populate_all_sections()
+        populator.populate_header_fields()
+    else:
+        populator.populate_header_fields()
+        populator.populate_all_sections()
+    if options.prune_empty_sections:
+        populator.remove_empty_sections()
+    yield from populator.iter_html(options.output_format)
+    if _metrics is not None:
+        _metrics.merge(populator.metrics.snapshot())
+
+
+def write_report(output_path: str, chunks: Iterable[str], bundle: Optional[str] = None,
+                 search_dirs: Sequence[str] = ()) -> Dict[str, str]:
+    """Write report HTML chunks to ``output_path``, optionally as a bundle
+    
+    Bundles look up relative media and stylesheet references in
+    ``search_dirs``. Returns the references that could not be embedded.
+    The report is written to a temporary file renamed into place once every
+    chunk is out, so a render that fails part-way leaves no partial report.
+    """
+    if bundle is not None:
+        from report_bundle import write_bundle
+        return write_bundle(output_path, ''.join(chunks), bundle, search_dirs)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {}
+
+
+def bundle_extension(bundle: Optional[str]) -> str:
+    """File extension of a report written as ``bundle`` (None for plain HTML)"""
+    if bundle is None:
+        return '.html'
+    from report_bundle import BUNDLE_EXTENSIONS
+    return BUNDLE_EXTENSIONS[bundle]
+
+
+def report_search_dirs(html_template: str, output_path: str) -> Tuple[str, ...]:
+    """Where a report's relative references resolve: its own directory, then the template's
+    
+    Bundles and PDFs only embed files inside these directories, plus the
+    media cache that localized media points into.
+    """
+    search_dirs = (os.path.dirname(os.path.abspath(output_path)),
+                   os.path.dirname(os.path.abspath(html_template)))
+    if _media_store is not None:
+        search_dirs += (_media_store.cache_dir,)
+    return search_dirs
+
+
+def render_report(html_template: str, inspection: Optional[Inspection], output_path: str,
+                  template=None, options: RenderOptions = RenderOptions(),
+                  inspection_stream: Optional['InspectionStream'] = None) -> Dict[str, str]:
+    """Render one populated report to ``output_path`` (see iter_report_chunks)
+    
+    Returns the references a bundle could not embed.
+    """
+    chunks = iter_report_chunks(html_template, inspection, template, options, inspection_stream)
+    return write_report(output_path, chunks, options.bundle, report_search_dirs(html_template, output_path))
+
+
+def load_shared_template(html_template: str, options: RenderOptions = RenderOptions()):
+    """Load the template once for the given engine"""
+    if options.engine == 'compiled':
+        from trec_template import compile_template
+        # The plan is already unindented; only minify changes its static text
+        return compile_template(html_template, minify=options.output_format == 'minify')
+    return load_template(html_template, options.parser)
+
+
+# Source files whose code determines the rendered output
+RENDER_CODE_FILES = ('populate_trec_complete.py', 'trec_content.py', 'trec_template.py', 'inspection_model.py')
+
+_FILE_DIGESTS: Dict[tuple, str] = {}
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, cached by path, mtime and size"""
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    cache_key = (abs_path, stat.st_mtime_ns, stat.st_size)
+    digest = _FILE_DIGESTS.get(cache_key)
+    if digest is None:
+        with open(abs_path, 'rb') as f:
+            digest = _FILE_DIGESTS[cache_key] = hashlib.sha256(f.read()).hexdigest()
+    return digest
+
+
+def render_context_digest(html_template: str, options: RenderOptions = RenderOptions()) -> str:
+    """Digest of everything but the inspection that affects a rendered report
+    
+    Covers the template, its CSS, the mapping tables, the populator code and
+    the output options.
+    """
+    digest = hashlib.sha256()
+    digest.update(file_digest(html_template).encode('ascii'))
+    css_path = os.path.join(os.path.dirname(os.path.abspath(html_template)), 'trec_styles.css')
+    if os.path.exists(css_path):
+        digest.update(file_digest(css_path).encode('ascii'))
+    digest.update(mapping_tables_version().encode('ascii'))
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in RENDER_CODE_FILES:
+        digest.update(file_digest(os.path.join(code_dir, name)).encode('ascii'))
+    # 'auto' is keyed by the builder it resolves to on this machine
+    parser = select_parser(options.parser) if options.engine == 'dom' else None
+    digest.update(repr(options._replace(stream=False, pdf=False, parser=parser)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_cache_key(context: str, inspection: Inspection) -> str:
+    """Cache key for one inspection rendered in a given context
+    
+    The normalized model is hashed, so payload fields the report never uses
+    don't change the key.
+    """
+    return hashlib.sha256(f"{context}\n{inspection!r}".encode('utf-8')).hexdigest()
+
+
+# Active render cache, if one has been configured (see use_render_cache)
+_render_cache: Optional['RenderCache'] = None
+
+
+def use_render_cache(cache: Optional['RenderCache']) -> None:
+    """Serve repeated renders from ``cache`` (None disables caching)"""
+    global _render_cache
+    _render_cache = cache
+
+
+def render_report_cached(html_template: str, inspection: Inspection, output_path: str,
+                         template=None, options: RenderOptions = RenderOptions()
+                         ) -> Tuple[Optional[str], Dict[str, str]]:
+    """render_report through the active render cache
+    
+    Returns the tier that served the report ('memory' or 'disk', None when it
+    was rendered) and the references a bundle could not embed. Bundles cache
+    the report HTML and re-embed media on every write.
+    """
+    if _render_cache is None:
+        return None, render_report(html_template, inspection, output_path, template, options)
+    key = render_cache_key(render_context_digest(html_template, options), inspection)
+    html_out, tier = _render_cache.lookup(key)
+    if html_out is None:
+        html_out = ''.join(iter_report_chunks(html_template, inspection, template, options))
+        _render_cache.put(key, html_out)
+    return tier, write_report(output_path, [html_out], options.bundle,
+                              report_search_dirs(html_template, output_path))
+
+
+# Active media store, if one has been configured (see use_media_store)
+_media_store: Optional['MediaStore'] = None
+
+
+def use_media_store(store: Optional['MediaStore']) -> None:
+    """Rewrite report media to files cached by ``store`` (None keeps original URLs)"""
+    global _media_store
+    _media_store = store
+
+
+# Metrics aggregated over every report rendered, if enabled (see use_metrics)
+_metrics: Optional[Metrics] = None
+
+
+def use_metrics(metrics: Optional[Metrics]) -> None:
+    """Collect populator timers and counters into ``metrics`` (None disables)"""
+    global _metrics
+    _metrics = metrics
+
+
+def batch_output_path(output_dir: str, name: str, options: RenderOptions) -> str:
+    """Where a batch writes the report for inspection ``name``"""
+    return os.path.join(output_dir, f"{name}{bundle_extension(options.bundle)}")
+
+
+def render_source(inspection: InspectionSource, html_template: str, output_dir: str,
+                  template, options: RenderOptions = RenderOptions()) -> BatchResult:
+    """Render one batch input, capturing any failure in the result"""
+    output_path = batch_output_path(output_dir, inspection.name, options)
+    start = time.perf_counter()
+    media_failures = len(_media_store.failures) if _media_store is not None else 0
+    unembedded: Dict[str, str] = {}
+    pdf_pages = None
+    with report_context(report=inspection.name):
+        try:
+            # Streamed inspections are never held whole, so they bypass the render cache
+            if options.stream:
+                inspection_stream = inspection.open_stream()
+                if _media_store is not None:
+                    from media_pipeline import LocalizedInspectionStream
+                    inspection_stream = LocalizedInspectionStream(inspection_stream, _media_store, output_dir)
+                unembedded = render_report(html_template, None, output_path, template, options,
+                                           inspection_stream=inspection_stream)
+                cache_tier = None
+            else:
+                inspection_model = inspection.load()
+                update_report_context(inspection=inspection_model.id)
+                if _media_store is not None:
+                    inspection_model = _media_store.localize(inspection_model, output_dir)
+                cache_tier, unembedded = render_report_cached(html_template, inspection_model,
+                                                              output_path, template, options)
+            if options.pdf:
+                from pdf_export import pdf_path_for, write_pdf
+                pdf_pages = write_pdf(output_path, pdf_path_for(output_path),
+                                      report_search_dirs(html_template, output_path))
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            cache_tier = None
+            log.debug("Render failed", exc_info=True)
+        for reference, reason in unembedded.items():
+            log.debug("Could not embed %s: %s", reference, reason)
+    if _media_store is not None:
+        media_failures = len(_media_store.failures) - media_failures
+    media_failures += len(unembedded)
+    seconds = time.perf_counter() - start
+    if _metrics is not None:
+        _metrics.add_time(metric_key('report', {'engine': options.engine}), seconds)
+        _metrics.count('reports', status='failed' if error else 'ok')
+    return BatchResult(inspection.name, output_path, seconds, error,
+                       cache=cache_tier, media_failures=media_failures, pdf_pages=pdf_pages)
+
+
+# Per-process state for pool workers, set up once by init_render_worker
+_WORKER_STATE: Dict[str, Any] = {}
+INCREMENTAL_RENDERERS = 64  # Inspections whose last render a worker keeps for incremental re-renders
+
+
+def init_render_worker(html_template: str, output_dir: Optional[str], options: RenderOptions,
+                       mapping_cache_path: Optional[str],
+                       render_cache_config: Optional[Dict[str, Any]] = None,
+                       media_store_config: Optional[Dict[str, Any]] = None,
+                       collect_metrics: bool = False,
+                       log_config: Optional[Dict[str, str]] = None) -> None:
+    """Load the template (and learned mappings) once per worker process"""
+    if log_config is not None:
+        configure_logging(**log_config)
+    # Workers only count hits; the parent merges them and writes the file
+    use_mapping_cache(MappingCache.load(mapping_cache_path) if mapping_cache_path else None)
+    if render_cache_config:
+        from render_cache import RenderCache
+        use_render_cache(RenderCache(**render_cache_config))
+    if media_store_config:
+        from media_pipeline import MediaStore
+        use_media_store(MediaStore(**media_store_config))
+    use_metrics(Metrics() if collect_metrics else None)
+    _WORKER_STATE.update(
+        html_template=html_template,
+        output_dir=output_dir,
+        template=load_shared_template(html_template, options),
+        options=options,
+    )
+
+
+def _render_in_worker(inspection: InspectionSource) -> BatchResult:
+    state = _WORKER_STATE
+    result = render_source(inspection, state['html_template'], state['output_dir'],
+                           state['template'], state['options'])
+    mapping_cache = active_mapping_cache()
+    if mapping_cache is not None:
+        result = result._replace(mapping_hits=mapping_cache.drain_pending())
+    if _metrics is not None:
+        # Sent per report and reset, so the parent can add them up
+        result = result._replace(metrics=_metrics.snapshot())
+        use_metrics(Metrics())
+    return result
+
+
+def is_object_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(entry, dict) for entry in value)
+
+
+def check_payload_shape(data: Dict[str, Any]) -> None:
+    """Raise ValueError unless the inspection, its sections and their line items are JSON objects"""
+    inspection = data.get('inspection', {})
+    if not isinstance(inspection, dict):
+        raise ValueError("'inspection' must be a JSON object")
+    sections = inspection.get('sections') or []
+    if not is_object_list(sections):
+        raise ValueError("'inspection.sections' must be a list of objects")
+    for index, section in enumerate(sections):
+        if not is_object_list(section.get('lineItems') or []):
+            raise ValueError(f"'inspection.sections[{index}].lineItems' must be a list of objects")
+
+
+def parse_inspection_payload(payload: bytes) -> Inspection:
+    """Normalize a raw inspection JSON payload
+    
+    Raises ValueError for a payload that is not an inspection JSON object,
+    or whose nested fields have the wrong JSON types.
+    """
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        raise ValueError("Inspection payload must be a JSON object")
+    check_payload_shape(data)
+    try:
+        return normalize_inspection(data)
+    except (AttributeError, TypeError) as e:
+        # Deeper fields of the wrong type, e.g. a string for 'clientInfo' or a comment
+        raise ValueError(f"Malformed inspection payload: {e}") from None
+
+
+def render_incremental(inspection: Inspection) -> str:
+    """Re-render an inspection from this worker's previous render of it (compiled engine)"""
+    from trec_template import IncrementalRenderer
+    state = _WORKER_STATE
+    renderers = state.setdefault('incremental', OrderedDict())
+    renderer = renderers.pop(inspection.id, None)
+    if renderer is None:
+        renderer = IncrementalRenderer(state['template'], state['options'].prune_empty_sections)
+    renderers[inspection.id] = renderer
+    while len(renderers) > INCREMENTAL_RENDERERS:
+        renderers.popitem(last=False)
+    return renderer.render(inspection)
+
+
+def render_inspection_in_worker(inspection: Inspection) -> Tuple[str, Optional[Dict[str, int]]]:
+    """Render an inspection to HTML in a pool worker
+    
+    The compiled engine re-renders incrementally from the worker's previous
+    render of the same inspection. Returns the HTML and the learned-mapping
+    hits for the parent to merge.
+    """
+    state = _WORKER_STATE
+    with report_context(inspection=inspection.id):
+        if state['options'].engine == 'compiled':
+            html_out = render_incremental(inspection)
+        else:
+            html_out = ''.join(iter_report_chunks(state['html_template'], inspection,
+                                                  state['template'], state['options']))
+    mapping_cache = active_mapping_cache()
+    hits = mapping_cache.drain_pending() if mapping_cache is not None else None
+    return html_out, hits
+
+
+def run_batch(source: str, html_template: str, output_dir: str,
+              options: RenderOptions = RenderOptions(), workers: int = 1) -> List[BatchResult]:
+    """Render every inspection in ``source``
+    
+    With ``workers`` > 1 inspections are fanned out over a process pool, each
+    worker loading the template once. Results are returned in input order and a
+    failing inspection only fails its own entry.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    inspections = list(iter_inspection_sources(source))
+    
+    if workers <= 1:
+        template = load_shared_template(html_template, options)
+        return [render_source(inspection, html_template, output_dir, template, options)
+                for inspection in inspections]
+    
+    from concurrent.futures import ProcessPoolExecutor
+    
+    results = []
+    mapping_cache = active_mapping_cache()
+    mapping_cache_path = mapping_cache.path if mapping_cache is not None else None
+    render_cache_config = _render_cache.config() if _render_cache is not None else None
+    media_store_config = _media_store.config() if _media_store is not None else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                             initargs=(html_template, output_dir, options,
+                                       mapping_cache_path, render_cache_config,
+                                       media_store_config, _metrics is not None,
+                                       logging_config())) as executor:
+        futures = [executor.submit(_render_in_worker, inspection) for inspection in inspections]
+        for inspection, future in zip(inspections, futures):
+            try:
+                result = future.result()
+                if result.mapping_hits and mapping_cache is not None:
+                    mapping_cache.merge_hits(result.mapping_hits)
+                if result.metrics and _metrics is not None:
+                    _metrics.merge(result.metrics)
+                results.append(result)
+            except Exception as e:
+                # The worker itself died (e.g. killed or out of memory)
+                output_path = batch_output_path(output_dir, inspection.name, options)
+                results.append(BatchResult(inspection.name, output_path, 0.0, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def print_batch_summary(results: List[BatchResult], wall_seconds: float) -> None:
+    """Print per-report timings and failures"""
+    print(f"{'Report':<40} {'Time (ms)':>10}  Status")
+    print("-" * 70)
+    for result in results:
+        if result.error is not None:
+            status = f"FAILED ({result.error})"
+        else:
+            status = f"OK (cached, {result.cache})" if result.cache else "OK"
+            if result.pdf_pages is not None:
+                status += f", PDF {result.pdf_pages} page(s)"
+        print(f"{result.name:<40} {result.seconds * 1000:>10.1f}  {status}")
+    print("-" * 70)
+    
+    failures = [r for r in results if r.error is not None]
+    succeeded = len(results) - len(failures)
+    print(f"Rendered {succeeded}/{len(results)} reports in {wall_seconds:.2f}s", end='')
+    if succeeded:
+        print(f" ({succeeded / wall_seconds:.1f} reports/s)")
+    else:
+        print()
+    if _render_cache is not None:
+        cached = [r.cache for r in results if r.cache]
+        print(f"Render cache: {len(cached)} hit(s) ({cached.count('memory')} memory, "
+              f"{cached.count('disk')} disk), {succeeded - len(cached)} rendered")
+    media_failures = sum(r.media_failures for r in results)
+    if media_failures:
+        print(f"[WARN] {media_failures} media file(s) could not be cached or embedded; original URLs were kept")
+    if failures:
+        print(f"[ERROR] {len(failures)} report(s) failed")
+
+
+def startup_parser() -> argparse.ArgumentParser:
+    """--version, --check and --template, answered before parse_args imports the feature modules"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--version', action='version', version=f"%(prog)s {__version__}")
+    parser.add_argument('--check', action='store_true',
+                        help="Report which engines and optional features are available, and exit")
+    parser.add_argument('--template', default="TREC_Report_All.html", help="TREC HTML template")
+    return parser
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    from media_pipeline import DEFAULT_FETCH_WORKERS
+    from render_cache import DEFAULT_DISK_BYTES
+    from report_bundle import BUNDLE_FORMATS
+    parser = argparse.ArgumentParser(description="Populate TREC HTML reports from inspection JSON",
+                                     parents=[startup_parser()])
+    parser.add_argument('--inspection', default="inspection.json", help="Inspection JSON (single report)")
+    parser.add_argument('--output', default="TREC_Report_Filled_Improved.html", help="Output HTML (single report)")
+    parser.add_argument('--batch', metavar='SOURCE',
+                        help="Directory, glob or JSONL file of inspections to render in one process")
+    parser.add_argument('--out-dir', default="reports", help="Output directory for --batch")
+    parser.add_argument('--engine', choices=['dom', 'compiled'], default='dom',
+                        help="Render with BeautifulSoup (dom) or the compiled template plan")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes for --batch (0 = one per CPU core)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Parse inspections incrementally, populating sections as they are read")
+    parser.add_argument('--parser', choices=('auto',) + PARSER_BACKENDS, default='auto',
+                        help="BeautifulSoup tree builder for the dom engine (auto: lxml when "
+                             "installed, else html.parser)")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='compact',
+                        help="Write reports unindented (compact), with whitespace collapsed "
+                             "(minify) or re-indented (pretty, slowest)")
+    parser.add_argument('--bundle', choices=BUNDLE_FORMATS,
+                        help="Write each report as one self-contained file (MHTML or zip) embedding "
+                             "every referenced image, video and stylesheet once")
+    parser.add_argument('--pdf', action='store_true',
+                        help="Also convert each report to PDF with WeasyPrint, numbering pages "
+                             "from the real layout")
+    parser.add_argument('--keep-empty-sections', action='store_true',
+                        help="Keep TREC sections with no populated items")
+    parser.add_argument('--render-cache', metavar='DIR',
+                        help="Cache rendered --batch reports in DIR, keyed by inspection, "
+                             "template, mappings and code")
+    parser.add_argument('--render-cache-mb', type=int, default=DEFAULT_DISK_BYTES // (1024 * 1024),
+                        help="Size limit for the --render-cache directory (least recently used "
+                             "reports are evicted)")
+    parser.add_argument('--media-cache', metavar='DIR',
+                        help="Fetch photos and videos into DIR (content-hashed, with report-sized "
+                             "thumbnails) and reference the cached files from the reports")
+    parser.add_argument('--media-workers', type=int, default=DEFAULT_FETCH_WORKERS,
+                        help="Concurrent media downloads per process for --media-cache")
+    parser.add_argument('--media-local-root', action='append', default=[], metavar='DIR',
+                        help="Let --media-cache copy local paths and file:// URLs from inside DIR "
+                             "(repeatable; by default only http(s) media is fetched)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="Write populator timers and counters (summed over the batch) to FILE "
+                             "('-' for stdout)")
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default='json',
+                        help="Format for --metrics: JSON or Prometheus text exposition")
+    parser.add_argument('--log-level', choices=LOG_LEVELS,
+                        help="Least severe messages to log to stderr (default: info for a single "
+                             "report, warning for --batch)")
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text',
+                        help="Log plain text or one JSON object per line, with the report, "
+                             "inspection id and worker of each message")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Log per-item progress (same as --log-level debug)")
+    parser.add_argument('--mapping-cache', default=MAPPING_CACHE_PATH,
+                        help="Learned line-item mapping cache file")
+    parser.add_argument('--no-mapping-cache', action='store_true',
+                        help="Resolve unmapped names with fuzzy matching only, without the cache")
+    parser.add_argument('--mapping-report', nargs='?', type=int, const=20, metavar='N',
+                        help="Print the N most frequent unmapped line-item names and exit")
+    return parser.parse_args(argv)
+
+
+def render_options(args: argparse.Namespace) -> RenderOptions:
+    return RenderOptions(engine=args.engine, stream=args.stream,
+                         output_format=args.output_format, parser=args.parser,
+                         prune_empty_sections=not args.keep_empty_sections,
+                         bundle=args.bundle, pdf=args.pdf)
+
+
+def batch_main(args: argparse.Namespace) -> int:
+    """Batch entry point"""
+    print("=" * 70)
+    print("Complete TREC HTML Populator (batch)")
+    print("=" * 70)
+    
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    start = time.perf_counter()
+    try:
+        results = run_batch(args.batch, args.template, args.out_dir, render_options(args), workers)
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e}")
+        return 1
+    print_batch_summary(results, time.perf_counter() - start)
+    return 1 if any(r.error for r in results) else 0
+
 
 def main():
     """Main function"""
+    startup_args, _ = startup_parser().parse_known_args()
+    if startup_args.check:
+        sys.exit(check_environment(startup_args.template))
+    
+    args = parse_args()
+    # Per-item detail is noise across a whole batch, so batches default to warnings only
+    configure_logging(args.log_level or ('debug' if args.verbose else 'warning' if args.batch else 'info'),
+                      args.log_format)
+    
+    if args.mapping_report is not None:
+        print_mapping_report(MappingCache.load(args.mapping_cache), args.mapping_report)
+        return
+    
+    if args.engine == 'dom' and not HAS_BS4:
+        print("Error: BeautifulSoup4 is required for the dom engine. "
+              "Install with: pip install beautifulsoup4 (or use --engine compiled)")
+        sys.exit(1)
+    
+    if args.pdf:
+        if args.bundle:
+            print("Error: --pdf converts the report HTML and cannot be combined with --bundle")
+            sys.exit(1)
+        from pdf_export import HAS_WEASYPRINT
+        if not HAS_WEASYPRINT:
+            print("Error: WeasyPrint is required for --pdf. Install with: pip install weasyprint")
+            sys.exit(1)
+    
+    mapping_cache = None if args.no_mapping_cache else MappingCache.load(args.mapping_cache)
+    use_mapping_cache(mapping_cache)
+    if args.metrics:
+        use_metrics(Metrics())
+    if args.media_cache:
+        from media_pipeline import MediaStore
+        use_media_store(MediaStore(args.media_cache, workers=args.media_workers,
+                                   local_roots=args.media_local_root))
+    if args.render_cache:
+        from render_cache import RenderCache
+        use_render_cache(RenderCache(disk_dir=args.render_cache,
+                                     disk_max_bytes=args.render_cache_mb * 1024 * 1024))
+    try:
+        if args.batch:
+            sys.exit(batch_main(args))
+        single_main(args)
+    finally:
+        if mapping_cache is not None:
+            mapping_cache.save()
+        if _metrics is not None:
+            write_metrics(_metrics, args.metrics, args.metrics_format)
+
+
+def write_metrics(metrics: Metrics, path: str, output_format: str) -> None:
+    """Write metrics to a file, or to stdout for '-'"""
+    text = metrics.render(output_format)
+    if path == '-':
+        sys.stdout.write(text)
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def check_environment(html_template: str) -> int:
+    """Print what this installation can run, without importing the optional packages
+    
+    Returns 1 when no report can be rendered (the template is missing).
+    """
+    checks = [
+        (f"Python {sys.version.split()[0]}", True, ''),
+        (f"Template {html_template}", os.path.isfile(html_template), "not found"),
+        ("beautifulsoup4 (dom engine)", HAS_BS4, "missing; use --engine compiled"),
+        ("lxml (fastest --parser)", find_spec('lxml') is not None, "missing; html.parser is used"),
+        ("html5lib (--parser html5lib)", find_spec('html5lib') is not None, "missing"),
+        ("Pillow (--media-cache thumbnails)", find_spec('PIL') is not None, "missing; originals are referenced"),
+        ("WeasyPrint (--pdf)", find_spec('weasyprint') is not None, "missing"),
+    ]
+    print(f"{os.path.basename(sys.argv[0]) or 'populate_trec_complete.py'} {__version__}")
+    for label, ok, problem in checks:
+        print(f"   [{'OK' if ok else 'MISSING'}] {label}" + ('' if ok else f": {problem}"))
+    return 0 if os.path.isfile(html_template) else 1
+
+
+def print_mapping_report(cache: MappingCache, limit: int) -> None:
+    """Print the most frequent line-item names with no mapping"""
+    unmapped = cache.hottest_unmapped(limit)
+    if not unmapped:
+        print("No unmapped line-item names recorded")
+        return
+    print(f"{'Hits':>6}  Unmapped line-item name")
+    print("-" * 70)
+    for name, hits in unmapped:
+        print(f"{hits:>6}  {name}")
+
+
+def single_main(args: argparse.Namespace) -> None:
+    """Render a single report"""
     print("=" * 70)
     print("Complete TREC HTML Populator")
     print("=" * 70)
     
-    html_template = "TREC_Report_All.html"
-    inspection_json = "inspection.json"
-    output_file = "TREC_Report_Filled_Improved.html"
+    html_template = args.template
+    inspection_json = args.inspection
+    output_file = args.output
+    if args.bundle and os.path.splitext(output_file)[1].lower() in ('.html', '.htm'):
+        output_file = os.path.splitext(output_file)[0] + bundle_extension(args.bundle)
     
     try:
-        populator = CompleteTRECPopulator(html_template, inspection_json)
-        
-        print("\n[1/4] Populating header fields...")
-        populator.populate_header_fields()
-        print("   [OK] Header fields populated")
-        
-        print("\n[2/4] Populating all sections...")
-        populator.populate_all_sections()
-        print("   [OK] All sections processed")
-        
-        print("\n[3/4] Removing empty sections...")
-        populator.remove_empty_sections()
-        print("   [OK] Empty sections removed")
-        
-        print(f"\n[4/4] Saving to {output_file}...")
-        populator.save(output_file)
-        print(f"   [OK] Saved to {output_file}")
+        if args.engine == 'compiled':
+            render_single_compiled(args, output_file)
+            return
+        with report_context():
+            populator = CompleteTRECPopulator(html_template, inspection_json, stream=args.stream,
+                                              parser=args.parser)
+            update_report_context(inspection=populator.inspection.id)
+            if _media_store is not None:
+                populator.localize_media(_media_store, os.path.dirname(os.path.abspath(output_file)))
+            
+            steps = [
+                ("Populating header fields", populator.populate_header_fields, "Header fields populated"),
+                ("Populating all sections", populator.populate_all_sections, "All sections processed"),
+            ]
+            if args.stream:
+                # Header fields such as the sponsor follow the sections in the file
+                steps.reverse()
+            for step, (label, populate, done) in enumerate(steps, 1):
+                log.info("[%d/4] %s...", step, label)
+                populate()
+                log.info("   [OK] %s", done)
+            
+            log.info("[3/4] Removing empty sections...")
+            if args.keep_empty_sections:
+                log.info("   [SKIP] Keeping empty sections")
+            else:
+                populator.remove_empty_sections()
+                log.info("   [OK] Empty sections removed")
+            
+            log.info("[4/4] Saving to %s...", output_file)
+            unembedded = populator.save(output_file, args.output_format, args.bundle)
+            log.info("   [OK] Saved to %s", output_file)
+            if _metrics is not None:
+                _metrics.merge(populator.metrics.snapshot())
+            for reference, error in unembedded.items():
+                log.warning("Could not embed %s: %s", reference, error)
+            if args.pdf:
+                from pdf_export import pdf_path_for, write_pdf
+                pdf_file = pdf_path_for(output_file)
+                pages = write_pdf(output_file, pdf_file, report_search_dirs(html_template, output_file))
+                log.info("   [OK] PDF saved to %s (%d pages)", pdf_file, pages)
+            if _media_store is not None:
+                log.info("   [MEDIA] %d file(s) cached in %s", len(_media_store.resolved), _media_store.cache_dir)
+                for url, error in _media_store.failures.items():
+                    log.warning("Could not cache %s: %s", url, error)
         
-        print("\n" + "=" * 70)
-        print(f"[SUCCESS] Populated HTML saved to: {output_file}")
-        print("You can now open the file in a web browser to view the filled form.")
+        print_single_success(output_file)
         
     except FileNotFoundError as e:
-        print(f"Error: File not found: {e}")
+        log.error("File not found: %s", e)
     except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON: {e}")
+        log.error("Invalid JSON: %s", e)
     except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error("%s", e, exc_info=True)
+
+def render_single_compiled(args: argparse.Namespace, output_file: str) -> None:
+    """Render a single report from the compiled template plan, without BeautifulSoup"""
+    options = render_options(args)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    with report_context():
+        log.info("[1/2] Compiling template %s...", args.template)
+        plan = load_shared_template(args.template, options)
+        log.info("[2/2] Rendering to %s...", output_file)
+        if args.stream:
+            from inspection_stream import open_inspection_stream
+            inspection_stream = open_inspection_stream(args.inspection)
+            if _media_store is not None:
+                from media_pipeline import LocalizedInspectionStream
+                inspection_stream = LocalizedInspectionStream(inspection_stream, _media_store, output_dir)
+            unembedded = render_report(args.template, None, output_file, plan, options,
+                                       inspection_stream=inspection_stream)
+        else:
+            inspection = InspectionSource(args.inspection, args.inspection).load()
+            update_report_context(inspection=inspection.id)
+            if _media_store is not None:
+                inspection = _media_store.localize(inspection, output_dir)
+            unembedded = render_report(args.template, inspection, output_file, plan, options)
+        log.info("   [OK] Saved to %s", output_file)
+        for reference, error in unembedded.items():
+            log.warning("Could not embed %s: %s", reference, error)
+        if args.pdf:
+            from pdf_export import pdf_path_for, write_pdf
+            pdf_file = pdf_path_for(output_file)
+            pages = write_pdf(output_file, pdf_file, report_search_dirs(args.template, output_file))
+            log.info("   [OK] PDF saved to %s (%d pages)", pdf_file, pages)
+        if _media_store is not None:
+            for url, error in _media_store.failures.items():
+                log.warning("Could not cache %s: %s", url, error)
+    print_single_success(output_file)
+
+
+def print_single_success(output_file: str) -> None:
+    print("=" * 70)
+    print(f"[SUCCESS] Populated HTML saved to: {output_file}")
+    print("You can now open the file in a web browser to view the filled form.")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Render Cache
+Content-addressed store of rendered report HTML: an in-memory LRU tier in
+front of an optional on-disk tier with size-based eviction.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_MEMORY_ENTRIES = 128
+DEFAULT_DISK_BYTES = 512 * 1024 * 1024
+
+
+class RenderCache:
+    """Rendered HTML keyed by a content hash of everything that affects it
+
+    Keys are hex digests; see ``render_cache_key`` in populate_trec_complete.
+    The disk tier is shared safely between processes (entries are written
+    atomically) and evicts least recently used files once it grows past
+    ``disk_max_bytes``.
+    """
+
+    def __init__(self, memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+                 disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = DEFAULT_DISK_BYTES):
+        self.memory_entries = memory_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.memory: 'OrderedDict[str, str]' = OrderedDict()
+        # Raw request payload digest -> render key, to skip re-normalizing repeats
+        self.aliases: 'OrderedDict[str, str]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self.disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def config(self) -> Dict[str, object]:
+        """Constructor arguments, to open the same cache in another process"""
+        return {'memory_entries': self.memory_entries, 'disk_dir': self.disk_dir,
+                'disk_max_bytes': self.disk_max_bytes}
+
+    # -- memory tier ---------------------------------------------------------
+
+    def _remember(self, key: str, html_out: str) -> None:
+        self.memory[key] = html_out
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def resolve_alias(self, alias: str) -> Optional[str]:
+        with self.lock:
+            key = self.aliases.get(alias)
+            if key is not None:
+                self.aliases.move_to_end(alias)
+            return key
+
+    def add_alias(self, alias: str, key: str) -> None:
+        with self.lock:
+            self.aliases[alias] = key
+            self.aliases.move_to_end(alias)
+            while len(self.aliases) > self.memory_entries * 4:
+                self.aliases.popitem(last=False)
+
+    # -- disk tier -----------------------------------------------------------
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.html")
+
+    def _disk_entries(self) -> List[Tuple[float, str, int]]:
+        """(mtime, path, size) of every cached file"""
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.html'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _read_disk(self, key: str) -> Optional[str]:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                html_out = f.read()
+            os.utime(path)  # Mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        return html_out
+
+    def _write_disk(self, key: str, html_out: str) -> None:
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(html_out)
+        if os.path.exists(path):
+            self.disk_bytes -= os.path.getsize(path)
+        os.replace(tmp_path, path)
+        self.disk_bytes += os.path.getsize(path)
+        if self.disk_bytes > self.disk_max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used files until the tier fits its budget"""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.counters['evictions'] += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.disk_bytes = total
+
+    # -- public API ----------------------------------------------------------
+
+    def lookup(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """(html, tier) for a cached render, or (None, None) on a miss"""
+        with self.lock:
+            html_out = self.memory.get(key)
+            if html_out is not None:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return html_out, 'memory'
+            if self.disk_dir:
+                html_out = self._read_disk(key)
+                if html_out is not None:
+                    self._remember(key, html_out)
+                    self.counters['disk_hits'] += 1
+                    return html_out, 'disk'
+            self.counters['misses'] += 1
+            return None, None
+
+    def put(self, key: str, html_out: str) -> None:
+        with self.lock:
+            self._remember(key, html_out)
+            if self.disk_dir:
+                self._write_disk(key, html_out)
+            self.counters['stores'] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and tier sizes"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self.memory)
+            stats['disk_bytes'] = self.disk_bytes
+            return stats
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report Bundle
+Packs a rendered report and every image, video and stylesheet it references
+into one file for offline delivery: an MHTML document (opens directly in
+Chrome/Edge) or a zip archive. Each unique asset is stored once, however many
+times the report references it, and assets are streamed into the bundle
+rather than held in memory.
+"""
+import base64
+import hashlib
+import html
+import mimetypes
+import os
+import quopri
+import re
+import shutil
+import tempfile
+import urllib.parse
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from media_pipeline import DEFAULT_FETCH_WORKERS, is_within, open_media, guess_extension
+
+BUNDLE_FORMATS = ('mhtml', 'zip')
+BUNDLE_EXTENSIONS = {'mhtml': '.mhtml', 'zip': '.zip'}
+
+# Tags whose attributes load a resource the report needs to display
+RESOURCE_TAG = re.compile(r'<(img|video|source|link)\b[^>]*>', re.IGNORECASE)
+RESOURCE_ATTR = re.compile(r'\b(src|poster|href)="([^"]*)"', re.IGNORECASE)
+STYLESHEET_REL = re.compile(r'\brel="stylesheet"', re.IGNORECASE)
+
+COPY_CHUNK = 256 * 1024
+# 57 input bytes -> one 76 character base64 line, as MIME requires
+BASE64_LINE_BYTES = 57
+BASE64_CHUNK = BASE64_LINE_BYTES * 4096
+
+
+class BundleAsset(NamedTuple):
+    """A referenced file, identified by the hash of its contents"""
+    sha: str
+    path: str
+    content_type: str
+    extension: str
+
+
+def iter_resource_references(html_text: str) -> Iterable[str]:
+    """Resource URLs referenced by the report (images, videos, stylesheets)"""
+    for tag in RESOURCE_TAG.finditer(html_text):
+        is_link = tag.group(1).lower() == 'link'
+        if is_link and not STYLESHEET_REL.search(tag.group(0)):
+            continue
+        for attr in RESOURCE_ATTR.finditer(tag.group(0)):
+            if (attr.group(1).lower() == 'href') != is_link:
+                continue
+            reference = html.unescape(attr.group(2))
+            if reference and not reference.startswith(('data:', 'cid:', '#')):
+                yield reference
+
+
+def rewrite_references(html_text: str, targets: Dict[str, str]) -> str:
+    """Point resource attributes at their bundled copies"""
+    def rewrite_attr(attr):
+        target = targets.get(html.unescape(attr.group(2)))
+        if target is None:
+            return attr.group(0)
+        return f'{attr.group(1)}="{html.escape(target)}"'
+
+    def rewrite_tag(tag):
+        return RESOURCE_ATTR.sub(rewrite_attr, tag.group(0))
+
+    return RESOURCE_TAG.sub(rewrite_tag, html_text)
+
+
+def resolve_local_reference(reference: str, search_dirs: Iterable[str]) -> Optional[str]:
+    """Path of a relative reference, trying each search directory in turn
+
+    Only files inside one of ``search_dirs`` resolve: absolute paths, file://
+    URLs and references that climb out of every search directory (``../``
+    or a symlink) are never embedded, since payloads choose their media URLs.
+    """
+    parsed = urllib.parse.urlparse(reference)
+    if parsed.scheme or parsed.netloc:  # Includes file:// and Windows drive paths
+        return None
+    relative = urllib.parse.unquote(parsed.path)
+    if not relative or os.path.isabs(relative):
+        return None
+    search_dirs = list(search_dirs)
+    for directory in search_dirs:
+        path = os.path.realpath(os.path.join(directory, relative))
+        if os.path.isfile(path) and any(is_within(path, root) for root in search_dirs):
+            return path
+    return None
+
+
+class AssetCollector:
+    """Locates referenced files, spooling remote ones to a temporary directory"""
+
+    def __init__(self, search_dirs: List[str], spool_dir: str):
+        self.search_dirs = search_dirs
+        self.spool_dir = spool_dir
+        self.failures: Dict[str, str] = {}
+
+    def _local_path(self, reference: str) -> Optional[str]:
+        if urllib.parse.urlparse(reference).scheme in ('http', 'https'):
+            return None
+        path = resolve_local_reference(reference, self.search_dirs)
+        if path is None:
+            raise FileNotFoundError(f"{reference} is not a file in the report's asset directories")
+        return path
+
+    def collect(self, reference: str) -> Optional[BundleAsset]:
+        """Hash one referenced file (streamed); None if it can't be read"""
+        digest = hashlib.sha256()
+        try:
+            path = self._local_path(reference)
+            if path is None:
+                # Remote: download once, hashing as it is written
+                name = hashlib.sha256(reference.encode('utf-8')).hexdigest()
+                path = os.path.join(self.spool_dir, f"{name}.part")
+                with open_media(reference) as source, open(path, 'wb') as out:
+                    headers = getattr(source, 'headers', None)
+                    content_type = headers.get_content_type() if headers is not None else None
+                    for chunk in iter(lambda: source.read(COPY_CHUNK), b''):
+                        digest.update(chunk)
+                        out.write(chunk)
+            else:
+                content_type = None
+                with open(path, 'rb') as source:
+                    for chunk in iter(lambda: source.read(COPY_CHUNK), b''):
+                        digest.update(chunk)
+        except Exception as e:
+            self.failures[reference] = f"{type(e).__name__}: {e}"
+            return None
+        content_type = content_type or mimetypes.guess_type(reference)[0] or 'application/octet-stream'
+        return BundleAsset(digest.hexdigest(), path, content_type, guess_extension(reference, content_type))
+
+
+def collect_assets(html_text: str, collector: AssetCollector,
+                   workers: int = DEFAULT_FETCH_WORKERS) -> Dict[str, BundleAsset]:
+    """reference -> asset for every readable resource the report references
+
+    Each unique reference is hashed (and downloaded, if remote) once, on a
+    bounded thread pool.
+    """
+    references = list(dict.fromkeys(iter_resource_references(html_text)))
+    if not references:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(references)))) as executor:
+        collected = list(executor.map(collector.collect, references))
+    return {reference: asset for reference, asset in zip(references, collected) if asset is not None}
+
+
+def unique_assets(assets: Dict[str, BundleAsset]) -> List[BundleAsset]:
+    return list({asset.sha: asset for asset in assets.values()}.values())
+
+
+def write_mhtml(output_path: str, html_text: str, assets: Dict[str, BundleAsset]) -> None:
+    """Write a multipart/related MHTML document with each unique asset once"""
+    html_text = rewrite_references(html_text, {ref: f"cid:{asset.sha}@trec-report"
+                                               for ref, asset in assets.items()})
+    boundary = "----=_TREC_" + hashlib.sha256(html_text.encode('utf-8')).hexdigest()[:24]
+    with open(output_path, 'wb') as out:
+        out.write((
+            "From: <Saved by TREC Report Generator>\r\n"
+            "Subject: TREC Property Inspection Report\r\n"
+            "MIME-Version: 1.0\r\n"
+            f'Content-Type: multipart/related; type="text/html"; boundary="{boundary}"\r\n'
+            "\r\n"
+            f"--{boundary}\r\n"
+            'Content-Type: text/html; charset="utf-8"\r\n'
+            "Content-Transfer-Encoding: quoted-printable\r\n"
+            "Content-Location: report.html\r\n"
+            "\r\n").encode('ascii'))
+        out.write(quopri.encodestring(html_text.encode('utf-8')).replace(b'\n', b'\r\n'))
+        for asset in unique_assets(assets):
+            out.write((
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {asset.content_type}\r\n"
+                "Content-Transfer-Encoding: base64\r\n"
+                f"Content-ID: <{asset.sha}@trec-report>\r\n"
+                "\r\n").encode('ascii'))
+            with open(asset.path, 'rb') as source:
+                for chunk in iter(lambda: source.read(BASE64_CHUNK), b''):
+                    for start in range(0, len(chunk), BASE64_LINE_BYTES):
+                        out.write(base64.b64encode(chunk[start:start + BASE64_LINE_BYTES]) + b'\r\n')
+        out.write(f"\r\n--{boundary}--\r\n".encode('ascii'))
+
+
+# Already-compressed media gains nothing from deflate
+STORED_TYPES = ('image/', 'video/', 'audio/')
+
+
+def write_zip(output_path: str, html_text: str, assets: Dict[str, BundleAsset]) -> None:
+    """Write report.html plus media/<sha><ext> for each unique asset"""
+    html_text = rewrite_references(html_text, {ref: f"media/{asset.sha}{asset.extension}"
+                                               for ref, asset in assets.items()})
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('report.html', html_text)
+        for asset in unique_assets(assets):
+            entry_info = zipfile.ZipInfo(f"media/{asset.sha}{asset.extension}")
+            entry_info.compress_type = (zipfile.ZIP_STORED if asset.content_type.startswith(STORED_TYPES)
+                                        else zipfile.ZIP_DEFLATED)
+            with open(asset.path, 'rb') as source, archive.open(entry_info, 'w') as entry:
+                shutil.copyfileobj(source, entry, COPY_CHUNK)
+
+
+def write_bundle(output_path: str, html_text: str, bundle: str,
+                 search_dirs: Iterable[str]) -> Dict[str, str]:
+    """Write a report as a single-file bundle ('mhtml' or 'zip')
+
+    Relative references are looked up in ``search_dirs`` in order and must
+    stay inside them (see resolve_local_reference). Returns the
+    references that could not be embedded (reference -> error); they are left
+    pointing at their original location.
+    """
+    if bundle not in BUNDLE_FORMATS:
+        raise ValueError(f"Unknown bundle format: {bundle}")
+    with tempfile.TemporaryDirectory(prefix='trec-bundle-') as spool_dir:
+        collector = AssetCollector([os.path.abspath(d) for d in search_dirs], spool_dir)
+        assets = collect_assets(html_text, collector)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            if bundle == 'mhtml':
+                write_mhtml(tmp_path, html_text, assets)
+            else:
+                write_zip(tmp_path, html_text, assets)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return collector.failures
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report Logging
+Leveled logging for the populator on the standard ``logging`` module. Every
+record carries the context of the report being rendered (report name,
+inspection id, worker process) and is written as plain text or one JSON
+object per line.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, TextIO
+
+LOGGER_NAME = 'trec'
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+LOG_FORMATS = ('text', 'json')
+
+# Fields of the report being rendered in this thread/task (see report_context)
+_context: contextvars.ContextVar = contextvars.ContextVar('trec_report_context', default={})
+
+# Active configuration, handed to pool workers (see configure_logging)
+_config: Optional[Dict[str, str]] = None
+
+# Attributes every LogRecord has; anything else was passed with ``extra=``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'context'}
+
+
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """The populator's logger, or a child of it (``trec.<name>``)"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+@contextlib.contextmanager
+def report_context(**fields: Any) -> Iterator[None]:
+    """Attach ``fields`` (e.g. ``report=name``) to every record logged in the block"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def update_report_context(**fields: Any) -> None:
+    """Add fields learned inside a report_context block, such as the inspection id"""
+    _context.set({**_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current report context onto each record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = _context.get()
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """``[report worker] [WARN] message``, with each prefix only when it applies"""
+    LEVEL_TAGS = {logging.WARNING: '[WARN] ', logging.ERROR: '[ERROR] ', logging.CRITICAL: '[ERROR] '}
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = getattr(record, 'context', {})
+        # Inspection ids stay in the JSON output; a single report needs no prefix
+        prefix = [str(context['report'])] if context.get('report') else []
+        if record.processName != 'MainProcess':
+            prefix.append(record.processName)
+        text = self.LEVEL_TAGS.get(record.levelno, '') + record.getMessage()
+        if prefix:
+            text = f"[{' '.join(prefix)}] {text}"
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, context and extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+            'worker': record.processName,
+            'pid': record.process,
+        }
+        entry.update(getattr(record, 'context', {}))
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = 'info', log_format: str = 'text',
+                      stream: Optional[TextIO] = None) -> None:
+    """Send the populator's records at ``level`` and above to ``stream`` (stderr)
+
+    Without this, only warnings and errors reach stderr, through Python's
+    last-resort handler.
+    """
+    global _config
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+    logger = get_logger()
+    logger.handlers = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    _config = {'level': level, 'log_format': log_format}
+
+
+def logging_config() -> Optional[Dict[str, str]]:
+    """Arguments for configure_logging in a worker process, if logging was configured"""
+    return dict(_config) if _config is not None else None
@@ -2,15 +2,41 @@
 """
 Simple HTTP server for TREC Report Generator
 Run this script to serve the files locally and avoid CORS issues.
+
+Requests are handled on their own threads over HTTP/1.1 keep-alive
+connections, so one slow client does not block the others. POST /render
+populates a report from inspection JSON on a pool of worker processes that
+keep the template and mapping index loaded.
 """
+import argparse
+import hashlib
 import http.server
-import socketserver
-import webbrowser
+import json
+import signal
+import socket
+import threading
 import os
+from functools import partial
+from typing import TYPE_CHECKING, List, Optional
+
+from report_logging import LOG_FORMATS, LOG_LEVELS, configure_logging, get_logger, logging_config
+
+# The process pool (multiprocessing) and webbrowser are imported only when used
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
 
 PORT = 8000
+BIND = ""
+KEEP_ALIVE_TIMEOUT = 15  # Seconds an idle keep-alive connection is held open
+MAX_RENDER_BYTES = 64 * 1024 * 1024  # Largest inspection JSON accepted by /render
+
+log = get_logger('server')
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep connections open between the template, CSS, logo and script requests
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+
     def end_headers(self):
         # Add CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -18,33 +44,273 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         super().end_headers()
 
+    def handle_one_request(self):
+        # Idle while waiting for the next request on a keep-alive connection
+        if not self.server.connection_idle(self.connection, True):
+            self.close_connection = True
+            return
+        super().handle_one_request()
+
+    def parse_request(self):
+        self.server.connection_idle(self.connection, False)
+        return super().parse_request()
+
+    def finish(self):
+        self.server.forget_connection(self.connection)
+        super().finish()
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == '/render/stats':
+            self.send_json(self.server.render_stats())
+            return
+        super().do_GET()
+
+    def send_json(self, payload) -> None:
+        body = json.dumps(payload, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        # CORS preflight for POST /render
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path.split('?', 1)[0] != '/render':
+            self.send_error(404, "Not found")
+            return
+        if self.server.render_options is None:
+            self.send_error(503, "Rendering is disabled on this server")
+            return
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self.send_error(411, "Content-Length required")
+            return
+        if int(length) > MAX_RENDER_BYTES:
+            self.send_error(413, "Inspection JSON too large")
+            self.close_connection = True
+            return
+        payload = self.rfile.read(int(length))
+
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            html_out = self.server.render(payload)
+        except ValueError as e:
+            self.send_error(400, f"Invalid inspection JSON: {e}")
+            return
+        except BrokenProcessPool:
+            self.send_error(503, "Render worker pool is unavailable")
+            return
+        except Exception as e:
+            log.error("Render failed", exc_info=True)
+            self.send_error(500, f"Render failed: {type(e).__name__}: {e}")
+            return
+
+        body = html_out.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TRECServer(http.server.ThreadingHTTPServer):
+    """Thread-per-connection server that finishes in-flight requests on shutdown
+
+    Keep-alive connections waiting for their next request are closed by
+    server_close() rather than held open until KEEP_ALIVE_TIMEOUT.
+    """
+    daemon_threads = False
+    block_on_close = True
+
+    render_options = None  # Set once rendering is enabled
+    render_pool: Optional['ProcessPoolExecutor'] = None
+    render_cache = None
+    mapping_cache = None
+    mapping_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        self.idle_connections = set()
+        self.connections_lock = threading.Lock()
+        self.closing = False
+        super().__init__(*args, **kwargs)
+
+    def connection_idle(self, connection: socket.socket, idle: bool) -> bool:
+        """Track whether a connection is between requests; False once the server is closing"""
+        with self.connections_lock:
+            if idle and self.closing:
+                return False
+            if idle:
+                self.idle_connections.add(connection)
+            else:
+                self.idle_connections.discard(connection)
+            return True
+
+    def forget_connection(self, connection: socket.socket) -> None:
+        with self.connections_lock:
+            self.idle_connections.discard(connection)
+
+    def start_rendering(self, html_template: str, engine: str, workers: int, render_cache) -> None:
+        """Load the template for POST /render
+        
+        Renders run on worker processes that each load the template once.
+        With the compiled engine a worker re-renders only what changed since
+        its previous render of the same inspection.
+        """
+        from populate_trec_complete import (
+            MAPPING_CACHE_PATH,
+            MappingCache,
+            RenderOptions,
+            init_render_worker,
+        )
+        self.html_template = html_template
+        self.render_options = options = RenderOptions(engine=engine)
+        self.render_cache = render_cache
+        # Workers only count learned-mapping hits; they are merged here under mapping_lock
+        self.mapping_cache = MappingCache.load(MAPPING_CACHE_PATH)
+        from concurrent.futures import ProcessPoolExecutor
+        self.render_pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_render_worker,
+            initargs=(html_template, None, options, self.mapping_cache.path,
+                      None, None, False, logging_config()))
+        # Load the template in every worker now rather than on the first requests
+        for future in [self.render_pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    def render(self, payload: bytes) -> str:
+        """Render inspection JSON to report HTML, from the render cache when possible"""
+        from populate_trec_complete import (
+            parse_inspection_payload,
+            render_cache_key,
+            render_context_digest,
+            render_inspection_in_worker,
+        )
+        context = render_context_digest(self.html_template, self.render_options)
+        # Byte-identical repeats skip JSON parsing and normalization entirely
+        alias = hashlib.sha256(context.encode('ascii') + payload).hexdigest()
+        key = self.render_cache.resolve_alias(alias)
+        inspection = None
+        if key is None:
+            inspection = parse_inspection_payload(payload)
+            key = render_cache_key(context, inspection)
+            self.render_cache.add_alias(alias, key)
+        html_out, _ = self.render_cache.lookup(key)
+        if html_out is not None:
+            return html_out
+
+        if inspection is None:
+            inspection = parse_inspection_payload(payload)
+        html_out, hits = self.render_pool.submit(render_inspection_in_worker, inspection).result()
+        if hits:
+            with self.mapping_lock:
+                self.mapping_cache.merge_hits(hits)
+        self.render_cache.put(key, html_out)
+        return html_out
+
+    def render_stats(self) -> dict:
+        """Render cache counters for GET /render/stats"""
+        if self.render_cache is None:
+            return {'enabled': False}
+        return dict(self.render_cache.stats(), enabled=True)
+
+    def server_close(self):
+        with self.connections_lock:
+            self.closing = True
+            for connection in self.idle_connections:
+                try:
+                    # Wakes the handler thread's pending read, which then sees EOF
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        # Joins the request threads, letting in-flight requests finish
+        super().server_close()
+        if self.render_pool is not None:
+            self.render_pool.shutdown()
+        if self.mapping_cache is not None:
+            self.mapping_cache.save()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve the TREC Report Generator UI")
+    parser.add_argument('--port', type=int, default=PORT, help="Port to listen on")
+    parser.add_argument('--bind', default=BIND, metavar='ADDRESS',
+                        help="Address to bind (default: all interfaces)")
+    parser.add_argument('--no-browser', action='store_true', help="Don't open a browser window")
+    parser.add_argument('--template', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'TREC_Report_All.html'),
+                        help="TREC HTML template used by POST /render")
+    parser.add_argument('--engine', choices=['dom', 'compiled'], default='dom',
+                        help="Render with BeautifulSoup (dom) or the compiled template plan")
+    parser.add_argument('--render-workers', type=int, default=0,
+                        help="Worker processes for POST /render (0 = one per CPU core)")
+    parser.add_argument('--render-cache', metavar='DIR',
+                        help="Also keep rendered reports on disk in DIR (memory cache is always on)")
+    parser.add_argument('--render-cache-mb', type=int, default=512,
+                        help="Size limit for the --render-cache directory")
+    parser.add_argument('--render-cache-entries', type=int, default=128,
+                        help="Rendered reports kept in memory")
+    parser.add_argument('--no-render', action='store_true',
+                        help="Serve static files only, without POST /render")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='warning',
+                        help="Least severe populator messages to log to stderr (debug logs every line item)")
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text',
+                        help="Log plain text or one JSON object per line")
+    return parser.parse_args(argv)
+
+
 def main():
-    # Change to project root directory (parent of src/)
+    args = parse_args()
+    configure_logging(args.log_level, args.log_format)
+
+    # Serve the project root (parent of src/)
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(script_dir)  # Go up one level from src/
-    os.chdir(project_root)
-    
-    Handler = MyHTTPRequestHandler
-    
-    try:
-        with socketserver.TCPServer(("", PORT), Handler) as httpd:
-            print("=" * 60)
-            print("TREC Report Generator Server")
-            print("=" * 60)
-            print(f"Server running at: http://localhost:{PORT}")
-            print(f"Open your browser to: http://localhost:{PORT}/index.html")
-            print("Press Ctrl+C to stop the server")
-            print("=" * 60)
-            
-            # Try to open browser automatically
+
+    Handler = partial(MyHTTPRequestHandler, directory=project_root)
+
+    with TRECServer((args.bind, args.port), Handler) as httpd:
+        if not args.no_render:
+            workers = args.render_workers if args.render_workers > 0 else (os.cpu_count() or 1)
+            from render_cache import RenderCache
+            render_cache = RenderCache(memory_entries=args.render_cache_entries,
+                                       disk_dir=args.render_cache,
+                                       disk_max_bytes=args.render_cache_mb * 1024 * 1024)
+            httpd.start_rendering(args.template, args.engine, workers, render_cache)
+        host = args.bind or "localhost"
+        print("=" * 60)
+        print("TREC Report Generator Server")
+        print("=" * 60)
+        print(f"Server running at: http://{host}:{args.port}")
+        print(f"Open your browser to: http://{host}:{args.port}/index.html")
+        if httpd.render_pool is not None:
+            print(f"POST /render: {workers} {args.engine} worker(s), template {args.template}")
+        print("Press Ctrl+C to stop the server")
+        print("=" * 60)
+
+        # shutdown() waits for serve_forever() to return, so call it off the main thread
+        def stop(signum, frame):
+            threading.Thread(target=httpd.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+
+        # Try to open browser automatically
+        if not args.no_browser:
             try:
-                webbrowser.open(f'http://localhost:{PORT}/index.html')
-            except:
+                import webbrowser
+                webbrowser.open(f'http://{host}:{args.port}/index.html')
+            except Exception:
                 pass
-            
+
+        try:
             httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\n\nServer stopped.")
+        except KeyboardInterrupt:
+            pass
+        print("\n\nStopping server (finishing in-flight requests)...")
+    # Leaving the with block closes the socket and joins the request threads
+    print("Server stopped.")
 
 if __name__ == "__main__":
     main()
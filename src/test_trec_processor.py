@@ -7,23 +7,92 @@ Tests populate_trec_complete.py against quality metrics
 import json
 import time
 import os
-from bs4 import BeautifulSoup
-from typing import Dict, Any, List, Tuple
+import re
+from html.parser import HTMLParser
+from typing import Dict, Any, List, Optional, Tuple
+
+from inspection_model import Inspection, iter_line_items, normalize_inspection
+
+INFORMATIONAL_ITEMS = ['Report Context', 'General Information']
 
 def load_json(path: str) -> Dict[str, Any]:
     """Load JSON file"""
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def analyze_data_accuracy(inspection_data: Dict, html_content: str) -> Tuple[int, Dict]:
+def load_inspection(path: str) -> Inspection:
+    """Load and normalize an inspection JSON file"""
+    return normalize_inspection(load_json(path))
+
+def parse_report(html_content: str, parser: str = 'auto'):
+    """Parse report HTML with the populator's parser backend
+    
+    BeautifulSoup is only imported once a report is analyzed.
+    """
+    from bs4 import BeautifulSoup
+    from populate_trec_complete import select_parser
+    return BeautifulSoup(html_content, select_parser(parser))
+
+class CanonicalHTML(HTMLParser):
+    """Element, attribute, text and comment events of a document, for comparing parser backends
+    
+    Whitespace runs collapse to one space and whitespace-only text is dropped,
+    since backends differ in where they keep whitespace between elements.
+    Implied <tbody> elements (added by html5lib) are ignored.
+    """
+    IGNORED_TAGS = frozenset(['tbody'])
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.events: List[Tuple] = []
+        self.text: List[str] = []
+    
+    def flush_text(self) -> None:
+        text = re.sub(r'\s+', ' ', ''.join(self.text)).strip()
+        if text:
+            self.events.append(('text', text))
+        self.text = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.IGNORED_TAGS:
+            self.flush_text()
+            self.events.append(('start', tag, tuple(sorted((name, value or '') for name, value in attrs))))
+    
+    def handle_endtag(self, tag):
+        if tag not in self.IGNORED_TAGS:
+            self.flush_text()
+            self.events.append(('end', tag))
+    
+    def handle_data(self, data):
+        self.text.append(data)
+    
+    def handle_comment(self, data):
+        self.flush_text()
+        self.events.append(('comment', data.strip()))
+
+def canonical_events(html_content: str) -> List[Tuple]:
+    canonical = CanonicalHTML()
+    canonical.feed(html_content)
+    canonical.close()
+    canonical.flush_text()
+    return canonical.events
+
+def first_difference(expected: List[Tuple], actual: List[Tuple]) -> Optional[str]:
+    """Describe where two event streams first differ, or None when they are equal"""
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return f"event {index}: expected {a!r}, got {b!r}"
+    if len(expected) != len(actual):
+        return f"expected {len(expected)} events, got {len(actual)}"
+    return None
+
+def analyze_data_accuracy(inspection: Inspection, html_content: str) -> Tuple[int, Dict]:
     """Test Data Accuracy (15 pts)"""
     print("\n" + "="*70)
     print("1. DATA ACCURACY TEST (15 points)")
     print("="*70)
     
-    soup = BeautifulSoup(html_content, 'html.parser')
-    inspection = inspection_data.get('inspection', {})
-    sections = inspection.get('sections', [])
+    soup = parse_report(html_content)
     
     total_line_items = 0
     mapped_items = 0
@@ -37,11 +106,11 @@ def analyze_data_accuracy(inspection_data: Dict, html_content: str) -> Tuple[int
     trec1_elem = soup.find(id='trec1')
     
     header_checks = {
-        'client': client_elem and client_elem.get('value') == inspection.get('clientInfo', {}).get('name', ''),
+        'client': client_elem and client_elem.get('value') == inspection.client_name,
         'date': date_elem and date_elem.get('value', '') != '',
-        'address': address_elem and address_elem.get('value') == inspection.get('address', {}).get('fullAddress', ''),
-        'inspector': inspector_elem and inspector_elem.get('value') == inspection.get('inspector', {}).get('name', ''),
-        'trec_license': trec1_elem and trec1_elem.get('value') == inspection.get('inspector', {}).get('id', '')
+        'address': address_elem and address_elem.get('value') == inspection.address,
+        'inspector': inspector_elem and inspector_elem.get('value') == inspection.inspector_name,
+        'trec_license': trec1_elem and trec1_elem.get('value') == inspection.inspector_license
     }
     
     missing_fields += sum(1 for v in header_checks.values() if not v)
@@ -51,20 +120,17 @@ def analyze_data_accuracy(inspection_data: Dict, html_content: str) -> Tuple[int
     mappable_items = 0
     skipped_items = 0
     
-    for section in sections:
-        line_items = section.get('lineItems', [])
-        for item in line_items:
-            has_status = item.get('inspectionStatus') is not None
-            has_comments = len(item.get('comments', [])) > 0
-            item_name = item.get('name', '')
-            
-            # Skip informational items that shouldn't be mapped
-            if item_name in ['Report Context', 'General Information']:
-                skipped_items += 1
-                continue
-            
-            if has_status or has_comments:
-                mappable_items += 1
+    for item in iter_line_items(inspection):
+        has_status = item.status is not None
+        has_comments = len(item.comments) > 0
+        
+        # Skip informational items that shouldn't be mapped
+        if item.name in INFORMATIONAL_ITEMS:
+            skipped_items += 1
+            continue
+        
+        if has_status or has_comments:
+            mappable_items += 1
     
     total_line_items = mappable_items
     
@@ -102,23 +168,21 @@ def analyze_data_accuracy(inspection_data: Dict, html_content: str) -> Tuple[int
     items_mapped = 0
     items_without_mapping = []
     
-    for section in sections:
-        for item in section.get('lineItems', []):
-            item_name = item.get('name', '')
-            has_comments = len(item.get('comments', [])) > 0
-            has_status = item.get('inspectionStatus') is not None
-            
-            # Skip informational
-            if item_name in ['Report Context', 'General Information']:
-                continue
-            
-            if has_comments or has_status:
-                if item_name in LINE_ITEM_MAPPING:
-                    items_mapped += 1
-                    if has_comments:
-                        items_with_comments += 1
-                else:
-                    items_without_mapping.append(item_name)
+    for item in iter_line_items(inspection):
+        has_comments = len(item.comments) > 0
+        has_status = item.status is not None
+        
+        # Skip informational
+        if item.name in INFORMATIONAL_ITEMS:
+            continue
+        
+        if has_comments or has_status:
+            if item.name in LINE_ITEM_MAPPING:
+                items_mapped += 1
+                if has_comments:
+                    items_with_comments += 1
+            else:
+                items_without_mapping.append(item.name)
     
     # Calculate percentage: items with mappings that have data
     if total_line_items > 0:
@@ -127,8 +191,8 @@ def analyze_data_accuracy(inspection_data: Dict, html_content: str) -> Tuple[int
         mapping_percentage = 100
     
     # For scoring: if items with comments are all mapped, that's what matters
-    total_with_comments = sum(1 for s in sections for li in s.get('lineItems', []) 
-                             if len(li.get('comments', [])) > 0 and li.get('name') not in ['Report Context', 'General Information'])
+    total_with_comments = sum(1 for li in iter_line_items(inspection)
+                             if len(li.comments) > 0 and li.name not in INFORMATIONAL_ITEMS)
     
     if total_with_comments > 0:
         comments_coverage = (items_with_comments / total_with_comments) * 100
@@ -174,7 +238,7 @@ def analyze_template_compliance(html_content: str) -> Tuple[int, Dict]:
     print("2. TEMPLATE COMPLIANCE TEST (20 points)")
     print("="*70)
     
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = parse_report(html_content)
     
     issues = []
     
@@ -255,7 +319,7 @@ def analyze_pdf_quality(html_content: str) -> Tuple[int, Dict]:
     print("3. PDF QUALITY TEST (15 points)")
     print("="*70)
     
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = parse_report(html_content)
     
     issues = []
     
@@ -333,24 +397,27 @@ def analyze_pdf_quality(html_content: str) -> Tuple[int, Dict]:
     
     return score, {'issues': issues, 'issue_count': issue_count}
 
-def analyze_media_integration(html_content: str, inspection_data: Dict) -> Tuple[int, Dict]:
+def analyze_media_integration(html_content: str, inspection: Inspection) -> Tuple[int, Dict]:
     """Test Media Integration (10 pts)"""
     print("\n" + "="*70)
     print("4. MEDIA INTEGRATION TEST (10 points)")
     print("="*70)
     
-    soup = BeautifulSoup(html_content, 'html.parser')
+    from trec_content import line_item_media
+    soup = parse_report(html_content)
     
     # Count media in JSON
     total_photos = 0
     total_videos = 0
     
-    sections = inspection_data.get('inspection', {}).get('sections', [])
-    for section in sections:
-        for item in section.get('lineItems', []):
-            for comment in item.get('comments', []):
-                total_photos += len(comment.get('photos', []))
-                total_videos += len(comment.get('videos', []))
+    for item in iter_line_items(inspection):
+        for comment in item.comments:
+            total_photos += len(comment.photos)
+            total_videos += len(comment.videos)
+        # Line-item media not already attached to a comment
+        photos, videos = line_item_media(item)
+        total_photos += len(photos)
+        total_videos += len(videos)
     
     # Count media in HTML
     html_images = soup.select('.media-container img')
@@ -482,6 +549,33 @@ def analyze_performance() -> Tuple[int, Dict]:
         'grade': grade
     }
 
+def analyze_parser_backends(inspection: Inspection, html_template: str = 'TREC_Report_All.html') -> Dict[str, Any]:
+    """Render with every installed parser backend and compare with html.parser (not scored)"""
+    print("\n" + "="*70)
+    print("6. PARSER BACKEND EQUIVALENCE (not scored)")
+    print("="*70)
+    
+    from populate_trec_complete import RenderOptions, available_parsers, iter_report_chunks
+    
+    backends = available_parsers()
+    results = {}
+    reference = None
+    for parser in ['html.parser'] + [b for b in backends if b != 'html.parser']:
+        start_time = time.perf_counter()
+        html_out = ''.join(iter_report_chunks(html_template, inspection, options=RenderOptions(parser=parser)))
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        events = canonical_events(html_out)
+        if reference is None:
+            reference = events
+        difference = first_difference(reference, events)
+        results[parser] = {'render_ms': elapsed_ms, 'equivalent': difference is None, 'difference': difference}
+        status = "[OK] Equivalent to html.parser" if difference is None else f"[FAIL] {difference}"
+        print(f"{parser:<12} {elapsed_ms:>8.1f} ms  {status}")
+    if len(results) == 1:
+        print("Only html.parser is installed; install lxml or html5lib to compare backends")
+    
+    return {'backends': results, 'equivalent': all(r['equivalent'] for r in results.values())}
+
 def main():
     """Run all tests"""
     print("="*70)
@@ -491,7 +585,7 @@ def main():
     # Load files
     print("\nLoading test files...")
     try:
-        inspection_data = load_json('inspection.json')
+        inspection = load_inspection('inspection.json')
         with open('TREC_Report_Filled_Improved.html', 'r', encoding='utf-8') as f:
             html_content = f.read()
         print("[OK] Files loaded successfully")
@@ -502,17 +596,18 @@ def main():
         subprocess.run(['python', 'populate_trec_complete.py'])
         with open('TREC_Report_Filled_Improved.html', 'r', encoding='utf-8') as f:
             html_content = f.read()
-        inspection_data = load_json('inspection.json')
+        inspection = load_inspection('inspection.json')
     
     # Run tests
     scores = {}
     details = {}
     
-    scores['data_accuracy'], details['data_accuracy'] = analyze_data_accuracy(inspection_data, html_content)
+    scores['data_accuracy'], details['data_accuracy'] = analyze_data_accuracy(inspection, html_content)
     scores['template_compliance'], details['template_compliance'] = analyze_template_compliance(html_content)
     scores['pdf_quality'], details['pdf_quality'] = analyze_pdf_quality(html_content)
-    scores['media_integration'], details['media_integration'] = analyze_media_integration(html_content, inspection_data)
+    scores['media_integration'], details['media_integration'] = analyze_media_integration(html_content, inspection)
     scores['performance'], details['performance'] = analyze_performance()
+    details['parser_backends'] = analyze_parser_backends(inspection)
     
     # Calculate total score
     total_score = sum(scores.values())
@@ -547,6 +642,481 @@ def main():
     
     return scores, details, total_score
 
+# -- Regression tests (python -m pytest src/test_trec_processor.py) ---------
+
+# Smallest valid PNG: a 1x1 transparent pixel
+PNG_BYTES = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082')
+
+def write_sample_assets(directory: str) -> str:
+    """logo.png and trec_styles.css in ``directory``; returns the logo's SHA-256"""
+    import hashlib
+    with open(os.path.join(directory, 'logo.png'), 'wb') as f:
+        f.write(PNG_BYTES)
+    with open(os.path.join(directory, 'trec_styles.css'), 'w', encoding='utf-8') as f:
+        f.write('body { margin: 0; }')
+    return hashlib.sha256(PNG_BYTES).hexdigest()
+
+def test_bundle_embeds_local_image(tmp_path):
+    import email
+    import zipfile
+    from report_bundle import write_bundle
+    logo_sha = write_sample_assets(str(tmp_path))
+    report = ('<html><head><link rel="stylesheet" href="trec_styles.css"/></head>'
+              '<body><img src="logo.png"/></body></html>')
+    
+    zip_path = str(tmp_path / 'report.zip')
+    assert write_bundle(zip_path, report, 'zip', [str(tmp_path)]) == {}
+    with zipfile.ZipFile(zip_path) as archive:
+        assert f'media/{logo_sha}.png' in archive.namelist()
+        assert archive.read(f'media/{logo_sha}.png') == PNG_BYTES
+        assert f'src="media/{logo_sha}.png"' in archive.read('report.html').decode('utf-8')
+    
+    mhtml_path = str(tmp_path / 'report.mhtml')
+    assert write_bundle(mhtml_path, report, 'mhtml', [str(tmp_path)]) == {}
+    with open(mhtml_path, 'rb') as f:
+        parts = list(email.message_from_bytes(f.read()).walk())
+    images = [part for part in parts if part.get_content_type() == 'image/png']
+    assert len(images) == 1 and images[0].get_payload(decode=True) == PNG_BYTES
+    assert images[0]['Content-ID'] == f'<{logo_sha}@trec-report>'
+
+def test_bundle_skips_references_outside_search_dirs(tmp_path):
+    import urllib.request
+    import zipfile
+    from report_bundle import write_bundle
+    assets = tmp_path / 'assets'
+    assets.mkdir()
+    logo_sha = write_sample_assets(str(assets))
+    secret = tmp_path / 'secret.png'
+    secret.write_bytes(PNG_BYTES + b'secret')
+    os.symlink(secret, assets / 'linked.png')
+    outside = [str(secret), 'file://' + urllib.request.pathname2url(str(secret)),
+               '../secret.png', 'linked.png']
+    report = ''.join(f'<img src="{reference}"/>' for reference in ['logo.png'] + outside)
+    
+    zip_path = str(tmp_path / 'report.zip')
+    failures = write_bundle(zip_path, report, 'zip', [str(assets)])
+    assert sorted(failures) == sorted(outside)
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.namelist() == ['report.html', f'media/{logo_sha}.png']
+
+def test_media_cache_only_copies_local_media_from_allowed_roots(tmp_path):
+    import urllib.request
+    from media_pipeline import MediaStore
+    allowed = tmp_path / 'photos'
+    allowed.mkdir()
+    write_sample_assets(str(allowed))
+    secret = tmp_path / 'secret.png'
+    secret.write_bytes(PNG_BYTES + b'secret')
+    os.symlink(secret, allowed / 'linked.png')
+    inside = [str(allowed / 'logo.png'), 'file://' + urllib.request.pathname2url(str(allowed / 'logo.png'))]
+    outside = [str(secret), 'file://' + urllib.request.pathname2url(str(secret)),
+               str(allowed / '..' / 'secret.png'), str(allowed / 'linked.png')]
+    
+    default_store = MediaStore(str(tmp_path / 'cache-default'))
+    assert default_store.resolve(inside) == {}
+    assert sorted(default_store.failures) == sorted(inside)
+    
+    store = MediaStore(str(tmp_path / 'cache'), local_roots=[str(allowed)])
+    assert sorted(store.resolve(inside + outside)) == sorted(inside)
+    assert sorted(store.failures) == sorted(outside)
+    assert all(error.startswith('PermissionError') for error in store.failures.values())
+    assert MediaStore(**store.config()).local_roots == store.local_roots
+
+class MediaServer:
+    """Serves ``directory`` over HTTP on a local port, recording the paths requested"""
+
+    def __init__(self, directory: str, concurrent_requests: int = 1):
+        import http.server
+        import threading
+        from functools import partial
+        server = self
+        self.requests: List[str] = []
+        # Requests wait here until this many are in flight at once
+        self.barrier = threading.Barrier(concurrent_requests, timeout=10)
+        
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                server.barrier.wait()
+                super().do_GET()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(Handler, directory=directory))
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+    
+    def url(self, name: str) -> str:
+        return 'http://%s:%d/%s' % (self.httpd.server_address + (name,))
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+
+def test_media_cache_fetches_concurrently_and_dedups(tmp_path):
+    from media_pipeline import MediaStore
+    served = tmp_path / 'served'
+    served.mkdir()
+    (served / 'front.png').write_bytes(PNG_BYTES)
+    (served / 'front-copy.png').write_bytes(PNG_BYTES)
+    (served / 'walkthrough.mp4').write_bytes(b'not really a video')
+    
+    # Each request waits for the other two, so a serial fetch would fail
+    with MediaServer(str(served), concurrent_requests=3) as server:
+        urls = [server.url(name) for name in ('front.png', 'front-copy.png', 'walkthrough.mp4')]
+        store = MediaStore(str(tmp_path / 'cache'), workers=3)
+        resolved = store.resolve(urls)
+        assert store.failures == {}
+        assert sorted(resolved) == sorted(urls)
+        # Identical content is stored once, whichever URL it came from
+        assert resolved[urls[0]].original == resolved[urls[1]].original
+        assert resolved[urls[0]].original != resolved[urls[2]].original
+        objects = [name for _, _, names in os.walk(tmp_path / 'cache' / 'objects') for name in names]
+        assert len(objects) == 2
+        assert len(server.requests) == 3
+        
+        # Resolved again from memory, then by another store from the URL records
+        assert store.resolve(urls) == resolved
+        assert MediaStore(**store.config()).resolve(urls) == resolved
+        assert len(server.requests) == 3
+
+def test_media_cache_thumbnails_photos(tmp_path):
+    import pytest
+    pytest.importorskip('PIL')
+    from PIL import Image
+    from media_pipeline import MediaStore
+    served = tmp_path / 'served'
+    served.mkdir()
+    Image.new('RGB', (1200, 600), 'navy').save(served / 'roof.png')
+    
+    with MediaServer(str(served)) as server:
+        store = MediaStore(str(tmp_path / 'cache'), thumbnail_size=(500, 400))
+        media = store.resolve([server.url('roof.png')])[server.url('roof.png')]
+    assert media.thumbnail != media.original
+    assert (media.width, media.height) == (500, 250)
+    with Image.open(tmp_path / 'cache' / media.thumbnail) as thumbnail:
+        assert thumbnail.size == (500, 250)
+
+# Line items mapped explicitly (two to one TREC item), by fuzzy matching,
+# informational and empty
+SAMPLE_PAYLOAD = {'inspection': {'id': 'sample', 'sections': [{'name': 'Structural', 'lineItems': [
+    {'name': 'Decks and Stairways', 'inspectionStatus': 'D', 'comments': [
+        {'text': 'Loose railing', 'photos': [{'url': 'railing.jpg'}], 'videos': [{'url': 'railing.mp4'}]}]},
+    {'name': 'Ground-Level Entry Structures', 'comments': [{'text': 'Cracked step'}]},
+    {'name': 'Roof Covering Materials Type', 'inspectionStatus': 'I'},
+    {'name': 'General Information', 'inspectionStatus': 'I'},
+    {'name': 'Porches'},
+]}]}}
+
+def test_additional_findings_are_written_once_in_order():
+    from populate_trec_complete import RenderOptions, iter_report_chunks
+    # All four map to the same TREC item; the first is its finding, the rest are additional
+    names = ['Decks and Stairways', 'Ground-Level Entry Structures', 'Paved Surfaces and Walkways',
+             'Outdoor Living Area Covers']
+    payload = {'inspection': {'id': 'findings', 'sections': [{'name': 'Exterior', 'lineItems': [
+        {'name': name, 'comments': [{'text': f'Finding {index}'}]} for index, name in enumerate(names)]}]}}
+    inspection = normalize_inspection(payload)
+    template = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TREC_Report_All.html')
+    
+    for engine in ('dom', 'compiled'):
+        report = ''.join(iter_report_chunks(template, inspection, options=RenderOptions(engine=engine)))
+        positions = [report.find(f'<p>Finding {index}</p>') for index in range(len(names))]
+        assert all(report.count(f'<p>Finding {index}</p>') == 1 for index in range(len(names))), engine
+        assert 0 < positions[0] < positions[1] < positions[2] < positions[3], engine
+        assert report.count('Additional Finding:') == len(names) - 1, engine
+        assert report.index('Additional Finding:') > positions[0], engine
+
+def test_normalized_model_reads_alternate_keys_and_pools_strings():
+    payload = {'inspection': {'id': 'model', 'sections': [{'name': 'Structural', 'lineItems': [
+        {'name': 'Foundations', 'inspectionStatus': 'D', 'comments': [
+            {'commentText': 'Minor cracking', 'location': ' North wall ', 'order': '2',
+             'photos': [{'url': 'crack.jpg', 'description': 'Crack', 'thumbnailUrl': 'crack_t.jpg',
+                         'width': '640', 'height': 480, 'mimeType': 'image/jpeg'}]},
+            {'value': 'Minor cracking', 'order': 1}]},
+        {'name': 'Grading and Drainage'}]}]}}
+    # Decoded like a real payload, so equal strings start out as separate objects
+    payload = json.loads(json.dumps(payload))
+    inspection = normalize_inspection(payload)
+    
+    foundations, grading = inspection.sections[0].line_items
+    first, second = foundations.comments
+    assert (first.text, first.location, first.order) == ('Minor cracking', 'North wall', 2)
+    assert first.photos[0] == ('', 'crack.jpg', 'Crack', 'crack_t.jpg', 640, 480, 'image/jpeg')
+    # Equal strings from different keys share one object
+    assert first.text is second.text
+    assert (grading.status, grading.comments, grading.media) == (None, (), ())
+    assert [li.name for li in iter_line_items(inspection)] == ['Foundations', 'Grading and Drainage']
+    # Records are immutable and hashable, so they can key caches
+    assert hash(inspection) == hash(normalize_inspection(payload))
+
+def test_fuzzy_match_needs_enough_shared_words():
+    from trec_content import FUZZY_MIN_SHARED_WORDS, LINE_ITEM_MAPPING, fuzzy_match_line_item
+    roof_covering = LINE_ITEM_MAPPING['Roof Covering Materials']
+    assert FUZZY_MIN_SHARED_WORDS == 2
+    # Three and then exactly two words in common with 'Roof Covering Materials'
+    assert fuzzy_match_line_item('Roof Covering Materials Type') == roof_covering
+    assert fuzzy_match_line_item('covering materials') == roof_covering
+    # One shared word ('Roof') is below the threshold, however many entries have it
+    assert fuzzy_match_line_item('Roof Leak') is None
+    
+    hits = fuzzy_match_line_item.cache_info().hits
+    assert fuzzy_match_line_item('Roof Covering Materials Type') == roof_covering
+    assert fuzzy_match_line_item.cache_info().hits == hits + 1
+
+def test_mapping_cache_round_trip_and_invalidation(tmp_path, monkeypatch):
+    import trec_content
+    from trec_content import LINE_ITEM_MAPPING, MappingCache
+    path = str(tmp_path / 'mapping_cache.json')
+    cache = MappingCache.load(path)
+    assert cache.resolve('Roof Covering Materials Type') == LINE_ITEM_MAPPING['Roof Covering Materials']
+    assert cache.resolve('Roof Leak') is None
+    assert cache.resolve('Roof Leak') is None
+    cache.save()
+    
+    reloaded = MappingCache.load(path)
+    assert reloaded.entries == {
+        'Roof Covering Materials Type': {'mapping': LINE_ITEM_MAPPING['Roof Covering Materials'], 'hits': 1},
+        'Roof Leak': {'mapping': None, 'hits': 2},
+    }
+    # Hits from another process are added to what is on disk
+    reloaded.merge_hits({'Roof Leak': 3})
+    reloaded.save()
+    assert MappingCache.load(path).hottest_unmapped() == [('Roof Leak', 5)]
+    
+    # Editing the mapping tables discards every learned entry
+    monkeypatch.setitem(trec_content.LINE_ITEM_MAPPING, 'Roof Leak', LINE_ITEM_MAPPING['Roof Covering Materials'])
+    assert MappingCache.load(path).entries == {}
+
+def test_chunked_serializer_matches_decode_and_minify_keeps_pre():
+    from bs4 import BeautifulSoup
+    from populate_trec_complete import iter_html_chunks, minify_tree
+    document = ('<!DOCTYPE html>\n<html lang="en"><head><title>Report</title></head>\n'
+                '<body class="trec">\n  <!-- page 1 -->\n  <p>Loose   railing\n\n  at steps</p>\n'
+                '  <pre>  keep\n    this  </pre><textarea>a  b</textarea>\n</body></html>\n')
+    soup = BeautifulSoup(document, 'html.parser')
+    
+    chunks = list(iter_html_chunks(soup))
+    assert ''.join(chunks) == str(soup)
+    assert max(len(chunk) for chunk in chunks) < len(str(soup)) // 2
+    
+    minify_tree(soup)
+    minified = ''.join(iter_html_chunks(soup))
+    assert 'page 1' not in minified
+    assert '<p>Loose railing\nat steps</p>' in minified
+    assert '<pre>  keep\n    this  </pre><textarea>a  b</textarea>' in minified
+
+def test_render_cache_evicts_lru_entries_and_hits_disk(tmp_path):
+    from render_cache import RenderCache
+    first, second, third = ('1a' * 32, '2b' * 32, '3c' * 32)
+    cache = RenderCache(memory_entries=2, disk_dir=str(tmp_path / 'renders'), disk_max_bytes=30)
+    cache.put(first, '<p>first</p>')
+    cache.put(second, '<p>second</p>')
+    assert cache.lookup(first) == ('<p>first</p>', 'memory')
+    os.utime(cache._disk_path(first), (1, 1))
+    os.utime(cache._disk_path(second), (2, 2))
+    
+    # Memory drops its least recently used entry (second); disk its oldest file (first)
+    cache.put(third, '<p>third</p>')
+    assert list(cache.memory) == [first, third]
+    assert not os.path.exists(cache._disk_path(first))
+    assert cache.lookup(second) == ('<p>second</p>', 'disk')
+    assert cache.stats()['evictions'] == 1
+    
+    # Another process opening the same directory is served from disk, then memory
+    reopened = RenderCache(**cache.config())
+    assert reopened.lookup(third) == ('<p>third</p>', 'disk')
+    assert reopened.lookup(third) == ('<p>third</p>', 'memory')
+    assert reopened.lookup(first) == (None, None)
+
+def test_incremental_render_matches_full_render_after_edits():
+    import copy
+    from trec_template import IncrementalRenderer, compile_template, render_plan
+    plan = compile_template(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TREC_Report_All.html'))
+    renderer = IncrementalRenderer(plan, prune_empty_sections=True)
+    
+    def check(payload, items_rendered):
+        inspection = normalize_inspection(payload)
+        assert renderer.render(inspection) == render_plan(plan, inspection, prune_empty_sections=True)
+        assert renderer.items_rendered == items_rendered
+    
+    check(SAMPLE_PAYLOAD, 2)
+    check(SAMPLE_PAYLOAD, 0)
+    
+    edited = copy.deepcopy(SAMPLE_PAYLOAD)
+    line_items = edited['inspection']['sections'][0]['lineItems']
+    line_items[1]['comments'][0]['text'] = 'Cracked and loose step'
+    check(edited, 1)
+    
+    # A finding added to a TREC item that was empty, and one removed from another
+    line_items.append({'name': 'Main Structural Supports', 'inspectionStatus': 'D', 'comments': [{'text': 'Settled'}]})
+    del line_items[0]
+    check(edited, 2)
+
+def test_streaming_loader_matches_full_parse_across_chunk_boundaries():
+    import io
+    from inspection_stream import InspectionStream
+    payload = dict(SAMPLE_PAYLOAD, account={'companyName': 'Lone Star Inspections \u2605', 'id': 'TX-12345'})
+    payload['inspection'] = dict(payload['inspection'], clientInfo={'name': 'Ana "Q" Ruiz'},
+                                 schedule={'date': 1700000000000})
+    document = json.dumps(payload, indent=1)
+    expected = normalize_inspection(payload)
+    
+    # Tiny chunks split keys, strings, escapes and numbers mid-token
+    for chunk_size in (1, 2, 3, 7, 64, len(document)):
+        assert InspectionStream(io.StringIO(document), chunk_size=chunk_size).load() == expected, chunk_size
+
+def test_streaming_loader_yields_valid_sections_before_a_bad_one():
+    import io
+    from inspection_stream import InspectionStream
+    document = json.dumps(SAMPLE_PAYLOAD)
+    # A truncated second section after the complete first one
+    document = document[:document.rindex(']}}')] + ', {"name": "Interior", "lineItems": [{"name": "Walls"'
+    stream = InspectionStream(io.StringIO(document), chunk_size=5)
+    sections = stream.iter_sections()
+    assert next(sections) == normalize_inspection(SAMPLE_PAYLOAD).sections[0]
+    try:
+        next(sections)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("truncated section was accepted")
+
+def test_compiled_engine_records_metrics():
+    from instrumentation import Metrics
+    from populate_trec_complete import RenderOptions, iter_report_chunks, use_metrics
+    template = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TREC_Report_All.html')
+    inspection = normalize_inspection(SAMPLE_PAYLOAD)
+    counters = {}
+    for engine in ('dom', 'compiled'):
+        metrics = Metrics()
+        use_metrics(metrics)
+        try:
+            ''.join(iter_report_chunks(template, inspection, options=RenderOptions(engine=engine)))
+        finally:
+            use_metrics(None)
+        # The compiled engine never builds pruned sections, so it removes none
+        counters[engine] = [c for c in metrics.snapshot()['counters'] if c['name'] != 'sections_removed']
+        if engine == 'compiled':
+            timed = {name for name, _ in metrics.timers}
+            assert {'fuzzy_match', 'find_trec_item', 'comment_formatting'} <= timed
+    assert {c['name'] for c in counters['compiled']} >= {'items_mapped', 'items_skipped', 'items_fuzzy_matched',
+                                                          'photos_emitted', 'videos_emitted'}
+    assert counters['compiled'] == counters['dom']
+
+def test_failed_render_leaves_no_report(tmp_path):
+    from populate_trec_complete import write_report
+    
+    def chunks():
+        yield '<html><body>'
+        raise ValueError("malformed inspection")
+    
+    output_path = tmp_path / 'report.html'
+    try:
+        write_report(str(output_path), chunks())
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("write_report swallowed the render error")
+    assert list(tmp_path.iterdir()) == []
+
+def test_server_rejects_malformed_nested_payload(tmp_path, monkeypatch):
+    import http.client
+    import threading
+    from functools import partial
+    import populate_trec_complete
+    from render_cache import RenderCache
+    from server import MyHTTPRequestHandler, TRECServer
+    # Keep the server's learned-mapping cache out of src/
+    monkeypatch.setattr(populate_trec_complete, 'MAPPING_CACHE_PATH', str(tmp_path / 'mapping_cache.json'))
+    template = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TREC_Report_All.html')
+    malformed = [
+        {'inspection': []},
+        {'inspection': {'sections': [1]}},
+        {'inspection': {'sections': [{'lineItems': 'Foundation'}]}},
+        {'inspection': {'sections': [{'lineItems': [{'name': 'Foundation', 'comments': ['Cracked']}]}]}},
+        {'inspection': {'clientInfo': 'Jane Doe'}},
+        {'inspection': {'sections': [{'lineItems': [{'name': 'Foundation', 'comments': [
+            {'text': 'Cracked', 'order': 'first'}]}]}]}},
+        {'inspection': {'sections': [{'lineItems': [{'name': 'Foundation', 'inspectionStatus': 3}]}]}},
+    ]
+    # Missing, null and numeric-string orders sort as numbers
+    accepted = {'inspection': {'sections': [{'name': 'Structural Systems', 'lineItems': [
+        {'name': 'Foundations', 'comments': [
+            {'text': 'Cracked', 'order': None}, {'text': 'Settled', 'order': '2'},
+            {'text': 'Sloped', 'order': 1}, {'text': 'Patched'}]}]}]}}
+    
+    httpd = TRECServer(('127.0.0.1', 0), partial(MyHTTPRequestHandler, directory=str(tmp_path)))
+    try:
+        httpd.start_rendering(template, 'compiled', 1, RenderCache(memory_entries=4))
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            for payload, status in [(payload, 400) for payload in malformed] + [(accepted, 200)]:
+                connection = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+                connection.request('POST', '/render', json.dumps(payload), {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                assert response.status == status, payload
+        finally:
+            httpd.shutdown()
+            thread.join()
+    finally:
+        httpd.server_close()
+
+
+def test_server_close_drops_idle_keep_alive_connections(tmp_path):
+    import http.client
+    import threading
+    from functools import partial
+    from server import KEEP_ALIVE_TIMEOUT, MyHTTPRequestHandler, TRECServer
+    write_sample_assets(str(tmp_path))
+    
+    httpd = TRECServer(('127.0.0.1', 0), partial(MyHTTPRequestHandler, directory=str(tmp_path)))
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    connection = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+    try:
+        connection.request('GET', '/logo.png')
+        response = connection.getresponse()
+        assert response.read() == PNG_BYTES
+        # The connection stays open, idle, waiting for another request
+        start = time.perf_counter()
+        httpd.shutdown()
+        thread.join()
+        httpd.server_close()
+        assert time.perf_counter() - start < KEEP_ALIVE_TIMEOUT / 3
+    finally:
+        connection.close()
+
+
+def test_version_skips_feature_imports():
+    # --version and --check are answered before the bundle, media, cache and
+    # streaming modules (or BeautifulSoup) are imported
+    import subprocess
+    import sys
+    script = ("import runpy, sys\n"
+              "sys.argv = ['populate_trec_complete', '--version']\n"
+              "try:\n"
+              "    runpy.run_module('populate_trec_complete', run_name='__main__')\n"
+              "except SystemExit:\n"
+              "    pass\n"
+              "print(' '.join(sorted(sys.modules)))\n")
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert '1.0.0' in result.stdout
+    loaded = set(result.stdout.split())
+    assert loaded.isdisjoint({'bs4', 'report_bundle', 'media_pipeline', 'render_cache',
+                              'inspection_stream', 'zipfile'})
+
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,746 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TREC Report Content
+Line-item mapping tables and the content rules shared by the DOM and compiled
+render paths: name resolution (with the learned-mapping cache), comment and
+media formatting, and the report CSS.
+"""
+import hashlib
+import html
+import json
+import os
+import re
+import urllib.parse
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+from inspection_model import Inspection, Section, LineItem, Comment, MediaRef
+from instrumentation import Metrics
+
+# Comprehensive mapping of inspection line items to TREC sections/items
+TREC_MAPPING = {
+    # Structural Systems (Section I - index 0)
+    "structural": {
+        "Foundation": ("A", 0),
+        "Grading and Drainage": ("B", 0),
+        "Roof Covering Materials": ("C", 0),
+        "Roof Structures and Attics": ("D", 0),
+        "Walls": ("E", 0),
+        "Ceilings and Floors": ("F", 0),
+        "Doors": ("G", 0),
+        "Windows": ("H", 0),
+        "Stairways": ("I", 0),
+        "Fireplaces and Chimneys": ("J", 0),
+        "Porches, Balconies, Decks, and Carports": ("K", 0),
+        "Other": ("L", 0),
+    },
+    # Electrical Systems (Section II - index 1)
+    "electrical": {
+        "Service Entrance and Panels": ("A", 1),
+        "Branch Circuits": ("B", 1),
+        "Other": ("C", 1),
+    },
+    # HVAC Systems (Section III - index 2)
+    "hvac": {
+        "Heating Equipment": ("A", 2),
+        "Cooling Equipment": ("B", 2),
+        "Duct Systems": ("C", 2),
+        "Other": ("D", 2),
+    },
+    # Plumbing Systems (Section IV - index 3)
+    "plumbing": {
+        "Plumbing Supply": ("A", 3),
+        "Drains, Wastes, and Vents": ("B", 3),
+        "Water Heating Equipment": ("C", 3),
+        "Hydro-Massage Therapy Equipment": ("D", 3),
+        "Gas Distribution": ("E", 3),
+        "Other": ("F", 3),
+    },
+    # Appliances (Section V - index 4)
+    "appliances": {
+        "Dishwashers": ("A", 4),
+        "Food Waste Disposers": ("B", 4),
+        "Range Hood": ("C", 4),
+        "Ranges, Cooktops, and Ovens": ("D", 4),
+        "Microwave Ovens": ("E", 4),
+        "Mechanical Exhaust": ("F", 4),
+        "Garage Door Operators": ("G", 4),
+        "Dryer Exhaust": ("H", 4),
+        "Other": ("I", 4),
+    },
+    # Optional Systems (Section VI - index 5)
+    "optional": {
+        "Landscape Irrigation": ("A", 5),
+        "Swimming Pools": ("B", 5),
+        "Outbuildings": ("C", 5),
+        "Private Water Wells": ("D", 5),
+        "Private Sewage Disposal": ("E", 5),
+        "Other Built-in Appliances": ("F", 5),
+        "Other": ("G", 5),
+    }
+}
+
+# Line item name to TREC mapping
+LINE_ITEM_MAPPING = {
+    # Structural
+    "Decks and Stairways": ("K", 0, "Porches, Balconies, Decks, and Carports"),
+    "Ground-Level Entry Structures": ("K", 0, "Porches, Balconies, Decks, and Carports"),
+    "Exterior Cladding and Trim": ("E", 0, "Walls (Interior and Exterior)"),
+    "Exterior Wall Cladding and Finishes": ("E", 0, "Walls (Interior and Exterior)"),
+    "Window Systems and Sealing": ("H", 0, "Windows"),
+    "Window Systems and Flashing": ("H", 0, "Windows"),
+    "Chimney Structures": ("J", 0, "Fireplaces and Chimneys"),
+    "Chimney Systems": ("J", 0, "Fireplaces and Chimneys"),
+    "Eaves and Soffit Components": ("K", 0, "Porches, Balconies, Decks, and Carports"),
+    "Paved Surfaces and Walkways": ("K", 0, "Porches, Balconies, Decks, and Carports"),
+    "Perimeter Fencing and Gates": ("L", 0, "Other"),
+    "Exterior Elevated Structures": ("K", 0, "Porches, Balconies, Decks, and Carports"),
+    "Exterior Entryways": ("G", 0, "Doors (Interior and Exterior)"),
+    "Site Grading and Drainage": ("B", 0, "Grading and Drainage"),
+    "Roof Covering Materials": ("C", 0, "Roof Covering Materials"),
+    "Roof Structures and Attics": ("D", 0, "Roof Structures and Attics"),
+    "Overall Roof Condition": ("C", 0, "Roof Covering Materials"),
+    "Roofing Material Integrity": ("C", 0, "Roof Covering Materials"),
+    "Flashing System Integrity": ("C", 0, "Roof Covering Materials"),
+    "Roof Flashing Components": ("C", 0, "Roof Covering Materials"),
+    "Roof Penetrations and Ventilation": ("D", 0, "Roof Structures and Attics"),
+    "Exterior Drainage Systems": ("B", 0, "Grading and Drainage"),
+    "Rainwater Management Systems": ("B", 0, "Grading and Drainage"),
+    
+    # HVAC
+    "Outdoor HVAC Unit": ("B", 2, "Cooling Equipment"),
+    "Outdoor Air Conditioning Unit": ("B", 2, "Cooling Equipment"),
+    
+    # Plumbing
+    "Exterior Water Taps and Drainage Access": ("A", 3, "Plumbing Supply, Distribution Systems and Fixtures"),
+    "Bathtub and Shower Systems": ("A", 3, "Plumbing Supply, Distribution Systems and Fixtures"),
+    
+    # Appliances
+    "Food Waste Disposer": ("B", 4, "Food Waste Disposers"),
+    "Integrated Appliances": ("I", 4, "Other"),
+    "Kitchen Ventilation": ("C", 4, "Range Hood and Exhaust Systems"),
+    "Microwave Oven": ("E", 4, "Microwave Ovens"),
+    "Dishwashing Unit": ("A", 4, "Dishwashers"),
+    "Laundry Appliances": ("H", 4, "Dryer Exhaust Systems"),
+    "Wine Refrigerator": ("I", 4, "Other"),
+    "Refrigeration Unit": ("I", 4, "Other"),
+    
+    # Electrical
+    "Electrical Receptacles, Switches, and Signaling Devices": ("B", 1, "Branch Circuits, Connected Devices, and Fixtures"),
+    "Electrical Conductors and Wiring": ("B", 1, "Branch Circuits, Connected Devices, and Fixtures"),
+    
+    # Structural
+    "Interior Door Systems": ("G", 0, "Doors (Interior and Exterior)"),
+    "Window Assemblies": ("H", 0, "Windows"),
+    "Window Systems": ("H", 0, "Windows"),
+    "Interior Wall Systems": ("E", 0, "Walls (Interior and Exterior)"),
+    "Interior Flooring Surfaces": ("F", 0, "Ceilings and Floors"),
+    "Ceiling Surfaces": ("F", 0, "Ceilings and Floors"),
+    "Floor Coverings": ("F", 0, "Ceilings and Floors"),
+    "Exterior Door Systems": ("G", 0, "Doors (Interior and Exterior)"),
+    "Subflooring": ("F", 0, "Ceilings and Floors"),
+    "Main Structural Supports": ("A", 0, "Foundations"),
+    "Floor Joist System": ("F", 0, "Ceilings and Floors"),
+    "General Structural Information": ("A", 0, "Foundations"),
+    "Substructure Entry": ("A", 0, "Foundations"),
+    "Outdoor Living Area Covers": ("K", 0, "Porches, Balconies, Decks, and Carports"),
+    "Exterior Plantings": ("L", 0, "Other"),
+    "Landscape Retaining Structures": ("B", 0, "Grading and Drainage"),
+    
+    # HVAC
+    "Indoor HVAC Unit": ("A", 2, "Heating Equipment"),
+    
+    # Optional - can map to Other
+    "Crawlspace Assessment": ("L", 0, "Other"),
+    "Interior Cabinetry and Countertops": ("L", 0, "Other"),
+    "Interior Passageways": ("L", 0, "Other"),
+    
+    # General/Info sections - map to appropriate fields
+    "Report Context": None,  # Skip - informational only
+    "General Information": None,  # Skip - informational only, not a TREC line item
+    "Site and Property Context": ("B", 0, "Grading and Drainage"),  # Keep this mapping
+}
+
+# Report CSS injected into the template's <style> block
+FORMATTING_CSS = """
+        /* Ensure all pages match pages 1-2 height and structure */
+        .page {
+            min-height: 11in !important;
+            display: flex !important;
+            flex-direction: column !important;
+            overflow: visible !important;
+        }
+        
+        /* Content area should expand to fill available space like pages 1-2 */
+        .page .content {
+            flex: 1 !important;
+            display: flex !important;
+            flex-direction: column !important;
+            overflow: visible !important;
+            padding: 0.6in !important;
+        }
+        
+        /* Ensure pages 3+ match padding-bottom pattern of pages 1-2 */
+        .page:nth-child(n+3) .content {
+            padding-bottom: calc(0.6in * 0.7) !important;
+        }
+        
+        /* Footer should stay at bottom */
+        .footer {
+            flex-shrink: 0;
+            margin: 0 0.6in 0.6in 0.6in;
+        }
+        
+        /* Content should flow naturally - no clipping */
+        .page .content > * {
+            flex-shrink: 0;
+        }
+        
+        /* Comment formatting */
+        .comment-item {
+            margin: 8px 0;
+            padding: 4px 0;
+            line-height: 1.5;
+            page-break-inside: avoid;
+        }
+        .comment-item p {
+            margin: 4px 0;
+        }
+        
+        /* Media container - prevent overflow, allow page breaks */
+        .media-container {
+            margin: 10px 0;
+            clear: both;
+            page-break-inside: avoid;
+            break-inside: avoid;
+            max-width: 100%;
+        }
+        .media-container img,
+        .media-container video {
+            max-width: 250px !important;
+            max-height: 200px !important;
+            width: auto !important;
+            height: auto !important;
+            display: block;
+            clear: both;
+            border: 1px solid #ddd;
+            padding: 2px;
+            margin: 8px 0;
+            object-fit: contain;
+        }
+        
+        /* Comments - allow natural growth */
+        .comments {
+            word-wrap: break-word;
+            height: auto !important;
+            min-height: 0.5in;
+            overflow: visible !important;
+            max-height: none !important;
+        }
+        .comments-inline {
+            height: auto !important;
+            overflow: visible !important;
+        }
+        
+        /* Items - prevent awkward page breaks */
+        .item {
+            page-break-inside: avoid;
+            break-inside: avoid;
+            min-height: auto;
+            overflow: visible;
+        }
+        .item .comments[contenteditable="true"] {
+            height: auto !important;
+            min-height: 0.5in;
+            overflow: visible !important;
+        }
+        
+        /* Section titles - keep with content */
+        .section-title {
+            page-break-after: avoid;
+            break-after: avoid;
+        }
+        
+        /* Print media - proper page breaks and consistent heights */
+        @media print {
+            @page {
+                size: letter;
+                margin: 0;
+            }
+            .page {
+                min-height: 11in !important;
+                height: auto !important;
+                page-break-after: always;
+                page-break-inside: avoid;
+                break-inside: avoid;
+                overflow: visible !important;
+            }
+            .page:last-child {
+                page-break-after: auto;
+            }
+            .page .content {
+                overflow: visible !important;
+                height: auto !important;
+            }
+            .item {
+                page-break-inside: avoid;
+                break-inside: avoid;
+                orphans: 3;
+                widows: 3;
+            }
+            .media-container {
+                page-break-inside: avoid;
+                break-inside: avoid;
+            }
+            .section-title {
+                page-break-after: avoid;
+                break-after: avoid;
+            }
+        }
+        
+        /* Screen view - allow natural flow, no clipping */
+        @media screen {
+            .page {
+                overflow: visible !important;
+            }
+            .page .content {
+                overflow: visible !important;
+            }
+        }
+        """
+
+# Header input ids and the labels used when reporting them
+HEADER_FIELD_LABELS = {
+    'client': 'Client',
+    'date': 'Date',
+    'address': 'Address',
+    'inspector': 'Inspector',
+    'trec1': 'Inspector TREC License',
+    'sponsor': 'Sponsor',
+    'trec2': 'Sponsor TREC License',
+}
+
+# Inline styles shared by the DOM and compiled-template render paths
+COMMENTS_STYLE = 'overflow: visible !important; height: auto !important; min-height: 0.5in; max-height: none !important;'
+COMMENTS_INLINE_STYLE = 'height: auto; overflow: visible;'
+ADDITIONAL_FINDING_SEPARATOR = '<hr style="margin: 12px 0; border: none; border-top: 2px solid #ccc;"/><p style="font-weight: bold; margin: 8px 0;">Additional Finding:</p>'
+# Markup shared by every comment and media fragment, built once
+COMMENT_SEPARATOR = '<hr style="margin: 12px 0; border: none; border-top: 1px solid #eee;"/>'
+MEDIA_CONTAINER_START = '<div class="media-container" style="margin: 10px 0; clear: both;">'
+CAPTION_START = '<p style="font-size: 0.85em; font-style: italic; margin: 4px 0;"><em>'
+PHOTO_STYLE = "max-width: 250px; max-height: 200px; margin: 8px 0; display: block; clear: both; border: 1px solid #ddd; padding: 2px;"
+VIDEO_STYLE = "max-width: 250px; max-height: 200px; margin: 8px 0; display: block; clear: both;"
+STATUS_CHECKBOX_INDEX = {"I": 0, "NI": 1, "NP": 2, "D": 3}
+# Report media is displayed within this box (see .media-container in FORMATTING_CSS)
+MEDIA_BOX = (250, 200)
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.webm', '.ogv', '.avi', '.3gp')
+
+
+def transform_value(value: Any, transform_type: Optional[str] = None) -> str:
+    """Transform value based on type"""
+    if value is None:
+        return ""
+    
+    if transform_type == "date":
+        try:
+            if isinstance(value, (int, float)):
+                dt = datetime.fromtimestamp(value / 1000)
+            else:
+                dt = datetime.fromisoformat(str(value))
+            return dt.strftime("%m/%d/%Y")
+        except:
+            return str(value)
+    
+    return str(value)
+
+
+def header_field_values(inspection: Inspection) -> Dict[str, Any]:
+    """Header input values keyed by element id, in form order"""
+    values = {'client': inspection.client_name}
+    
+    if inspection.inspection_date:
+        values['date'] = transform_value(inspection.inspection_date, 'date')
+    
+    values['address'] = inspection.address
+    values['inspector'] = inspection.inspector_name
+    values['trec1'] = inspection.inspector_license
+    
+    if inspection.sponsor_name:
+        values['sponsor'] = inspection.sponsor_name
+    if inspection.sponsor_license:
+        values['trec2'] = inspection.sponsor_license
+    
+    return values
+
+
+def is_empty_item(line_item: LineItem) -> bool:
+    """Check if line item is empty (no status, no comments and no media)"""
+    return line_item.status is None and not line_item.comments and not line_item.media
+
+
+def is_video(media: MediaRef) -> bool:
+    if media.content_type:
+        return media.content_type.startswith('video/')
+    return os.path.splitext(urllib.parse.urlparse(media.url).path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def line_item_media(line_item: LineItem) -> Tuple[List[MediaRef], List[MediaRef]]:
+    """(photos, videos) attached to the line item itself
+    
+    Media already shown with one of its comments (same URL or id) is left
+    out, as are repeats within the line item.
+    """
+    seen_urls = set()
+    seen_ids = set()
+    for comment in line_item.comments:
+        for media in comment.photos + comment.videos:
+            seen_urls.add(media.url)
+            seen_ids.add(media.id)
+    seen_ids.discard('')
+    photos, videos = [], []
+    for media in line_item.media:
+        if not media.url or media.url in seen_urls or media.id in seen_ids:
+            continue
+        seen_urls.add(media.url)
+        if media.id:
+            seen_ids.add(media.id)
+        (videos if is_video(media) else photos).append(media)
+    return photos, videos
+
+
+def media_size_attrs(media: MediaRef) -> str:
+    """width/height attributes for the displayed size, when the media's size is known
+    
+    Lets browsers and PDF engines lay the page out before the file loads.
+    """
+    width, height = media.width, media.height
+    if not isinstance(width, (int, float)) or not isinstance(height, (int, float)) or width <= 0 or height <= 0:
+        return ''
+    scale = min(1.0, MEDIA_BOX[0] / width, MEDIA_BOX[1] / height)
+    return f' width="{max(1, round(width * scale))}" height="{max(1, round(height * scale))}"'
+
+
+def format_photo(photo: MediaRef) -> str:
+    caption = html.escape(photo.caption)
+    caption_text = f'{CAPTION_START}{caption}</em></p>' if caption else ''
+    return (f'{MEDIA_CONTAINER_START}{caption_text}<img src="{html.escape(photo.url)}" alt="{caption}"'
+            f'{media_size_attrs(photo)} loading="lazy" decoding="async" style="{PHOTO_STYLE}" /></div>')
+
+
+def format_video(video: MediaRef) -> str:
+    return (f'{MEDIA_CONTAINER_START}<video src="{html.escape(video.url)}"{media_size_attrs(video)} '
+            f'controls preload="metadata" style="{VIDEO_STYLE}"></video></div>')
+
+
+def format_comment_text(comment: Comment) -> str:
+    """Format a single comment's text"""
+    parts = []
+    
+    if comment.location:
+        parts.append(f'<p><strong>Location:</strong> {html.escape(comment.location)}</p>')
+    
+    if comment.text:
+        parts.append(f'<p>{html.escape(comment.text)}</p>')
+    
+    return ''.join(parts)
+
+
+def format_all_comments(comments: Sequence[Comment]) -> str:
+    """Format all comments for a line item"""
+    if not comments:
+        return ''
+    
+    # Sort by order
+    sorted_comments = sorted(comments, key=lambda c: c.order)
+    
+    html_parts = []
+    for idx, comment in enumerate(sorted_comments):
+        # Format comment text
+        comment_html = format_comment_text(comment)
+        if comment_html:
+            html_parts.append(f'<div class="comment-item">{comment_html}</div>')
+        
+        # Add media
+        html_parts.extend(format_photo(photo) for photo in comment.photos if photo.url)
+        html_parts.extend(format_video(video) for video in comment.videos if video.url)
+        
+        if idx < len(sorted_comments) - 1:
+            html_parts.append(COMMENT_SEPARATOR)
+    
+    return '\n'.join(html_parts)
+
+
+def format_line_item(line_item: LineItem) -> str:
+    """Format a line item's comments followed by its own (non-duplicate) media"""
+    html_parts = []
+    comments_html = format_all_comments(line_item.comments)
+    if comments_html:
+        html_parts.append(comments_html)
+    photos, videos = line_item_media(line_item)
+    html_parts.extend(format_photo(photo) for photo in photos)
+    html_parts.extend(format_video(video) for video in videos)
+    return '\n'.join(html_parts)
+
+
+def count_line_item_output(metrics: Metrics, line_item: LineItem) -> None:
+    """Count the comments, photos and videos format_line_item emits for a line item"""
+    photos, videos = line_item_media(line_item)
+    metrics.count('comments_emitted', len(line_item.comments))
+    metrics.count('photos_emitted', len(photos) + sum(
+        1 for comment in line_item.comments for photo in comment.photos if photo.url))
+    metrics.count('videos_emitted', len(videos) + sum(
+        1 for comment in line_item.comments for video in comment.videos if video.url))
+
+
+# Fragment text splits into comments, tags and the text between them
+MARKUP_TOKEN = re.compile(r'(<!--.*?-->|<[^>]*>)', re.DOTALL)
+MEDIA_TAG = re.compile(r'<(?:img|video)\b', re.IGNORECASE)
+
+
+def has_text(html_fragment: str) -> bool:
+    """Whether an HTML fragment has any visible text"""
+    return bool(html.unescape(MARKUP_TOKEN.sub('', html_fragment)).strip())
+
+
+def has_content(html_fragment: str) -> bool:
+    """Whether an HTML fragment has visible text or an image or video"""
+    return has_text(html_fragment) or MEDIA_TAG.search(html_fragment) is not None
+
+
+def build_fuzzy_index(mapping: Dict[str, Optional[tuple]]) -> Dict[str, List[int]]:
+    """Inverted index of lowercase name word -> positions of mapped names containing it"""
+    index: Dict[str, List[int]] = {}
+    for position, (mapped_name, target) in enumerate(mapping.items()):
+        if target is None:
+            continue  # Informational entries are never fuzzy targets
+        for word in set(mapped_name.lower().split()):
+            index.setdefault(word, []).append(position)
+    return index
+
+
+# Built once at import; LINE_ITEM_MAPPING is static
+FUZZY_MAPPING_ENTRIES = list(LINE_ITEM_MAPPING.items())
+FUZZY_ENTRY_WORD_COUNTS = [len(set(name.lower().split())) for name, _ in FUZZY_MAPPING_ENTRIES]
+FUZZY_WORD_INDEX = build_fuzzy_index(LINE_ITEM_MAPPING)
+FUZZY_MIN_SHARED_WORDS = 2
+
+
+@lru_cache(maxsize=4096)
+def fuzzy_match_line_item(line_item_name: str) -> Optional[tuple]:
+    """Match an unmapped line item to the mapped name sharing the most words
+    
+    Candidates need at least two words in common. Ties go to the higher
+    overlap ratio, then to the earlier mapping entry, so the result does not
+    depend on which candidate happens to be seen first.
+    """
+    name_words = set(line_item_name.lower().split())
+    
+    shared: Dict[int, int] = {}
+    for word in name_words:
+        for position in FUZZY_WORD_INDEX.get(word, ()):
+            shared[position] = shared.get(position, 0) + 1
+    
+    best = None
+    for position, overlap in shared.items():
+        if overlap < FUZZY_MIN_SHARED_WORDS:
+            continue
+        union = len(name_words) + FUZZY_ENTRY_WORD_COUNTS[position] - overlap
+        score = (overlap, overlap / union, -position)
+        if best is None or score > best[0]:
+            best = (score, position)
+    
+    return FUZZY_MAPPING_ENTRIES[best[1]][1] if best else None
+
+
+def mapping_tables_version() -> str:
+    """Fingerprint of the mapping tables; learned resolutions are only valid for one version"""
+    tables = [TREC_MAPPING, list(LINE_ITEM_MAPPING.items()), FUZZY_MIN_SHARED_WORDS]
+    return hashlib.sha256(json.dumps(tables, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+# Learned resolutions are stored next to the mapping tables
+MAPPING_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'line_item_mapping_cache.json')
+
+
+class MappingCache:
+    """Persistent record of how names missing from LINE_ITEM_MAPPING resolved
+    
+    Each entry holds the fuzzy match result (None when unresolved) and a hit
+    count. The file is versioned by mapping_tables_version(), so editing the
+    tables discards every learned entry.
+    """
+    
+    def __init__(self, path: str = MAPPING_CACHE_PATH):
+        self.path = path
+        self.version = mapping_tables_version()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.pending_hits: Dict[str, int] = {}  # Hits not yet written to disk
+    
+    @classmethod
+    def load(cls, path: str = MAPPING_CACHE_PATH) -> 'MappingCache':
+        cache = cls(path)
+        cache.entries = cache._read_entries()
+        return cache
+    
+    def _read_entries(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if stored.get('version') != self.version:
+            return {}
+        return {name: {'mapping': tuple(entry['mapping']) if entry.get('mapping') else None,
+                       'hits': entry.get('hits', 0)}
+                for name, entry in stored.get('names', {}).items()}
+    
+    def resolve(self, line_item_name: str) -> Optional[tuple]:
+        """Resolve a name missing from LINE_ITEM_MAPPING, learning new names"""
+        entry = self.entries.get(line_item_name)
+        if entry is None:
+            entry = self.entries[line_item_name] = {'mapping': fuzzy_match_line_item(line_item_name), 'hits': 0}
+        entry['hits'] += 1
+        self.pending_hits[line_item_name] = self.pending_hits.get(line_item_name, 0) + 1
+        return entry['mapping']
+    
+    def drain_pending(self) -> Dict[str, int]:
+        """Hand over hits recorded since the last drain (for merging across processes)"""
+        pending, self.pending_hits = self.pending_hits, {}
+        return pending
+    
+    def merge_hits(self, hits: Dict[str, int]) -> None:
+        """Record hits counted by another process"""
+        for name, count in hits.items():
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self.entries[name] = {'mapping': fuzzy_match_line_item(name), 'hits': 0}
+            entry['hits'] += count
+            self.pending_hits[name] = self.pending_hits.get(name, 0) + count
+    
+    def save(self) -> None:
+        """Write the cache, adding this process's hits to whatever is on disk"""
+        merged = self._read_entries()
+        for name, count in self.drain_pending().items():
+            entry = merged.setdefault(name, {'mapping': self.entries[name]['mapping'], 'hits': 0})
+            entry['hits'] += count
+        self.entries = merged
+        
+        payload = {
+            'version': self.version,
+            'names': {name: {'mapping': list(entry['mapping']) if entry['mapping'] else None,
+                             'hits': entry['hits']}
+                      for name, entry in sorted(merged.items())},
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+        os.replace(tmp_path, self.path)
+    
+    def hottest_unmapped(self, limit: int = 20) -> List[tuple]:
+        """(name, hits) for names that could not be resolved, most frequent first"""
+        unmapped = [(name, entry['hits']) for name, entry in self.entries.items() if entry['mapping'] is None]
+        return sorted(unmapped, key=lambda item: (-item[1], item[0]))[:limit]
+
+
+# Active learned-mapping cache, if one has been loaded (see use_mapping_cache)
+_mapping_cache: Optional[MappingCache] = None
+
+
+def use_mapping_cache(cache: Optional[MappingCache]) -> None:
+    """Route resolution of unmapped names through ``cache`` (None disables it)"""
+    global _mapping_cache
+    _mapping_cache = cache
+
+
+def active_mapping_cache() -> Optional[MappingCache]:
+    """The cache set by use_mapping_cache, if any"""
+    return _mapping_cache
+
+
+def resolve_unmapped_line_item(line_item_name: str) -> Optional[tuple]:
+    """Resolve a name missing from LINE_ITEM_MAPPING via the learned cache or fuzzy matching"""
+    if _mapping_cache is not None:
+        return _mapping_cache.resolve(line_item_name)
+    return fuzzy_match_line_item(line_item_name)
+
+
+def resolve_line_item_mapping(line_item_name: str) -> Optional[tuple]:
+    """Resolve a line item name to (code, section index, title), or None to skip"""
+    if line_item_name in LINE_ITEM_MAPPING:
+        # Explicit None entries are informational items
+        return LINE_ITEM_MAPPING[line_item_name]
+    return resolve_unmapped_line_item(line_item_name)
+
+
+def group_line_items(sections: Iterable[Section], lookup,
+                     metrics: Optional[Metrics] = None) -> Dict[str, Dict[str, Any]]:
+    """Group mapped line items by the TREC item they populate, in first-seen order
+    
+    ``lookup(section_index, item_code, item_title)`` returns the template item
+    (or None); the first line item of each group provides the status and the
+    rest are rendered as "Additional Finding" blocks. ``metrics`` receives the
+    same mapping timers and counters as ``CompleteTRECPopulator``.
+    """
+    groups = {}
+    for section in sections:
+        for line_item in section.line_items:
+            if is_empty_item(line_item):
+                if metrics is not None:
+                    metrics.count('items_skipped', reason='empty')
+                continue
+            line_item_name = line_item.name
+            if line_item_name in LINE_ITEM_MAPPING:
+                # Explicit None entries are informational items
+                mapping = LINE_ITEM_MAPPING[line_item_name]
+                if mapping is None:
+                    if metrics is not None:
+                        metrics.count('items_skipped', reason='informational')
+                    continue
+            elif metrics is None:
+                mapping = resolve_unmapped_line_item(line_item_name)
+                if not mapping:
+                    continue
+            else:
+                with metrics.timer('fuzzy_match'):
+                    mapping = resolve_unmapped_line_item(line_item_name)
+                if not mapping:
+                    metrics.count('items_skipped', reason='unmapped')
+                    continue
+                metrics.count('items_fuzzy_matched')
+            
+            item_code, section_idx, item_title = mapping
+            item_key = f"{section_idx}_{item_code}"
+            group = groups.get(item_key)
+            if group is not None:
+                group['line_items'].append(line_item)
+                if metrics is not None:
+                    metrics.count('items_mapped')
+                    metrics.count('additional_findings')
+                continue
+            
+            if metrics is None:
+                trec_item = lookup(section_idx, item_code, item_title)
+            else:
+                with metrics.timer('find_trec_item'):
+                    trec_item = lookup(section_idx, item_code, item_title)
+            if trec_item is None:
+                if metrics is not None:
+                    metrics.count('items_skipped', reason='no_template_item')
+                continue
+            if metrics is not None:
+                metrics.count('items_mapped')
+            groups[item_key] = {'item': trec_item, 'line_items': [line_item]}
+    return groups
+
+
+# Elements whose text must keep its whitespace when minifying
+PRESERVE_WHITESPACE = frozenset(['pre', 'textarea', 'script', 'style'])
+
+WHITESPACE_RUN = re.compile(r'\s+')
+
+
+def title_keywords(title: str) -> List[str]:
+    """Normalize a TREC item title into lowercase keywords"""
+    return re.findall(r'[a-z0-9]+', title.lower())
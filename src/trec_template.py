@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled TREC Template
+Compiles TREC_Report_All.html once into a render plan (static HTML fragments
+plus named slots) that can be filled from any number of inspections without
+building a DOM.
+"""
+import html
+import os
+import re
+from html.parser import HTMLParser
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, NamedTuple, Sequence, Set, Tuple, Union
+
+from inspection_model import Inspection, LineItem, Section
+from instrumentation import Metrics
+
+from trec_content import (
+    FORMATTING_CSS,
+    COMMENTS_STYLE,
+    COMMENTS_INLINE_STYLE,
+    ADDITIONAL_FINDING_SEPARATOR,
+    STATUS_CHECKBOX_INDEX,
+    HEADER_FIELD_LABELS,
+    PRESERVE_WHITESPACE,
+    WHITESPACE_RUN,
+    MARKUP_TOKEN,
+    header_field_values,
+    has_content,
+    count_line_item_output,
+    format_line_item,
+    group_line_items,
+    title_keywords,
+)
+
+# An Inspection, or a callable producing one once streamed sections are read
+InspectionSource = Union[Inspection, Callable[[], Inspection]]
+
+# Elements that never have an end tag
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+class Slot(NamedTuple):
+    """A replaceable region of the template"""
+    key: tuple  # ('header', id) / ('check', section, item, n) / ('comments', section, item) ...
+    # ('section_start', section) / ('section_end', section) are empty markers
+    # around a section's title and items, for pruning empty sections
+    tag: str
+    attrs: Tuple[Tuple[str, Optional[str]], ...]
+    self_closing: bool
+    default: str  # Original template text for the region
+
+
+class PlanItem(NamedTuple):
+    """A TREC item in the compiled template"""
+    code: str
+    title: str
+
+
+class TemplatePlan(NamedTuple):
+    """Immutable compiled template: fragments are str (static) or Slot"""
+    source_path: str
+    fragments: Tuple[Union[str, Slot], ...]
+    section_items: Tuple[Tuple[PlanItem, ...], ...]
+    item_index: Dict[Tuple[int, str], int]  # (section, code) -> item position
+    keyword_index: Dict[Tuple[int, str], int]  # (section, keyword) -> first item position
+    page_count: int
+
+
+def render_starttag(tag: str, attrs, self_closing: bool, overrides: Dict[str, Optional[str]]) -> str:
+    """Serialize a start tag, replacing or appending the given attributes"""
+    parts = ['<', tag]
+    pending = dict(overrides)
+    for name, value in attrs:
+        if name in pending:
+            value = pending.pop(name)
+        parts.append(f' {name}' if value is None else f' {name}="{html.escape(value)}"')
+    for name, value in pending.items():
+        parts.append(f' {name}' if value is None else f' {name}="{html.escape(value)}"')
+    parts.append(' />' if self_closing else '>')
+    return ''.join(parts)
+
+
+def section_marker(kind: str, section: int) -> Slot:
+    return Slot((kind, section), '', (), False, '')
+
+
+class _PlanBuilder(HTMLParser):
+    """Single pass over the template recording slot positions"""
+
+    def __init__(self, source: str):
+        super().__init__(convert_charrefs=True)
+        self.source = source
+        self.line_offsets = [0]
+        for line in source.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+
+        self.stack: List[Dict[str, Any]] = []
+        self.edits: List[Tuple[int, int, Union[str, Slot]]] = []
+        self.section_items: List[List[Dict[str, str]]] = []
+        self.section_depth: Optional[int] = None
+        self.seen_header_ids = set()
+        self.page_count = 0
+        self.page_inputs = 0
+        self.style_found = False
+
+    def source_offset(self) -> int:
+        line, col = self.getpos()
+        return self.line_offsets[line - 1] + col
+
+    def find_ancestor(self, css_class: str) -> Optional[Dict[str, Any]]:
+        for entry in reversed(self.stack):
+            if css_class in entry['classes']:
+                return entry
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, self_closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, self_closing=True)
+
+    def _start(self, tag, attrs, self_closing):
+        raw = self.get_starttag_text()
+        start = self.source_offset()
+        end = start + len(raw)
+        attr_map = dict(attrs)
+        classes = (attr_map.get('class') or '').split()
+        entry = {'tag': tag, 'classes': classes, 'start': start, 'body_start': end, 'role': None}
+
+        def slot(key):
+            return Slot(key, tag, tuple(attrs), self_closing, raw)
+
+        if tag == 'div' and 'page' in classes:
+            self.page_count += 1
+
+        if tag == 'style' and not self.style_found:
+            entry['role'] = 'style'
+            self.style_found = True
+
+        element_id = attr_map.get('id')
+        if element_id in HEADER_FIELD_LABELS and element_id not in self.seen_header_ids:
+            self.seen_header_ids.add(element_id)
+            self.edits.append((start, end, slot(('header', element_id))))
+
+        if tag == 'div' and 'section-title' in classes:
+            self.section_items.append([])
+            self.section_depth = len(self.stack)
+            entry['role'] = 'section_title'
+            entry['section'] = len(self.section_items) - 1
+        elif (tag == 'div' and 'item' in classes and self.section_depth == len(self.stack)
+              and self.section_items):
+            entry['role'] = 'item'
+            entry['section'] = len(self.section_items) - 1
+            entry['position'] = len(self.section_items[-1])
+            entry['checkboxes'] = 0
+            entry['code'] = ''
+            entry['title'] = ''
+            entry['has_comments'] = False
+            entry['has_inline'] = False
+            self.section_items[-1].append(entry)
+        else:
+            item = self.find_ancestor('item')
+            if item is not None and item.get('role') == 'item':
+                item_id = (item['section'], item['position'])
+                if 'item-title' in classes or 'code' in classes:
+                    entry['role'] = 'code' if 'code' in classes else 'title'
+                    entry['item'] = item
+                elif (tag == 'input' and attr_map.get('type') == 'checkbox'
+                      and self.find_ancestor('checks') is not None):
+                    self.edits.append((start, end, slot(('check',) + item_id + (item['checkboxes'],))))
+                    item['checkboxes'] += 1
+                elif tag == 'div' and 'comments-inline' in classes and not item['has_inline']:
+                    item['has_inline'] = True
+                    self.edits.append((start, end, slot(('inline',) + item_id)))
+                elif (tag == 'div' and 'comments' in classes and not item['has_comments']
+                      and self.find_ancestor('comments-inline') is not None):
+                    item['has_comments'] = True
+                    entry['role'] = 'comments'
+                    entry['item_id'] = item_id
+                    self.edits.append((start, end, slot(('comments',) + item_id)))
+            elif (tag == 'input' and attr_map.get('type') == 'text'
+                  and self.find_ancestor('pagecount-center') is not None):
+                self.edits.append((start, end, slot(('page_count', self.page_inputs))))
+                self.page_inputs += 1
+
+        if not self_closing and tag not in VOID_ELEMENTS:
+            self.stack.append(entry)
+
+    def handle_endtag(self, tag):
+        if tag == 'head' and not self.style_found:
+            self.style_found = True
+            pos = self.source_offset()
+            self.edits.append((pos, pos, '<style>' + FORMATTING_CSS + '</style>'))
+
+        if not any(entry['tag'] == tag for entry in self.stack):
+            return
+        while self.stack:
+            entry = self.stack.pop()
+            if entry['role'] == 'comments':
+                body_start, body_end = entry['body_start'], self.source_offset()
+                body = self.source[body_start:body_end]
+                # Anything inside the comments body is replaced wholesale
+                self.edits = [e for e in self.edits if not (body_start <= e[0] and e[1] <= body_end and e[1] > e[0])]
+                self.edits.append((body_start, body_end, Slot(('comments_body',) + entry['item_id'], 'div', (), False, body)))
+            elif entry['role'] in ('section_title', 'item'):
+                pos = self.source_offset()
+                end = self.source.index('>', pos) + 1 if entry['tag'] == tag else pos
+                self.edits.append((entry['start'], entry['start'], section_marker('section_start', entry['section'])))
+                self.edits.append((end, end, section_marker('section_end', entry['section'])))
+            elif entry['role'] == 'style':
+                pos = self.source_offset()
+                existing = self.source[entry['body_start']:pos]
+                self.edits.append((pos, pos, '\n' + FORMATTING_CSS if existing else FORMATTING_CSS))
+            if entry['tag'] == tag:
+                break
+        # The section's parent closed: stop collecting items
+        if self.section_depth is not None and len(self.stack) < self.section_depth:
+            self.section_depth = None
+
+    def handle_data(self, data):
+        for entry in reversed(self.stack):
+            if entry['role'] in ('code', 'title'):
+                item = entry['item']
+                if entry['role'] == 'code':
+                    item['code'] += data
+                item['title'] += data
+                break
+
+
+def compile_template_source(source: str, source_path: str = '<string>') -> TemplatePlan:
+    """Compile template HTML into a TemplatePlan"""
+    builder = _PlanBuilder(source)
+    builder.feed(source)
+    builder.close()
+
+    fragments: List[Union[str, Slot]] = []
+    cursor = 0
+    for start, end, replacement in sorted(builder.edits, key=lambda e: (e[0], e[1])):
+        if start > cursor:
+            fragments.append(source[cursor:start])
+        fragments.append(replacement)
+        cursor = max(cursor, end)
+    fragments.append(source[cursor:])
+
+    # Merge adjacent static text
+    merged: List[Union[str, Slot]] = []
+    for fragment in fragments:
+        if isinstance(fragment, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += fragment
+        elif fragment != '':
+            merged.append(fragment)
+
+    section_items = []
+    item_index = {}
+    keyword_index = {}
+    for section_idx, entries in enumerate(builder.section_items):
+        items = []
+        for position, entry in enumerate(entries):
+            code = entry['code'].strip().rstrip('.')
+            title = re.sub(r'^[A-Z]\.\s*', '', entry['title'].strip(), count=1)
+            items.append(PlanItem(code, title))
+            if code:
+                item_index.setdefault((section_idx, code), position)
+            for keyword in title_keywords(title):
+                keyword_index.setdefault((section_idx, keyword), position)
+        section_items.append(tuple(items))
+
+    return TemplatePlan(
+        source_path=source_path,
+        fragments=tuple(merged),
+        section_items=tuple(section_items),
+        item_index=item_index,
+        keyword_index=keyword_index,
+        page_count=builder.page_count,
+    )
+
+
+def minify_plan(plan: TemplatePlan) -> TemplatePlan:
+    """Drop comments and collapse whitespace in the plan's static text
+    
+    Matches ``minify_tree`` for the DOM engine. Slots and filled values are
+    left as they are.
+    """
+    fragments: List[Union[str, Slot]] = []
+    preserve: List[str] = []  # Open elements whose text keeps its whitespace
+    for fragment in plan.fragments:
+        if not isinstance(fragment, str):
+            fragments.append(fragment)
+            continue
+        parts = []
+        for token in MARKUP_TOKEN.split(fragment):
+            if token.startswith('<!--'):
+                continue
+            if token.startswith('<'):
+                name = re.match(r'</?([a-zA-Z0-9]*)', token).group(1).lower()
+                if name in PRESERVE_WHITESPACE:
+                    if token.startswith('</'):
+                        if name in preserve:
+                            preserve.remove(name)
+                    elif not token.endswith('/>'):
+                        preserve.append(name)
+            elif not preserve:
+                token = WHITESPACE_RUN.sub(lambda m: '\n' if '\n' in m.group() else ' ', token)
+            parts.append(token)
+        fragments.append(''.join(parts))
+    return plan._replace(fragments=tuple(fragments))
+
+
+_PLAN_CACHE: Dict[Tuple[str, int, int, bool], TemplatePlan] = {}
+
+
+def compile_template(html_path: str, minify: bool = False) -> TemplatePlan:
+    """Compile (or fetch the cached plan for) a template file"""
+    abs_path = os.path.abspath(html_path)
+    stat = os.stat(abs_path)
+    cache_key = (abs_path, stat.st_mtime_ns, stat.st_size, minify)
+    plan = _PLAN_CACHE.get(cache_key)
+    if plan is None:
+        if minify:
+            plan = minify_plan(compile_template(html_path))
+        else:
+            with open(abs_path, 'r', encoding='utf-8') as f:
+                plan = compile_template_source(f.read(), abs_path)
+        _PLAN_CACHE[cache_key] = plan
+    return plan
+
+
+def lookup_plan_item(plan: TemplatePlan, section_index: int, item_code: str, item_title: str) -> Optional[Tuple[int, int]]:
+    """Resolve a TREC item to (section, position) the same way the DOM populator does"""
+    position = plan.item_index.get((section_index, item_code))
+    if position is None and section_index < len(plan.section_items):
+        positions = [plan.keyword_index[(section_index, kw)] for kw in title_keywords(item_title)
+                     if (section_index, kw) in plan.keyword_index]
+        if positions:
+            position = min(positions)
+        elif plan.section_items[section_index]:
+            position = 0
+    return None if position is None else (section_index, position)
+
+
+def format_metered(line_item: LineItem, metrics: Optional[Metrics]) -> str:
+    """format_line_item, timed and counted into ``metrics`` when given"""
+    if metrics is None:
+        return format_line_item(line_item)
+    with metrics.timer('comment_formatting'):
+        line_item_html = format_line_item(line_item)
+    count_line_item_output(metrics, line_item)
+    return line_item_html
+
+
+def item_slot_values(item_id: Tuple[int, int], line_items: Sequence[LineItem],
+                     metrics: Optional[Metrics] = None) -> Dict[tuple, Any]:
+    """Slot values for one TREC item from the line items mapped to it
+    
+    Includes ('section', n) when the item gives its section content.
+    """
+    values: Dict[tuple, Any] = {}
+    first, *additional = line_items
+
+    status = first.status
+    if status:
+        idx = STATUS_CHECKBOX_INDEX.get(status.upper(), -1)
+        if idx >= 0:
+            values[('check',) + item_id + (idx,)] = {'checked': 'checked'}
+            values[('section', item_id[0])] = True
+
+    fragments = []
+    first_html = format_metered(first, metrics)
+    if first_html:
+        fragments.append(first_html)
+        values[('comments',) + item_id] = {'style': COMMENTS_STYLE}
+        values[('inline',) + item_id] = {'style': COMMENTS_INLINE_STYLE}
+    for line_item in additional:
+        new_html = format_metered(line_item, metrics)
+        if new_html:
+            fragments += [ADDITIONAL_FINDING_SEPARATOR, new_html]
+    if fragments:
+        body = values[('comments_body',) + item_id] = ''.join(fragments)
+        if has_content(body):
+            values[('section', item_id[0])] = True
+    return values
+
+
+def header_slot_values(inspection: Inspection) -> Dict[tuple, Any]:
+    return {('header', field_id): {'value': str(value)}
+            for field_id, value in header_field_values(inspection).items()}
+
+
+def page_count_slot_values(plan: TemplatePlan) -> Dict[tuple, Any]:
+    page_count = {'value': str(plan.page_count)}
+    return {fragment.key: page_count for fragment in plan.fragments
+            if not isinstance(fragment, str) and fragment.key[0] == 'page_count'}
+
+
+def plan_slot_values(plan: TemplatePlan, inspection: InspectionSource,
+                     sections: Optional[Iterable[Section]] = None,
+                     metrics: Optional[Metrics] = None) -> Dict[tuple, Any]:
+    """Compute the replacement text for every filled slot
+    
+    ``sections`` overrides ``inspection.sections`` (e.g. a streaming iterator).
+    ``inspection`` may be a callable returning the Inspection, evaluated after
+    the sections have been consumed, for headers that follow the sections.
+    ``metrics`` collects the mapping and formatting timers and counters.
+    """
+    if sections is None:
+        sections = inspection.sections
+    groups = group_line_items(sections, lambda *args: lookup_plan_item(plan, *args), metrics)
+    if callable(inspection):
+        inspection = inspection()
+    
+    values = header_slot_values(inspection)
+    for group in groups.values():
+        values.update(item_slot_values(group['item'], group['line_items'], metrics))
+    values.update(page_count_slot_values(plan))
+    return values
+
+
+def render_slot(slot: Slot, value: Any) -> str:
+    """Text for a slot given its value (None keeps the template's text)"""
+    if value is None:
+        return slot.default
+    if isinstance(value, str):
+        return value
+    return render_starttag(slot.tag, slot.attrs, slot.self_closing, value)
+
+
+def iter_section_pruned(plan: TemplatePlan, chunks: Iterable[str],
+                        filled_sections: Optional[Set[int]]) -> Iterator[str]:
+    """Yield the chunk for each plan fragment, skipping the title and items of
+    sections not in ``filled_sections`` (None keeps every section)"""
+    skipping = False
+    for fragment, chunk in zip(plan.fragments, chunks):
+        if not isinstance(fragment, str):
+            kind = fragment.key[0]
+            if kind == 'section_start':
+                skipping = filled_sections is not None and fragment.key[1] not in filled_sections
+                continue
+            if kind == 'section_end':
+                skipping = False
+                continue
+        if not skipping:
+            yield chunk
+
+
+def filled_sections(values: Dict[tuple, Any]) -> Set[int]:
+    return {key[1] for key in values if key[0] == 'section'}
+
+
+def iter_render_plan(plan: TemplatePlan, inspection: InspectionSource,
+                     sections: Optional[Iterable[Section]] = None,
+                     prune_empty_sections: bool = False,
+                     metrics: Optional[Metrics] = None) -> Iterator[str]:
+    """Yield the populated report as a sequence of HTML chunks
+    
+    With ``prune_empty_sections`` the title and items of sections with no
+    checked status or comment text are never emitted, matching
+    ``CompleteTRECPopulator.remove_empty_sections``.
+    """
+    values = plan_slot_values(plan, inspection, sections, metrics)
+    chunks = (fragment if isinstance(fragment, str) else render_slot(fragment, values.get(fragment.key))
+              for fragment in plan.fragments)
+    yield from iter_section_pruned(plan, chunks, filled_sections(values) if prune_empty_sections else None)
+
+
+def render_plan(plan: TemplatePlan, inspection: InspectionSource,
+                sections: Optional[Iterable[Section]] = None,
+                prune_empty_sections: bool = False) -> str:
+    """Render a populated report from a compiled plan"""
+    return ''.join(iter_render_plan(plan, inspection, sections, prune_empty_sections))
+
+
+class IncrementalRenderer:
+    """Re-renders one inspection, reformatting only the TREC items whose line
+    items changed and splicing them into the previous output
+    
+    Line items are grouped per TREC item on every render (mapping lookups are
+    memoized); a group is re-rendered only when its line items differ by id
+    or value from the previous render. Output matches ``render_plan``.
+    """
+
+    def __init__(self, plan: TemplatePlan, prune_empty_sections: bool = False):
+        self.plan = plan
+        self.prune_empty_sections = prune_empty_sections
+        # Fragment positions of each slot, to splice re-rendered values in place
+        self.slot_positions: Dict[tuple, List[int]] = {}
+        for position, fragment in enumerate(plan.fragments):
+            if not isinstance(fragment, str):
+                self.slot_positions.setdefault(fragment.key, []).append(position)
+        self.chunks = [fragment if isinstance(fragment, str) else fragment.default
+                       for fragment in plan.fragments]
+        self.header_values: Dict[tuple, Any] = {}
+        # item id -> (line items, slot values) from the previous render
+        self.items: Dict[Tuple[int, int], Tuple[Tuple[LineItem, ...], Dict[tuple, Any]]] = {}
+        self.items_rendered = 0  # TREC items reformatted by the last render
+        self._splice({}, page_count_slot_values(plan))
+
+    def _splice(self, old_values: Dict[tuple, Any], new_values: Dict[tuple, Any]) -> None:
+        """Re-render the slots whose value changed between two value sets"""
+        for key in old_values.keys() | new_values.keys():
+            for position in self.slot_positions.get(key, ()):
+                self.chunks[position] = render_slot(self.plan.fragments[position], new_values.get(key))
+
+    def render(self, inspection: Inspection) -> str:
+        """Render ``inspection``, reusing everything unchanged since the last call"""
+        plan = self.plan
+        groups = group_line_items(inspection.sections, lambda *args: lookup_plan_item(plan, *args))
+
+        header_values = header_slot_values(inspection)
+        if header_values != self.header_values:
+            self._splice(self.header_values, header_values)
+            self.header_values = header_values
+
+        current = {group['item']: tuple(group['line_items']) for group in groups.values()}
+        self.items_rendered = 0
+        for item_id in current.keys() | self.items.keys():
+            line_items = current.get(item_id)
+            previous_items, previous_values = self.items.get(item_id, ((), {}))
+            if line_items == previous_items:
+                continue
+            values = item_slot_values(item_id, line_items) if line_items else {}
+            self._splice(previous_values, values)
+            if line_items:
+                self.items[item_id] = (line_items, values)
+            else:
+                del self.items[item_id]
+            self.items_rendered += 1
+
+        filled = None
+        if self.prune_empty_sections:
+            filled = set()
+            for _, values in self.items.values():
+                filled |= filled_sections(values)
+        return ''.join(iter_section_pruned(plan, self.chunks, filled))